@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -81,8 +82,61 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Production SQLite profile, applied to every new connection:
+            # WAL so readers never wait on the dispensing write path, a busy
+            # timeout instead of failing fast on contention, and a larger
+            # page cache / mmap window. IMMEDIATE takes the write lock at
+            # BEGIN, so a transaction can't deadlock upgrading from a read.
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA auto_vacuum=INCREMENTAL;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# Write views retry transactions that still hit "database is locked" after
+# busy_timeout, with jittered exponential backoff (see pharma.db.retry_on_lock).
+PHARMA_LOCK_RETRY_ATTEMPTS = 5
+PHARMA_LOCK_RETRY_DELAY = 0.05  # seconds; doubled per attempt
+
+# Stored responses for requests sent with an Idempotency-Key header are
+# replayed to retries for this long (see pharma.idempotency).
+PHARMA_IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# Computed AI analytics are cached per endpoint and parameters under a data
+# version that every stock movement or catalog edit bumps (see
+# pharma.ai_cache). Local memory is per process: with several workers use a
+# shared backend (file, Redis, memcached) so a bump reaches all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 256},
     }
 }
+PHARMA_AI_CACHE_TIMEOUT = 300  # seconds
+
+# Comprehensive insights are precomputed into InsightSnapshot rows and served
+# from the newest one (see pharma.insights). A snapshot is stale once it is
+# older than MAX_AGE or MAX_MOVEMENTS ledger rows were posted after it; a
+# stale read kicks off a refresh in a background thread unless
+# BACKGROUND_REFRESH is off (e.g. when `manage.py precompute_insights` runs).
+# The newest SNAPSHOTS_KEPT snapshots keep their full payload; older ones
+# keep only metrics and per-SKU forecasts as history for HISTORY_DAYS,
+# thinned to one snapshot per hour past a day and one per day past a week.
+PHARMA_INSIGHTS_MAX_AGE = timedelta(minutes=5)
+PHARMA_INSIGHTS_MAX_MOVEMENTS = 50
+PHARMA_INSIGHTS_BACKGROUND_REFRESH = True
+PHARMA_INSIGHT_SNAPSHOTS_KEPT = 24
+PHARMA_INSIGHT_HISTORY_DAYS = 90
 
 
 # Password validation
@@ -144,6 +198,17 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Pharma inventory
+# Number of delta rows per product when a high-velocity SKU is switched to
+# sharded stock counters (see `manage.py inventory_shards`).
+PHARMA_INVENTORY_SHARDS = 8
+
+# Catalog-wide forecasts with more than PHARMA_AI_SHARD_SIZE SKUs are split
+# into shards of that many rows and run on PHARMA_AI_WORKERS processes
+# (see pharma.parallel). 1 keeps everything in the request process.
+PHARMA_AI_WORKERS = 1
+PHARMA_AI_SHARD_SIZE = 5000
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 CORS_ALLOW_CREDENTIALS = True
@@ -32,7 +32,7 @@ class ProductAdmin(admin.ModelAdmin):
     
     def current_stock(self, obj):
         try:
-            return obj.inventory.quantity
+            return obj.inventory.on_hand
         except Inventory.DoesNotExist:
             return 0
     current_stock.short_description = 'Current Stock'
@@ -67,3 +67,10 @@ class TransactionAdmin(admin.ModelAdmin):
     search_fields = ['product__name', 'product__sku', 'reference', 'notes']
     ordering = ['-created_at']
     readonly_fields = ['created_at']
+
+    # Append-only ledger: new movements can be posted, posted ones stay as they are
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
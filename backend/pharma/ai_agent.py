@@ -1,13 +1,17 @@
 import numpy as np
-import pandas as pd
 from datetime import datetime, timedelta
 from django.db.models import Sum, Count, Avg, Q, F
+from django.conf import settings
 from django.utils import timezone
-from .models import Product, Inventory, Transaction, Category, Supplier
+from .models import Product, Inventory, Transaction, Category, Supplier, DailyProductSales, ProductDemandStats
+from . import forecasting, parallel, trends
+from .analytics import AnalyticsContext
+from .forecasting import DemandMatrix, current_stock
 import json
 import random
 from typing import Dict, List, Tuple, Optional
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -17,43 +21,58 @@ class PharmacyAIAgent:
     Provides intelligent insights, forecasting, and recommendations
     """
     
-    def __init__(self):
+    # optimize_inventory recommendation classes, by index
+    STOCK_RECOMMENDATIONS = (
+        "URGENT: Reorder immediately",
+        "Consider reordering soon",
+        "Stock level is high - consider reducing orders",
+        "Stock level is optimal",
+    )
+    
+    def __init__(self, workers: Optional[int] = None, shard_size: Optional[int] = None):
         self.forecast_horizon = 30  # days
         self.confidence_level = 0.95
+        # Process-pool fan-out for large catalogs (see pharma.parallel)
+        self.workers = workers or getattr(settings, 'PHARMA_AI_WORKERS', 1)
+        self.shard_size = shard_size or getattr(settings, 'PHARMA_AI_SHARD_SIZE', 5000)
+        self.timing = {}
         
-    def get_system_health_score(self) -> Dict:
+    def get_system_health_score(self, context: Optional[AnalyticsContext] = None) -> Dict:
         """
         Calculate overall system health score based on multiple factors
         """
         try:
-            # Get basic metrics
-            total_products = Product.objects.count()
-            low_stock_products = 0
-            out_of_stock_products = 0
-            
-            # Check each product's inventory
-            for product in Product.objects.all():
-                try:
-                    inventory = product.inventory
-                    if inventory.quantity <= product.reorder_level:
-                        low_stock_products += 1
-                    if inventory.quantity == 0:
-                        out_of_stock_products += 1
-                except Inventory.DoesNotExist:
-                    out_of_stock_products += 1  # No inventory record means out of stock
+            context = context or AnalyticsContext()
+            # One conditional aggregate over Product LEFT JOIN Inventory, by category
+            by_category = context.health_by_category
+            total_products = sum(row['total'] for row in by_category)
+            low_stock_products = sum(row['low'] for row in by_category)
+            out_of_stock_products = sum(row['out'] for row in by_category)
             
             # Calculate health score (0-100)
-            stock_health = max(0, 100 - (low_stock_products / total_products * 100)) if total_products > 0 else 100
-            availability_health = max(0, 100 - (out_of_stock_products / total_products * 100)) if total_products > 0 else 100
+            stock_health, availability_health = self._stock_health(
+                total_products, low_stock_products, out_of_stock_products
+            )
             
             # Get recent transaction activity
-            recent_transactions = Transaction.objects.filter(
-                created_at__gte=timezone.now() - timedelta(days=7)
-            ).count()
+            recent_transactions = context.recent_activity
             activity_health = min(100, recent_transactions * 10)  # Scale based on activity
             
             overall_health = (stock_health * 0.4 + availability_health * 0.4 + activity_health * 0.2)
             
+            category_breakdown = []
+            for row in by_category:
+                category_stock, category_availability = self._stock_health(row['total'], row['low'], row['out'])
+                category_breakdown.append({
+                    'category_id': row['category_id'],
+                    'category_name': row['category__name'],
+                    'total_products': row['total'],
+                    'low_stock_count': row['low'],
+                    'out_of_stock_count': row['out'],
+                    'stock_health': round(category_stock, 1),
+                    'availability_health': round(category_availability, 1),
+                })
+            
             return {
                 'overall_score': round(overall_health, 1),
                 'stock_health': round(stock_health, 1),
@@ -63,12 +82,19 @@ class PharmacyAIAgent:
                 'low_stock_count': low_stock_products,
                 'out_of_stock_count': out_of_stock_products,
                 'recent_activity': recent_transactions,
-                'status': self._get_health_status(overall_health)
+                'status': self._get_health_status(overall_health),
+                'category_breakdown': category_breakdown
             }
         except Exception as e:
             logger.error(f"Error calculating system health: {e}")
             return {'error': str(e)}
     
+    def _stock_health(self, total: int, low: int, out: int) -> Tuple[float, float]:
+        """Stock and availability health (0-100) from low/out-of-stock counts"""
+        if total == 0:
+            return 100, 100
+        return max(0, 100 - (low / total * 100)), max(0, 100 - (out / total * 100))
+    
     def _get_health_status(self, score: float) -> str:
         """Get health status based on score"""
         if score >= 90:
@@ -80,7 +106,8 @@ class PharmacyAIAgent:
         else:
             return "Needs Attention"
     
-    def forecast_demand(self, product_id: int = None, days: int = 30) -> Dict:
+    def forecast_demand(self, product_id: int = None, days: int = 30,
+                        context: Optional[AnalyticsContext] = None) -> Dict:
         """
         Forecast product demand using historical transaction data
         """
@@ -90,102 +117,173 @@ class PharmacyAIAgent:
                 return self._forecast_single_product(product_id, days)
             else:
                 # Forecast for all products
-                return self._forecast_all_products(days)
+                return self._forecast_all_products(days, context)
         except Exception as e:
             logger.error(f"Error in demand forecasting: {e}")
             return {'error': str(e)}
     
     def _forecast_single_product(self, product_id: int, days: int) -> Dict:
-        """Forecast demand for a single product"""
+        """Forecast demand for a single product from its running demand statistics"""
         try:
-            # Get historical transaction data
-            transactions = Transaction.objects.filter(
-                product=product_id,
-                transaction_type='OUT',
-                created_at__gte=timezone.now() - timedelta(days=90)
-            ).order_by('created_at')
-            
-            if not transactions.exists():
+            forecast = self._forecast_online(days, [product_id])[1].get(product_id)
+            if forecast is None:
                 return {'error': 'Insufficient historical data for forecasting'}
-            
-            # Calculate daily demand
-            daily_demand = {}
-            for transaction in transactions:
-                date = transaction.created_at.date()
-                daily_demand[date] = daily_demand.get(date, 0) + transaction.quantity
-            
-            # Calculate average daily demand
-            avg_daily_demand = sum(daily_demand.values()) / len(daily_demand)
-            
-            # Calculate demand variability
-            demand_values = list(daily_demand.values())
-            demand_std = np.std(demand_values) if len(demand_values) > 1 else 0
-            
-            # Generate forecast
-            forecast_demand = avg_daily_demand * days
-            confidence_interval = demand_std * np.sqrt(days) * 1.96  # 95% confidence
-            
-            # Get current stock
-            current_stock = Inventory.objects.filter(product=product_id).first()
-            current_quantity = current_stock.quantity if current_stock else 0
-            
-            # Calculate stockout risk
-            stockout_risk = self._calculate_stockout_risk(
-                current_quantity, forecast_demand, demand_std, days
-            )
-            
-            return {
-                'product_id': product_id,
-                'forecast_period_days': days,
-                'forecasted_demand': round(forecast_demand, 2),
-                'confidence_interval': round(confidence_interval, 2),
-                'avg_daily_demand': round(avg_daily_demand, 2),
-                'demand_volatility': round(demand_std, 2),
-                'current_stock': current_quantity,
-                'stockout_risk': round(stockout_risk, 2),
-                'recommended_reorder_quantity': max(0, round(forecast_demand - current_quantity, 2)),
-                'confidence_level': '95%'
-            }
+            forecast.pop('product_name')
+            forecast.pop('sku')
+            return forecast
         except Exception as e:
             logger.error(f"Error forecasting single product: {e}")
             return {'error': str(e)}
     
-    def _forecast_all_products(self, days: int) -> Dict:
+    def _forecast_all_products(self, days: int, context: Optional[AnalyticsContext] = None) -> Dict:
         """Forecast demand for all products"""
         try:
-            products = Product.objects.all()
-            forecasts = {}
-            
-            for product in products:
-                forecast = self._forecast_single_product(product.id, days)
-                if 'error' not in forecast:
-                    forecasts[product.id] = {
-                        'product_name': product.name,
-                        'sku': product.sku,
-                        **forecast
-                    }
+            forecasts = self._forecast_products(days, context=context)
             
             return {
                 'forecast_period_days': days,
                 'total_products_forecasted': len(forecasts),
                 'forecasts': forecasts,
-                'summary': self._generate_forecast_summary(forecasts)
+                'summary': self._generate_forecast_summary(forecasts),
+                'timing': self.timing
             }
         except Exception as e:
             logger.error(f"Error forecasting all products: {e}")
             return {'error': str(e)}
     
-    def _calculate_stockout_risk(self, current_stock: int, forecast_demand: float, 
-                                demand_std: float, days: int) -> float:
-        """Calculate probability of stockout"""
-        if demand_std == 0:
-            return 1.0 if current_stock < forecast_demand else 0.0
+    def _forecast_products(self, days: int, context: Optional[AnalyticsContext] = None) -> Dict[int, Dict]:
+        """
+        Batched catalog-wide forecast from the context's products x days
+        demand matrix; the statistics are array operations over all
+        products at once. Products without sales in the history window are
+        left out.
+        """
+        demand, products, stats = self._forecast_arrays(days, context)
+        stats = {name: values.tolist() for name, values in stats.items()}
         
-        # Using normal distribution approximation
-        z_score = (current_stock - forecast_demand) / (demand_std * np.sqrt(days))
-        from scipy.stats import norm
-        stockout_probability = 1 - norm.cdf(z_score)
-        return stockout_probability
+        return {pid: self._forecast_entry(pid, product, stats, demand.index(pid), days)
+                for pid, product in products.items()}
+    
+    def _forecast_online(self, days: int, product_ids) -> Tuple[Dict[int, Dict], Dict[int, Dict]]:
+        """
+        Forecast from the running demand statistics (ProductDemandStats)
+        instead of history: two queries and one array pass for any number
+        of products. `product_ids` may be a list or a Product queryset.
+        Returns the current_stock() metadata of every matched product and
+        the forecasts of those with sales history.
+        """
+        products = current_stock(product_ids)
+        running = {row.pk: row.as_of() for row in ProductDemandStats.objects.filter(pk__in=product_ids)}
+        ids = [pid for pid in products if pid in running and running[pid]['days']]
+        stats = forecasting.forecast_from_stats(
+            np.array([running[pid]['rate_30'] for pid in ids], dtype=float),
+            np.array([running[pid]['std'] for pid in ids], dtype=float),
+            np.array([products[pid]['on_hand'] for pid in ids], dtype=float),
+            days,
+        )
+        stats = {name: values.tolist() for name, values in stats.items()}
+        return products, {pid: self._forecast_entry(pid, products[pid], stats, i, days) for i, pid in enumerate(ids)}
+    
+    def product_recommendations(self, product_ids, days: int = 30) -> Dict[int, Dict]:
+        """
+        Forecast and recommendations for many products in one batched pass,
+        keyed by product id in name order. Products without sales history
+        get an error entry instead.
+        """
+        products, forecasts = self._forecast_online(days, product_ids)
+        results = {}
+        for pid in products:
+            forecast = forecasts.get(pid)
+            if forecast is None:
+                results[pid] = {'product_id': pid, 'error': 'Insufficient historical data for forecasting'}
+                continue
+            recommendations = self._product_recommendations(forecast)
+            risk = forecast['stockout_risk']
+            results[pid] = {
+                'product_id': pid,
+                'forecast': forecast,
+                'recommendations': recommendations,
+                'summary': {
+                    'total_recommendations': len(recommendations),
+                    'high_priority_count': len([r for r in recommendations if r['priority'] == 'high']),
+                    'risk_level': 'high' if risk > 0.3 else 'medium' if risk > 0.1 else 'low'
+                }
+            }
+        return results
+    
+    def _product_recommendations(self, forecast: Dict) -> List[Dict]:
+        """Recommendation rules for one product's forecast"""
+        recommendations = []
+        
+        if forecast['stockout_risk'] > 0.3:
+            recommendations.append({
+                'type': 'high_risk',
+                'message': 'High stockout risk detected',
+                'action': 'Consider immediate reorder',
+                'priority': 'high'
+            })
+        
+        if forecast['current_stock'] < forecast['avg_daily_demand'] * 7:
+            recommendations.append({
+                'type': 'low_stock',
+                'message': 'Less than 1 week of stock remaining',
+                'action': 'Monitor closely and reorder soon',
+                'priority': 'medium'
+            })
+        
+        if forecast['demand_volatility'] > 5:
+            recommendations.append({
+                'type': 'volatile_demand',
+                'message': 'High demand volatility detected',
+                'action': 'Consider increasing safety stock',
+                'priority': 'medium'
+            })
+        
+        return recommendations
+    
+    def _forecast_entry(self, pid: int, product: Dict, stats: Dict, i: int, days: int) -> Dict:
+        """One product's forecast from row i of the forecast arrays (as lists)"""
+        forecasted = stats['forecasted_demand'][i]
+        return {
+            'product_name': product['name'],
+            'sku': product['sku'],
+            'product_id': pid,
+            'forecast_period_days': days,
+            'model': stats['model'][i],
+            'forecasted_demand': round(forecasted, 2),
+            'confidence_interval': round(stats['confidence_interval'][i], 2),
+            'avg_daily_demand': round(stats['avg_daily_demand'][i], 2),
+            'demand_volatility': round(stats['demand_volatility'][i], 2),
+            'current_stock': product['on_hand'],
+            'stockout_risk': round(stats['stockout_risk'][i], 2),
+            'recommended_reorder_quantity': max(0, round(forecasted - product['on_hand'], 2)),
+            'confidence_level': '95%'
+        }
+    
+    def _forecast_arrays(self, days: int, context: Optional[AnalyticsContext] = None):
+        """
+        Demand matrix, product/stock metadata for its rows, and the forecast
+        arrays (aligned with demand.product_ids) shared by forecasting and
+        inventory optimization, all read from the context.
+        """
+        context = context or AnalyticsContext()
+        demand = context.demand
+        products = {pid: p for pid, p in context.products.items() if demand.index(pid) is not None}
+        ids = demand.product_ids.tolist()
+        stock = np.array([products[pid]['on_hand'] for pid in ids], dtype=float)
+        return demand, products, self._run_forecast(demand, stock, days)
+    
+    def _run_forecast(self, demand: DemandMatrix, stock: np.ndarray, days: int) -> Dict:
+        """forecasting.forecast, fanned out to worker processes for large catalogs; records self.timing"""
+        if self.workers > 1 and len(demand) > self.shard_size:
+            stats, self.timing = parallel.forecast(demand, stock, days, self.workers, self.shard_size)
+            return stats
+        started = time.perf_counter()
+        stats = forecasting.forecast(demand, stock, days)
+        elapsed = round(time.perf_counter() - started, 4)
+        self.timing = {'workers': 1, 'shards': 1, 'wall_seconds': elapsed, 'cpu_seconds': elapsed,
+                       'estimated_speedup': 1.0, 'parallel_efficiency': 1.0}
+        return stats
     
     def _generate_forecast_summary(self, forecasts: Dict) -> Dict:
         """Generate summary statistics for all forecasts"""
@@ -217,181 +315,163 @@ class PharmacyAIAgent:
         
         return recommendations
     
-    def optimize_inventory(self) -> Dict:
+    def optimize_inventory(self, context: Optional[AnalyticsContext] = None) -> Dict:
         """
         Provide inventory optimization recommendations
         """
         try:
-            products = Product.objects.all()
-            optimization_data = []
+            # Same demand matrix and forecast arrays as forecast_demand; every
+            # per-SKU figure below is one array operation over all products
+            demand, products, stats = self._forecast_arrays(30, context)
+            ids = demand.product_ids.tolist()
+            rows = [products[pid] for pid in ids]
+            on_hand = np.array([p['on_hand'] for p in rows], dtype=float)
+            reorder_level = np.array([p['reorder_level'] for p in rows], dtype=float)
+            unit_price = np.array([float(p['unit_price']) for p in rows])
+            
+            optimal = forecasting.optimal_stock(
+                np.round(stats['avg_daily_demand'], 2),
+                np.round(stats['demand_volatility'], 2),
+                reorder_level,
+            )
+            holding = np.round(forecasting.holding_cost(on_hand, unit_price), 2)
+            recommendation = np.select(
+                [on_hand <= reorder_level, on_hand < optimal * 0.8, on_hand > optimal * 1.5],
+                [0, 1, 2], default=3,
+            )
+            risk = np.round(stats['stockout_risk'], 2)
             
-            for product in products:
-                inventory = Inventory.objects.filter(product=product).first()
-                if not inventory:
-                    continue
-                
-                # Get demand forecast
-                forecast = self._forecast_single_product(product.id, 30)
-                if 'error' in forecast:
+            optimization_data = []
+            urgent_reorders = high_holding_costs = 0
+            total_holding_cost = 0.0
+            for pid, product in products.items():
+                i = demand.index(pid)
+                if not product['has_inventory']:
                     continue
-                
-                # Calculate optimal stock levels
-                optimal_stock = self._calculate_optimal_stock(
-                    forecast['avg_daily_demand'],
-                    forecast['demand_volatility'],
-                    product.reorder_level
-                )
-                
-                # Calculate holding cost
-                holding_cost = self._calculate_holding_cost(
-                    inventory.quantity,
-                    product.unit_price
-                )
-                
                 optimization_data.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'sku': product.sku,
-                    'current_stock': inventory.quantity,
-                    'optimal_stock': round(optimal_stock, 2),
-                    'reorder_level': product.reorder_level,
-                    'holding_cost': round(holding_cost, 2),
-                    'stockout_risk': forecast.get('stockout_risk', 0),
-                    'recommendation': self._get_stock_recommendation(
-                        inventory.quantity, optimal_stock, product.reorder_level
-                    )
+                    'product_id': pid,
+                    'product_name': product['name'],
+                    'sku': product['sku'],
+                    'current_stock': product['on_hand'],
+                    'optimal_stock': round(float(optimal[i]), 2),
+                    'reorder_level': product['reorder_level'],
+                    'holding_cost': float(holding[i]),
+                    'stockout_risk': float(risk[i]),
+                    'recommendation': self.STOCK_RECOMMENDATIONS[recommendation[i]]
                 })
+                urgent_reorders += recommendation[i] == 0
+                high_holding_costs += holding[i] > 10
+                total_holding_cost += holding[i]
             
             return {
                 'total_products_analyzed': len(optimization_data),
                 'optimization_data': optimization_data,
-                'summary': self._generate_optimization_summary(optimization_data)
+                'summary': {
+                    'urgent_reorders_needed': int(urgent_reorders),
+                    'high_holding_cost_products': int(high_holding_costs),
+                    'total_daily_holding_cost': round(float(total_holding_cost), 2),
+                    'potential_savings': round(float(total_holding_cost) * 0.2, 2)  # 20% potential savings
+                },
+                'timing': self.timing
             }
         except Exception as e:
             logger.error(f"Error in inventory optimization: {e}")
             return {'error': str(e)}
     
-    def _calculate_optimal_stock(self, avg_demand: float, demand_std: float, 
-                                reorder_level: int) -> float:
-        """Calculate optimal stock level using safety stock formula"""
-        # Safety stock = Z * σ * √(lead_time)
-        # Assuming 7 days lead time
-        lead_time = 7
-        safety_stock = 1.96 * demand_std * np.sqrt(lead_time)  # 95% service level
-        cycle_stock = avg_demand * lead_time / 2
-        optimal_stock = safety_stock + cycle_stock
-        return max(optimal_stock, reorder_level)
-    
-    def _calculate_holding_cost(self, quantity: int, unit_price) -> float:
-        """Calculate annual holding cost (assuming 20% annual holding cost rate)"""
-        annual_rate = 0.20
-        # Convert Decimal to float if needed
-        unit_price_float = float(unit_price)
-        return quantity * unit_price_float * annual_rate / 365  # Daily holding cost
-    
-    def _get_stock_recommendation(self, current_stock: int, optimal_stock: float, 
-                                 reorder_level: int) -> str:
-        """Get stock level recommendation"""
-        if current_stock <= reorder_level:
-            return "URGENT: Reorder immediately"
-        elif current_stock < optimal_stock * 0.8:
-            return "Consider reordering soon"
-        elif current_stock > optimal_stock * 1.5:
-            return "Stock level is high - consider reducing orders"
-        else:
-            return "Stock level is optimal"
-    
-    def _generate_optimization_summary(self, optimization_data: List[Dict]) -> Dict:
-        """Generate optimization summary"""
-        urgent_reorders = len([d for d in optimization_data if 'URGENT' in d['recommendation']])
-        high_holding_costs = len([d for d in optimization_data if d['holding_cost'] > 10])
-        total_holding_cost = sum(d['holding_cost'] for d in optimization_data)
-        
-        return {
-            'urgent_reorders_needed': urgent_reorders,
-            'high_holding_cost_products': high_holding_costs,
-            'total_daily_holding_cost': round(total_holding_cost, 2),
-            'potential_savings': round(total_holding_cost * 0.2, 2)  # 20% potential savings
-        }
-    
-    def predict_sales_trends(self, days: int = 30) -> Dict:
+    def predict_sales_trends(self, days: int = 30, context: Optional[AnalyticsContext] = None,
+                             granularity: str = 'day', window: Optional[int] = None,
+                             group_by: Optional[str] = None) -> Dict:
         """
-        Predict sales trends and patterns
+        Predict sales trends and patterns over hourly, daily or weekly
+        buckets, optionally per category or supplier. `days` is the
+        prediction horizon; `window` is the number of buckets of history
+        (default: twice the horizon).
         """
         try:
-            # Get historical sales data
-            end_date = timezone.now()
-            start_date = end_date - timedelta(days=days * 2)  # Get more data for analysis
-            
-            transactions = Transaction.objects.filter(
-                transaction_type='OUT',
-                created_at__gte=start_date,
-                created_at__lte=end_date
-            ).order_by('created_at')
-            
-            if not transactions.exists():
-                return {'error': 'Insufficient sales data for trend analysis'}
-            
-            # Group by date and calculate daily sales
-            daily_sales = {}
-            for transaction in transactions:
-                date = transaction.created_at.date()
-                # Calculate total amount for this transaction
-                total_amount = float(transaction.quantity * transaction.unit_price) if transaction.unit_price else 0
-                daily_sales[date] = daily_sales.get(date, 0) + total_amount
-            
-            # Calculate trend
-            dates = sorted(daily_sales.keys())
-            sales_values = [daily_sales[date] for date in dates]
-            
-            if len(sales_values) < 2:
+            if granularity not in trends.BUCKET_LENGTH:
+                return {'error': f"Unknown granularity '{granularity}'; use hour, day or week"}
+            if group_by is not None and group_by not in trends.GROUP_FIELDS:
+                return {'error': f"Unknown group_by '{group_by}'; use category or supplier"}
+            bucket_days = trends.BUCKET_LENGTH[granularity] / timedelta(days=1)
+            horizon = max(1, round(days / bucket_days))
+            window = window or 2 * horizon
+            if window < 2:
                 return {'error': 'Insufficient data points for trend analysis'}
             
-            # Simple linear trend
-            x = np.arange(len(sales_values))
-            trend_coefficient = np.polyfit(x, sales_values, 1)[0]
-            
-            # Calculate growth rate
-            if sales_values[0] > 0:
-                growth_rate = ((sales_values[-1] - sales_values[0]) / sales_values[0]) * 100
+            if granularity == 'day' and not group_by and context is not None and context.covers(window):
+                # Daily buckets are already loaded in the shared insights read
+                keys = [context.end - timedelta(days=i) for i in range(window - 1, -1, -1)]
+                daily = context.daily_sales(keys[0], keys[-1])
+                index = {key: i for i, key in enumerate(keys)}
+                series = {None: {'revenue': np.zeros(window), 'units': np.zeros(window), 'sales': np.zeros(window)}}
+                for row in daily:
+                    series[None]['revenue'][index[row['date']]] = float(row['revenue'])
+                    series[None]['units'][index[row['date']]] = row['units']
+                    series[None]['sales'][index[row['date']]] = row['sales']
+                day_of_week_sales = self._calculate_day_of_week_pattern(daily)
             else:
-                growth_rate = 0
-            
-            # Predict future sales
-            future_days = np.arange(len(sales_values), len(sales_values) + days)
-            predicted_sales = np.polyval(np.polyfit(x, sales_values, 1), future_days)
+                # Bucketed in SQL; only the bucket series come back
+                keys, series = trends.sales_series(granularity, window, group_by)
+                day_of_week_sales = trends.weekday_pattern(granularity, window)
             
-            # Calculate seasonality (day of week patterns)
-            day_of_week_sales = self._calculate_day_of_week_pattern(transactions)
+            totals = {name: sum(group[name] for group in series.values()) if series else np.zeros(window)
+                      for name in ('revenue', 'units', 'sales')}
+            if not totals['revenue'].any():
+                return {'error': 'Insufficient sales data for trend analysis'}
             
-            return {
+            result = {
                 'analysis_period_days': days,
-                'trend_direction': 'increasing' if trend_coefficient > 0 else 'decreasing',
-                'trend_strength': abs(trend_coefficient),
-                'growth_rate_percent': round(growth_rate, 2),
-                'average_daily_sales': round(np.mean(sales_values), 2),
-                'sales_volatility': round(np.std(sales_values), 2),
-                'predicted_sales_next_period': round(sum(predicted_sales), 2),
+                'granularity': granularity,
+                'window': window,
+                **self._trend_summary(totals, horizon, window * bucket_days),
                 'day_of_week_pattern': day_of_week_sales,
-                'recommendations': self._generate_sales_recommendations(
-                    trend_coefficient, growth_rate, day_of_week_sales
-                )
+                'series': [{
+                    'bucket': key.isoformat(),
+                    'revenue': round(float(totals['revenue'][i]), 2),
+                    'units': int(totals['units'][i]),
+                    'sales': int(totals['sales'][i]),
+                } for i, key in enumerate(keys)],
             }
+            slope = result['trend_strength'] * (1 if result['trend_direction'] == 'increasing' else -1)
+            result['recommendations'] = self._generate_sales_recommendations(
+                slope, result['growth_rate_percent'], day_of_week_sales
+            )
+            if group_by:
+                result['group_by'] = group_by
+                result['groups'] = {
+                    (name or 'Unassigned'): self._trend_summary(group, horizon, window * bucket_days)
+                    for name, group in sorted(series.items(), key=lambda item: item[0] or '')
+                }
+            return result
         except Exception as e:
             logger.error(f"Error in sales trend prediction: {e}")
             return {'error': str(e)}
     
-    def _calculate_day_of_week_pattern(self, transactions) -> Dict:
-        """Calculate sales patterns by day of week"""
+    def _trend_summary(self, series: Dict, horizon: int, period_days: float) -> Dict:
+        """Fitted trend and totals for one bucketed revenue/units/sales series"""
+        revenue = series['revenue']
+        slope, growth, projected = trends.fit_trend(revenue, horizon)
+        return {
+            'trend_direction': 'increasing' if slope > 0 else 'decreasing',
+            'trend_strength': abs(slope),
+            'growth_rate_percent': round(growth, 2),
+            'average_daily_sales': round(float(revenue.sum()) / period_days, 2),
+            'sales_volatility': round(float(np.std(revenue)), 2),
+            'predicted_sales_next_period': round(projected, 2),
+            'total_revenue': round(float(revenue.sum()), 2),
+            'total_units': int(series['units'].sum()),
+            'total_sales': int(series['sales'].sum()),
+        }
+    
+    def _calculate_day_of_week_pattern(self, daily_sales: List[Dict]) -> Dict:
+        """Calculate average sale value by day of week from daily rollup rows"""
         day_sales = {i: 0 for i in range(7)}
         day_counts = {i: 0 for i in range(7)}
         
-        for transaction in transactions:
-            day = transaction.created_at.weekday()
-            # Calculate total amount for this transaction
-            total_amount = float(transaction.quantity * transaction.unit_price) if transaction.unit_price else 0
-            day_sales[day] += total_amount
-            day_counts[day] += 1
+        for row in daily_sales:
+            day = row['date'].weekday()
+            day_sales[day] += float(row['revenue'])
+            day_counts[day] += row['sales']
         
         day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
         pattern = {}
@@ -428,11 +508,13 @@ class PharmacyAIAgent:
         Get comprehensive AI insights for the pharmacy
         """
         try:
+            # One context: every sub-analysis reads the same loaded history
+            context = AnalyticsContext(trend_days=30)
             insights = {
-                'system_health': self.get_system_health_score(),
-                'demand_forecast': self.forecast_demand(days=30),
-                'inventory_optimization': self.optimize_inventory(),
-                'sales_trends': self.predict_sales_trends(days=30),
+                'system_health': self.get_system_health_score(context),
+                'demand_forecast': self.forecast_demand(days=30, context=context),
+                'inventory_optimization': self.optimize_inventory(context),
+                'sales_trends': self.predict_sales_trends(days=30, context=context),
                 'generated_at': timezone.now().isoformat(),
                 'ai_version': '1.0.0'
             }
@@ -0,0 +1,51 @@
+"""
+Versioned result cache for the AI analytics endpoints. Entries are keyed by
+endpoint, parameters and a global data version; writes to the ledger, stock
+or catalog bump the version (see receivers), so stale results are never
+read again and simply age out of the bounded cache.
+"""
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+
+VERSION_KEY = 'pharma:ai:data-version'
+
+
+def data_version():
+    # Seeded from the clock rather than 0 so a culled or flushed counter
+    # never comes back as a version some cached entry was stored under
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_data_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def cached_result(endpoint, compute, **params):
+    """
+    Return (result, info) for `compute()`, served from the cache when this
+    endpoint and parameters were already computed at the current data
+    version. `info` reports {hit, age_seconds, data_version}. Results with
+    an 'error' key are not cached.
+    """
+    version = data_version()
+    key = f"pharma:ai:{endpoint}:{version}:{urlencode(sorted(params.items()))}"
+    entry = cache.get(key)
+    if entry is not None:
+        computed_at, result = entry
+        return result, {'hit': True, 'age_seconds': round(time.time() - computed_at, 3),
+                        'data_version': version}
+
+    result = compute()
+    if 'error' not in result:
+        cache.set(key, (time.time(), result), getattr(settings, 'PHARMA_AI_CACHE_TIMEOUT', 300))
+    return result, {'hit': False, 'age_seconds': 0.0, 'data_version': version}
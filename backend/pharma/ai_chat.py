@@ -1,7 +1,7 @@
 from datetime import timedelta
-from django.db.models import Sum, Count, F
+from django.db.models import Sum, Count, Q
 from django.utils import timezone
-from .models import Product, Inventory, Transaction, Category
+from .models import Product, Category, DailyProductSales, ProductStockStatus
 import random
 
 
@@ -72,7 +72,7 @@ class PharmacyAIChat:
     
     def _generate_greeting(self):
         total_products = Product.objects.count()
-        low_stock_count = Inventory.objects.filter(quantity__lte=F('product__reorder_level')).count()
+        low_stock_count = ProductStockStatus.objects.filter(is_low=True).count()
         
         greeting = f"Hello! I'm your AI pharmacy assistant. You have {total_products} products in your system"
         if low_stock_count > 0:
@@ -96,12 +96,17 @@ class PharmacyAIChat:
     
     def _generate_inventory_response(self):
         total_products = Product.objects.count()
-        low_stock_products = Inventory.objects.filter(quantity__lte=F('product__reorder_level')).count()
-        out_of_stock_products = Inventory.objects.filter(quantity=0).count()
-        total_inventory_value = sum(inv.total_value for inv in Inventory.objects.all())
+        status = ProductStockStatus.objects.aggregate(
+            low=Count('pk', filter=Q(is_low=True)),
+            out=Count('pk', filter=Q(is_out=True)),
+            value=Sum('stock_value'),
+        )
+        low_stock_products = status['low']
+        out_of_stock_products = status['out']
+        total_inventory_value = status['value'] or 0
         
-        low_stock_items = Inventory.objects.filter(
-            quantity__lte=F('product__reorder_level')
+        low_stock_items = ProductStockStatus.objects.filter(
+            is_low=True
         ).select_related('product').order_by('quantity')[:5]
         
         message = f"Inventory Status Overview:\n"
@@ -121,19 +126,19 @@ class PharmacyAIChat:
         }
     
     def _generate_sales_response(self):
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        transactions = Transaction.objects.filter(
-            created_at__gte=thirty_days_ago,
-            transaction_type='OUT'
-        )
+        thirty_days_ago = timezone.localdate() - timedelta(days=30)
+        rollup = DailyProductSales.objects.filter(date__gte=thirty_days_ago, out_count__gt=0)
         
-        total_sales = transactions.count()
-        total_revenue = sum(t.quantity * t.unit_price for t in transactions if t.unit_price)
-        total_quantity_sold = sum(abs(t.quantity) for t in transactions)
+        totals = rollup.aggregate(
+            sales=Sum('out_count'), revenue=Sum('revenue'), quantity=Sum('qty_out')
+        )
+        total_sales = totals['sales'] or 0
+        total_revenue = totals['revenue'] or 0
+        total_quantity_sold = totals['quantity'] or 0
         
-        top_products = transactions.values('product__name').annotate(
-            total_quantity=Sum('quantity'),
-            total_revenue=Sum(F('quantity') * F('unit_price'))
+        top_products = rollup.values('product__name').annotate(
+            total_quantity=Sum('qty_out'),
+            total_revenue=Sum('revenue')
         ).order_by('-total_quantity')[:5]
         
         message = f"Sales Analysis (Last 30 days):\n"
@@ -176,8 +181,12 @@ class PharmacyAIChat:
     
     def _generate_health_response(self):
         total_products = Product.objects.count()
-        low_stock_count = Inventory.objects.filter(quantity__lte=F('product__reorder_level')).count()
-        out_of_stock_count = Inventory.objects.filter(quantity=0).count()
+        status = ProductStockStatus.objects.aggregate(
+            low=Count('pk', filter=Q(is_low=True)),
+            out=Count('pk', filter=Q(is_out=True)),
+        )
+        low_stock_count = status['low']
+        out_of_stock_count = status['out']
         
         if total_products > 0:
             health_score = max(0, 100 - (low_stock_count / total_products * 50) - (out_of_stock_count / total_products * 30))
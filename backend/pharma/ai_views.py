@@ -6,18 +6,35 @@ from django.http import JsonResponse
 from django.db.models import Sum, Count, Avg, Q, F
 from django.utils import timezone
 from datetime import timedelta
-from .models import Product, Inventory, Transaction, Category, Supplier
-from .ai_agent import PharmacyAIAgent
-from .ai_chat import PharmacyAIChat
+from .models import Product, Inventory, ProductStockStatus, Transaction, Category, Supplier
+from . import alerts as alert_rules
+from . import insight_history
+from .ai_cache import cached_result
+from .insights import latest_insights
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Initialize AI Agent instance
-ai_agent = PharmacyAIAgent()
+# Horizon of the precomputed insight snapshot's forecast and trend sections
+INSIGHT_DAYS = 30
 
-# Initialize AI Chat instance
-ai_chat_instance = PharmacyAIChat()
+# Most explicit product ids accepted by the batch recommendations endpoint
+BATCH_RECOMMENDATION_LIMIT = 500
+
+# The AI stack (numpy, scipy) is imported on the first AI request, so
+# workers that only serve inventory endpoints never load it
+
+def get_ai_agent():
+    """A forecasting agent; imports pharma.ai_agent on first use"""
+    from .ai_agent import PharmacyAIAgent
+    return PharmacyAIAgent()
+
+@functools.cache
+def get_ai_chat():
+    """The process-wide chat session, which holds the conversation history"""
+    from .ai_chat import PharmacyAIChat
+    return PharmacyAIChat()
 
 @api_view(['GET'])
 @permission_classes([])  # Allow unauthenticated access for external API calls
@@ -33,11 +50,11 @@ def get_database_context(request):
         total_suppliers = Supplier.objects.count()
         
         # Get inventory summary
-        inventory_summary = Inventory.objects.aggregate(
+        inventory_summary = ProductStockStatus.objects.aggregate(
             total_items=Sum('quantity'),
-            total_value=Sum(F('quantity') * F('product__unit_price')),
-            low_stock_count=Count('id', filter=Q(quantity__lte=F('product__reorder_level'))),
-            out_of_stock_count=Count('id', filter=Q(quantity=0))
+            total_value=Sum('stock_value'),
+            low_stock_count=Count('pk', filter=Q(is_low=True)),
+            out_of_stock_count=Count('pk', filter=Q(is_out=True))
         )
         
         # Get recent transactions
@@ -53,9 +70,9 @@ def get_database_context(request):
             })
         
         # Get low stock items
-        low_stock_items = Inventory.objects.select_related('product').filter(
-            quantity__lte=F('product__reorder_level')
-        )[:10]
+        low_stock_items = ProductStockStatus.objects.select_related(
+            'product', 'product__category'
+        ).filter(is_low=True)[:10]
         low_stock_data = []
         for item in low_stock_items:
             low_stock_data.append({
@@ -77,13 +94,13 @@ def get_database_context(request):
         
         # Get full inventory data for AI to access specific products
         inventory_data = []
-        inventory_items = Inventory.objects.select_related('product', 'product__category').all()
+        inventory_items = Inventory.objects.with_stock().select_related('product', 'product__category').all()
         for item in inventory_items:
             inventory_data.append({
                 'product_name': item.product.name,
                 'product_sku': item.product.sku,
                 'category': item.product.category.name if item.product.category else 'Uncategorized',
-                'quantity': item.quantity,
+                'quantity': item.on_hand,
                 'unit_price': float(item.product.unit_price),
                 'total_value': float(item.total_value),
                 'is_low_stock': item.is_low_stock,
@@ -128,8 +145,8 @@ def ai_system_health(request):
     Get AI-powered system health analysis
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        health_data = ai_agent.get_system_health_score()
+        insights, cache_info = latest_insights()
+        health_data = insights['system_health']
         
         if 'error' in health_data:
             return Response(
@@ -140,6 +157,7 @@ def ai_system_health(request):
         return Response({
             'success': True,
             'data': health_data,
+            'cache': cache_info,
             'message': 'System health analysis completed successfully'
         })
     except Exception as e:
@@ -157,8 +175,14 @@ def ai_demand_forecast(request):
     """
     try:
         days = int(request.GET.get('days', 30))
-        ai_agent = PharmacyAIAgent()
-        forecast_data = ai_agent.forecast_demand(days=days)
+        if days == INSIGHT_DAYS:
+            insights, cache_info = latest_insights()
+            forecast_data = insights['demand_forecast']
+        else:
+            ai_agent = get_ai_agent()
+            forecast_data, cache_info = cached_result(
+                'demand-forecast', lambda: ai_agent.forecast_demand(days=days), days=days
+            )
         
         if 'error' in forecast_data:
             return Response(
@@ -169,6 +193,7 @@ def ai_demand_forecast(request):
         return Response({
             'success': True,
             'data': forecast_data,
+            'cache': cache_info,
             'message': 'Demand forecast generated successfully'
         })
     except Exception as e:
@@ -185,8 +210,8 @@ def ai_inventory_optimization(request):
     Get AI-powered inventory optimization recommendations
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        optimization_data = ai_agent.optimize_inventory()
+        insights, cache_info = latest_insights()
+        optimization_data = insights['inventory_optimization']
         
         if 'error' in optimization_data:
             return Response(
@@ -197,6 +222,7 @@ def ai_inventory_optimization(request):
         return Response({
             'success': True,
             'data': optimization_data,
+            'cache': cache_info,
             'message': 'Inventory optimization completed successfully'
         })
     except Exception as e:
@@ -210,11 +236,35 @@ def ai_inventory_optimization(request):
 @permission_classes([IsAuthenticatedOrReadOnly])
 def ai_sales_trends(request):
     """
-    Get AI-powered sales trend analysis
+    Get AI-powered sales trend analysis. Optional query parameters:
+    days (prediction horizon), granularity (hour/day/week), window (buckets
+    of history) and group_by (category/supplier).
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        trends_data = ai_agent.predict_sales_trends()
+        params = {
+            'days': int(request.GET.get('days', INSIGHT_DAYS)),
+            'granularity': request.GET.get('granularity', 'day'),
+            'window': int(request.GET['window']) if request.GET.get('window') else None,
+            'group_by': request.GET.get('group_by') or None,
+        }
+    except ValueError:
+        return Response({'error': 'days and window must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    if params['granularity'] not in ('hour', 'day', 'week') or params['group_by'] not in (None, 'category', 'supplier'):
+        return Response(
+            {'error': 'granularity must be hour, day or week; group_by must be category or supplier'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        if params == {'days': INSIGHT_DAYS, 'granularity': 'day', 'window': None, 'group_by': None}:
+            insights, cache_info = latest_insights()
+            trends_data = insights['sales_trends']
+        else:
+            ai_agent = get_ai_agent()
+            trends_data, cache_info = cached_result(
+                'sales-trends', lambda: ai_agent.predict_sales_trends(**params),
+                **{name: value for name, value in params.items() if value is not None}
+            )
         
         if 'error' in trends_data:
             return Response(
@@ -225,6 +275,7 @@ def ai_sales_trends(request):
         return Response({
             'success': True,
             'data': trends_data,
+            'cache': cache_info,
             'message': 'Sales trend analysis completed successfully'
         })
     except Exception as e:
@@ -241,8 +292,7 @@ def ai_comprehensive_insights(request):
     Get comprehensive AI insights
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        insights_data = ai_agent.get_ai_insights()
+        insights_data, cache_info = latest_insights()
         
         if 'error' in insights_data:
             return Response(
@@ -253,6 +303,7 @@ def ai_comprehensive_insights(request):
         return Response({
             'success': True,
             'data': insights_data,
+            'cache': cache_info,
             'message': 'Comprehensive insights generated successfully'
         })
     except Exception as e:
@@ -269,63 +320,22 @@ def ai_product_recommendations(request, product_id):
     Get AI-powered product recommendations
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        # Get demand forecast for the product
-        forecast = ai_agent.forecast_demand(product_id=product_id, days=30)
-        
-        if 'error' in forecast:
-            return Response(
-                {'error': forecast['error']}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
-        # Generate specific recommendations
-        recommendations = []
-        
-        if forecast.get('stockout_risk', 0) > 0.3:
-            recommendations.append({
-                'type': 'high_risk',
-                'message': 'High stockout risk detected',
-                'action': 'Consider immediate reorder',
-                'priority': 'high'
-            })
-        
-        if forecast.get('current_stock', 0) < forecast.get('avg_daily_demand', 0) * 7:
-            recommendations.append({
-                'type': 'low_stock',
-                'message': 'Less than 1 week of stock remaining',
-                'action': 'Monitor closely and reorder soon',
-                'priority': 'medium'
-            })
-        
-        if forecast.get('demand_volatility', 0) > 5:
-            recommendations.append({
-                'type': 'volatile_demand',
-                'message': 'High demand volatility detected',
-                'action': 'Consider increasing safety stock',
-                'priority': 'medium'
-            })
-        
-        recommendations_data = {
-            'product_id': product_id,
-            'forecast': forecast,
-            'recommendations': recommendations,
-            'summary': {
-                'total_recommendations': len(recommendations),
-                'high_priority_count': len([r for r in recommendations if r['priority'] == 'high']),
-                'risk_level': 'high' if forecast.get('stockout_risk', 0) > 0.3 else 'medium' if forecast.get('stockout_risk', 0) > 0.1 else 'low'
-            }
-        }
+        ai_agent = get_ai_agent()
+        result = ai_agent.product_recommendations([product_id]).get(
+            product_id, {'error': 'Insufficient historical data for forecasting'}
+        )
         
-        if 'error' in recommendations_data:
+        if 'error' in result:
             return Response(
-                {'error': recommendations_data['error']}, 
+                {'error': result['error']}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
+        result['forecast'].pop('product_name')
+        result['forecast'].pop('sku')
         return Response({
             'success': True,
-            'data': recommendations_data,
+            'data': result,
             'message': 'Product recommendations generated successfully'
         })
     except Exception as e:
@@ -335,6 +345,87 @@ def ai_product_recommendations(request, product_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def ai_batch_product_recommendations(request):
+    """
+    Recommendations for many products in one call, keyed by product id.
+    Select products with ids (comma-separated, at most
+    BATCH_RECOMMENDATION_LIMIT), category and/or low_stock=true; days sets
+    the forecast horizon. Runs in a constant number of queries.
+    """
+    try:
+        days = int(request.GET.get('days', INSIGHT_DAYS))
+        ids = [int(pid) for pid in request.GET['ids'].split(',') if pid] if request.GET.get('ids') else None
+        category = int(request.GET['category']) if request.GET.get('category') else None
+    except ValueError:
+        return Response({'error': 'ids, category and days must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    low_stock = request.GET.get('low_stock', '').lower() in ('1', 'true', 'yes')
+    if not (ids or category or low_stock):
+        return Response({'error': 'Provide ids, category or low_stock=true'}, status=status.HTTP_400_BAD_REQUEST)
+    if ids and len(ids) > BATCH_RECOMMENDATION_LIMIT:
+        return Response({'error': f'At most {BATCH_RECOMMENDATION_LIMIT} ids per request'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    
+    products = Product.objects.order_by()
+    if ids:
+        products = products.filter(pk__in=ids)
+    if category:
+        products = products.filter(category_id=category)
+    if low_stock:
+        products = products.filter(stock_status__is_low=True)
+    
+    try:
+        results = get_ai_agent().product_recommendations(products.values('pk'), days=days)
+        return Response({
+            'success': True,
+            'data': {
+                'forecast_period_days': days,
+                'total_products': len(results),
+                'products': results,
+            },
+            'message': 'Product recommendations generated successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in AI batch product recommendations endpoint: {e}")
+        return Response(
+            {'error': 'Failed to generate product recommendations'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticatedOrReadOnly])
+def ai_insight_history(request):
+    """
+    Trends of the stored insight snapshots over the last `days` (default
+    30): health score, stockout risk, forecast error and the other headline
+    metrics, or one product's forecasts with `product`. Read from the
+    snapshot history only; nothing is recomputed.
+    """
+    try:
+        days = int(request.GET.get('days', 30))
+        product_id = int(request.GET['product']) if request.GET.get('product') else None
+    except ValueError:
+        return Response({'error': 'days and product must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        if product_id is None:
+            data = {'days': days, 'snapshots': insight_history.metrics(days)}
+        else:
+            data = {'days': days, 'product_id': product_id,
+                    'forecasts': insight_history.product_history(product_id, days)}
+        return Response({
+            'success': True,
+            'data': data,
+            'message': 'Insight history retrieved successfully'
+        })
+    except Exception as e:
+        logger.error(f"Error in AI insight history endpoint: {e}")
+        return Response(
+            {'error': 'Failed to retrieve insight history'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticatedOrReadOnly])
 def ai_alert_summary(request):
@@ -342,55 +433,16 @@ def ai_alert_summary(request):
     Get AI-powered alert summary
     """
     try:
-        ai_agent = PharmacyAIAgent()
-        # Get system health
-        health = ai_agent.get_system_health_score()
-        
-        # Get inventory optimization
-        optimization = ai_agent.optimize_inventory()
-        
-        # Generate alerts
-        alerts = []
-        
-        if health.get('overall_score', 100) < 70:
-            alerts.append({
-                'type': 'system_health',
-                'severity': 'critical',
-                'message': f"System health score is {health.get('overall_score', 0)} - needs immediate attention",
-                'action': 'Review system status and take corrective actions'
-            })
-        
-        if health.get('low_stock_count', 0) > 5:
-            alerts.append({
-                'type': 'low_stock',
-                'severity': 'high',
-                'message': f"{health.get('low_stock_count', 0)} products are low on stock",
-                'action': 'Review and reorder low stock items'
-            })
-        
-        if health.get('out_of_stock_count', 0) > 0:
-            alerts.append({
-                'type': 'out_of_stock',
-                'severity': 'critical',
-                'message': f"{health.get('out_of_stock_count', 0)} products are out of stock",
-                'action': 'Urgently reorder out of stock items'
-            })
-        
-        urgent_reorders = optimization.get('summary', {}).get('urgent_reorders_needed', 0)
-        if urgent_reorders > 0:
-            alerts.append({
-                'type': 'urgent_reorder',
-                'severity': 'high',
-                'message': f"{urgent_reorders} products need urgent reordering",
-                'action': 'Place urgent reorders immediately'
-            })
+        # Open alerts are kept current by the rules in pharma.alerts as
+        # stock moves, so the summary is a single read
+        alerts, last_updated = alert_rules.summary()
         
         alert_data = {
             'total_alerts': len(alerts),
             'critical_alerts': len([a for a in alerts if a['severity'] == 'critical']),
             'high_alerts': len([a for a in alerts if a['severity'] == 'high']),
             'alerts': alerts,
-            'last_updated': ai_agent.get_ai_insights().get('generated_at', '')
+            'last_updated': (last_updated or timezone.now()).isoformat()
         }
         
         if 'error' in alert_data:
@@ -426,7 +478,7 @@ def ai_chat(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Process message through AI chat
-        response = ai_chat_instance.process_message(message)
+        response = get_ai_chat().process_message(message)
         
         return Response({
             'success': True,
@@ -447,7 +499,7 @@ def ai_chat_history(request):
     Get AI chat conversation history
     """
     try:
-        history = ai_chat_instance.get_conversation_history()
+        history = get_ai_chat().get_conversation_history()
         
         return Response({
             'success': True,
@@ -471,7 +523,7 @@ def ai_chat_clear(request):
     Clear AI chat conversation history
     """
     try:
-        ai_chat_instance.clear_history()
+        get_ai_chat().clear_history()
         
         return Response({
             'success': True,
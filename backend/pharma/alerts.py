@@ -0,0 +1,151 @@
+"""
+Stock alert rules, evaluated incrementally. Each rule looks at one
+ProductStockStatus row and returns (severity, message) while it fires.
+evaluate() runs the rules for the products a movement touched and syncs the
+open Alert rows: new ones are opened, changed ones updated, the rest resolved.
+The system_health rule is system-wide instead: summary() applies it to the
+health score stored with the latest insight snapshot.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import Alert, InsightSnapshot, ProductStockStatus
+
+# Days of cover below which a product needs reordering now: the supplier
+# lead time assumed by inventory optimization (forecasting.LEAD_TIME_DAYS)
+REORDER_COVER_DAYS = 7
+EXPIRY_WARNING_DAYS = 30
+# The summary reports low stock once more than this many products are low
+LOW_STOCK_SUMMARY_MIN = 5
+HEALTH_ALERT_SCORE = 70
+
+
+def out_of_stock(status, today):
+    if status['is_out']:
+        return 'critical', f"{status['product__name']} is out of stock"
+
+
+def low_stock(status, today):
+    if status['is_low'] and not status['is_out']:
+        return 'high', f"{status['product__name']} is at or below its reorder level"
+
+
+def urgent_reorder(status, today):
+    cover = status['days_of_cover']
+    if not status['is_out'] and cover is not None and cover < REORDER_COVER_DAYS:
+        return 'high', f"{status['product__name']} has under {REORDER_COVER_DAYS} days of cover"
+
+
+def expiring(status, today):
+    expiry = status['next_expiry']
+    if expiry is None or status['is_out']:
+        return None
+    if expiry < today:
+        return 'critical', f"{status['product__name']} has an expired lot in stock"
+    if expiry <= today + timedelta(days=EXPIRY_WARNING_DAYS):
+        return 'high', f"{status['product__name']} has a lot expiring on {expiry.isoformat()}"
+
+
+def system_health(score):
+    if score is not None and score < HEALTH_ALERT_SCORE:
+        return 'critical', f"System health score is {score} - needs immediate attention"
+
+
+RULES = {
+    'out_of_stock': out_of_stock,
+    'low_stock': low_stock,
+    'urgent_reorder': urgent_reorder,
+    'expiring': expiring,
+}
+
+# Alert summary wording per (kind, severity), and what to do about it
+SUMMARIES = {
+    ('out_of_stock', 'critical'): "{count} products are out of stock",
+    ('low_stock', 'high'): "{count} products are low on stock",
+    ('urgent_reorder', 'high'): "{count} products need urgent reordering",
+    ('expiring', 'critical'): "{count} products have expired lots in stock",
+    ('expiring', 'high'): f"{{count}} products have lots expiring within {EXPIRY_WARNING_DAYS} days",
+}
+ACTIONS = {
+    'out_of_stock': 'Urgently reorder out of stock items',
+    'low_stock': 'Review and reorder low stock items',
+    'urgent_reorder': 'Place urgent reorders immediately',
+    'expiring': 'Dispense expiring lots first or return them to the supplier',
+    'system_health': 'Review system status and take corrective actions',
+}
+
+
+def evaluate(product_ids=None):
+    """
+    Re-run the rules for these products (all when None) against their stock
+    status and sync open alerts. Returns (opened, updated, resolved) counts.
+    """
+    statuses = ProductStockStatus.objects.order_by()
+    current = Alert.objects.open().order_by()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        statuses = statuses.filter(product_id__in=product_ids)
+        current = current.filter(product_id__in=product_ids)
+
+    today = timezone.localdate()
+    firing = {}
+    for status in statuses.values('product_id', 'product__name', 'is_low', 'is_out',
+                                  'days_of_cover', 'next_expiry'):
+        for kind, rule in RULES.items():
+            result = rule(status, today)
+            if result:
+                firing[status['product_id'], kind] = result
+
+    now = timezone.now()
+    changed, resolved = [], []
+    for alert in current:
+        result = firing.pop((alert.product_id, alert.kind), None)
+        if result is None:
+            resolved.append(alert.pk)
+        elif result != (alert.severity, alert.message):
+            alert.severity, alert.message = result
+            alert.updated_at = now
+            changed.append(alert)
+
+    if resolved:
+        Alert.objects.filter(pk__in=resolved).update(resolved_at=now, updated_at=now)
+    if changed:
+        Alert.objects.bulk_update(changed, ['severity', 'message', 'updated_at'])
+    if firing:
+        Alert.objects.bulk_create(
+            [Alert(product_id=pid, kind=kind, severity=severity, message=message, updated_at=now)
+             for (pid, kind), (severity, message) in firing.items()],
+            ignore_conflicts=True,
+        )
+    return len(firing), len(changed), len(resolved)
+
+
+def summary():
+    """
+    Open alerts grouped by kind and severity, critical first, in one read
+    over the open-alert index, plus system_health on the latest snapshot's
+    score (a second, single-row read). Low stock is left out until more
+    than LOW_STOCK_SUMMARY_MIN products are low. Returns (alerts,
+    last_updated).
+    """
+    groups = [group for group in (Alert.objects.open().order_by()
+                                  .values('kind', 'severity')
+                                  .annotate(count=Count('pk'), updated=Max('updated_at'))
+                                  .order_by('kind', 'severity'))
+              if group['kind'] != 'low_stock' or group['count'] > LOW_STOCK_SUMMARY_MIN]
+    health = InsightSnapshot.objects.order_by('-computed_at', '-pk').values('health_score', 'computed_at').first()
+    fired = system_health(health['health_score']) if health else None
+    if fired:
+        groups.insert(0, {'kind': 'system_health', 'severity': fired[0], 'count': 1,
+                          'message': fired[1], 'updated': health['computed_at']})
+    alerts = [{
+        'type': group['kind'],
+        'severity': group['severity'],
+        'count': group['count'],
+        'message': group.get('message') or SUMMARIES[group['kind'], group['severity']].format(count=group['count']),
+        'action': ACTIONS[group['kind']],
+    } for group in groups]
+    alerts.sort(key=lambda alert: alert['severity'] != 'critical')
+    return alerts, max((group['updated'] for group in groups), default=None)
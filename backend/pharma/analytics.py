@@ -0,0 +1,90 @@
+"""
+Shared inputs for the AI analyses. One AnalyticsContext is passed through
+every analysis in a get_ai_insights run, so each dataset is read from the
+database at most once however many analyses use it.
+"""
+from datetime import timedelta
+from functools import cached_property
+
+from django.db.models import Count, F, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .forecasting import HISTORY_DAYS, DemandMatrix, current_stock
+from .models import DailyProductSales, Product, Transaction, unfolded_shard_delta
+
+
+class AnalyticsContext:
+    """
+    Lazily loaded, cached analytics inputs. `trend_days` sizes the sales
+    history so predict_sales_trends(days=trend_days) can be answered from
+    the same read as the demand matrix.
+    """
+
+    def __init__(self, trend_days=30, end=None):
+        self.end = end or timezone.localdate()
+        self.history_days = max(HISTORY_DAYS, trend_days * 2)
+        self.start = self.end - timedelta(days=self.history_days)
+
+    def covers(self, days):
+        """Whether the loaded history reaches back `days` days"""
+        return days <= self.history_days
+
+    @cached_property
+    def products(self):
+        """Every product's metadata and shard-aware stock (see forecasting.current_stock)"""
+        return current_stock()
+
+    @cached_property
+    def sales(self):
+        """(product_id, date, qty_out, out_count, revenue) rollup rows with OUT activity in the history window"""
+        return list(DailyProductSales.objects
+                    .filter(date__gte=self.start, date__lte=self.end, out_count__gt=0)
+                    .order_by()
+                    .values_list('product_id', 'date', 'qty_out', 'out_count', 'revenue'))
+
+    @cached_property
+    def demand(self):
+        """The forecaster's products x days DemandMatrix, cut from `sales`"""
+        start = self.end - timedelta(days=HISTORY_DAYS)
+        return DemandMatrix.from_rows(
+            ((pid, day, qty) for pid, day, qty, _, _ in self.sales if qty > 0 and day >= start),
+            start,
+        )
+
+    def daily_sales(self, start, end):
+        """[{date, revenue, units, sales}] per day with sales between start and end, in date order"""
+        days = {}
+        for _, day, qty_out, out_count, revenue in self.sales:
+            if start <= day <= end:
+                row = days.setdefault(day, {'date': day, 'revenue': 0, 'units': 0, 'sales': 0})
+                row['revenue'] += revenue
+                row['units'] += qty_out
+                row['sales'] += out_count
+        return [days[day] for day in sorted(days)]
+
+    @cached_property
+    def health_by_category(self):
+        """
+        Per-category product, low-stock and out-of-stock counts from one
+        conditional aggregate over Product LEFT JOIN Inventory. A product
+        without an inventory row counts as out of stock.
+        """
+        on_hand = Coalesce(F('inventory__quantity'), 0) + unfolded_shard_delta(OuterRef('pk'))
+        stocked = Q(inventory__isnull=False)
+        return list(
+            Product.objects.order_by()
+            .annotate(on_hand=on_hand)
+            .values('category_id', 'category__name')
+            .annotate(
+                total=Count('pk'),
+                low=Count('pk', filter=stocked & Q(on_hand__lte=F('reorder_level'))),
+                out=Count('pk', filter=~stocked | Q(on_hand=0)),
+            )
+            .order_by('category__name')
+        )
+
+    @cached_property
+    def recent_activity(self):
+        """Transactions posted in the last 7 days"""
+        return Transaction.objects.filter(created_at__gte=timezone.now() - timedelta(days=7)).count()
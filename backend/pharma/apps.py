@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PharmaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pharma'
+
+    def ready(self):
+        from . import receivers  # noqa: F401  (connects transactions_posted handlers)
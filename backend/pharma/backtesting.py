@@ -0,0 +1,109 @@
+"""
+Rolling-origin backtests of the demand forecaster. The daily sales history
+is loaded once as a products x days matrix; at every cut-off the forecaster
+sees only the HISTORY_DAYS before it and is scored against the units
+actually dispensed over the following horizon. Cut-offs are independent,
+so they can be fanned out to worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import django
+import numpy as np
+from django.utils import timezone
+
+from .forecasting import HISTORY_DAYS, DemandMatrix, forecast
+from .models import Product
+
+
+def cutoffs(total_days, horizon, folds, step, history_days=HISTORY_DAYS):
+    """
+    Column indexes of up to `folds` cut-offs, `step` days apart, the latest
+    leaving exactly `horizon` days of actuals. Each keeps a full history
+    window before it. Oldest first.
+    """
+    latest = total_days - horizon
+    return [cut for cut in range(latest, latest - folds * step, -step) if cut >= history_days][::-1]
+
+
+def forecast_at(window, history_days, horizon):
+    """
+    (forecast, actual, model) arrays for every row of `window`: the
+    history_days before a cut-off followed by the horizon after it.
+    """
+    train = DemandMatrix(np.arange(len(window)), None, window[:, :history_days])
+    stats = forecast(train, np.zeros(len(window)), horizon)
+    return stats['forecasted_demand'], window[:, history_days:].sum(axis=1), stats['model']
+
+
+class Backtest:
+    """
+    Forecast errors (cut-offs x products) for the products with sales in
+    the evaluated span, ending yesterday so no day is partial.
+    """
+
+    def __init__(self, horizon=14, folds=12, step=7, history_days=HISTORY_DAYS, end=None):
+        self.horizon = horizon
+        self.history_days = history_days
+        self.end = end or timezone.localdate() - timedelta(days=1)
+        span = history_days + (folds - 1) * step + horizon
+        self.matrix = DemandMatrix.load(history_days=span - 1, end=self.end)
+        self.cutoffs = cutoffs(span, horizon, folds, step, history_days)
+
+    def cutoff_dates(self):
+        return [self.matrix.start + timedelta(days=cut) for cut in self.cutoffs]
+
+    def run(self, workers=1):
+        # Each task gets only its own window of the matrix
+        windows = [self.matrix.values[:, cut - self.history_days:cut + self.horizon] for cut in self.cutoffs]
+        args = (windows, [self.history_days] * len(windows), [self.horizon] * len(windows))
+        if workers > 1 and len(self.cutoffs) > 1:
+            # Workers re-run django.setup() so spawn/forkserver start methods work too
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                results = list(pool.map(forecast_at, *args))
+        else:
+            results = list(map(forecast_at, *args))
+        self.predicted = np.array([r[0] for r in results])
+        self.actual = np.array([r[1] for r in results])
+        self.models = np.array([r[2] for r in results])
+        return self
+
+    @staticmethod
+    def metrics(predicted, actual):
+        """MAE, MAPE (%, over points with demand; None without) and bias (mean signed error)"""
+        errors = predicted - actual
+        sold = actual > 0
+        return {
+            'points': int(errors.size),
+            'mae': float(np.abs(errors).mean()) if errors.size else 0.0,
+            'mape': float((np.abs(errors[sold]) / actual[sold]).mean() * 100) if sold.any() else None,
+            'bias': float(errors.mean()) if errors.size else 0.0,
+        }
+
+    def overall(self):
+        return self.metrics(self.predicted, self.actual)
+
+    def by_product(self):
+        """{product_id: metrics + name, sku, category, model}, over all cut-offs"""
+        ids = self.matrix.product_ids.tolist()
+        info = {p['pk']: p for p in Product.objects.filter(pk__in=ids)
+                .values('pk', 'name', 'sku', 'category__name')}
+        report = {}
+        for i, pid in enumerate(ids):
+            models, counts = np.unique(self.models[:, i], return_counts=True)
+            report[pid] = {
+                'name': info[pid]['name'],
+                'sku': info[pid]['sku'],
+                'category': info[pid]['category__name'] or 'Uncategorized',
+                'model': str(models[counts.argmax()]),
+                **self.metrics(self.predicted[:, i], self.actual[:, i]),
+            }
+        return report
+
+    def by_category(self, products=None):
+        products = products or self.by_product()
+        columns = {}
+        for i, pid in enumerate(self.matrix.product_ids.tolist()):
+            columns.setdefault(products[pid]['category'], []).append(i)
+        return {name: self.metrics(self.predicted[:, cols], self.actual[:, cols])
+                for name, cols in sorted(columns.items())}
@@ -0,0 +1,37 @@
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+
+def is_lock_error(exc):
+    """True for SQLite's transient 'database is locked' / 'database table is locked' errors"""
+    return isinstance(exc, OperationalError) and 'locked' in str(exc).lower()
+
+
+def retry_on_lock(func=None, *, attempts=None, base_delay=None):
+    """
+    Re-run `func` when SQLite reports the database is locked, sleeping with
+    jittered exponential backoff between tries (PHARMA_LOCK_RETRY_ATTEMPTS,
+    PHARMA_LOCK_RETRY_DELAY). The wrapped call must own its transaction:
+    inside an outer atomic block the lock error is re-raised unchanged,
+    since only the outermost transaction can be safely retried.
+    """
+    if func is None:
+        return functools.partial(retry_on_lock, attempts=attempts, base_delay=base_delay)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        tries = attempts or getattr(settings, 'PHARMA_LOCK_RETRY_ATTEMPTS', 5)
+        delay = base_delay if base_delay is not None else getattr(settings, 'PHARMA_LOCK_RETRY_DELAY', 0.05)
+        for attempt in range(tries):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_lock_error(exc) or connection.in_atomic_block or attempt == tries - 1:
+                    raise
+            time.sleep(random.uniform(0, delay * 2 ** attempt))
+
+    return wrapper
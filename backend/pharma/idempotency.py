@@ -0,0 +1,107 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction as db_txn
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+HEADER = 'Idempotency-Key'
+# Names an anonymous caller (e.g. a POS terminal id); keys are scoped to it
+CLIENT_HEADER = 'X-Client-Id'
+CLIENT_ID_MAX_LENGTH = 50
+
+
+def _client_id(request):
+    """
+    The namespace for a request's keys: the user, or the X-Client-Id header
+    for anonymous requests. None when an anonymous request does not send
+    one. The remote address is not used, because terminals behind one NAT
+    or proxy share it.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    client = request.headers.get(CLIENT_HEADER, '').strip()
+    return f"client:{client}" if client else None
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return Response({'error': f'{HEADER} was already used for a different request'},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response(record.response_body, status=record.status_code,
+                    headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a write action. The first request
+    claims (client, key) and its response is stored in the same database
+    transaction as the write, so a retry either replays that response
+    (with `Idempotent-Replayed: true`) or, if the write rolled back, runs
+    again. Reusing a key with a different body is rejected with 422.
+    Requests without the header are unaffected. Keys are scoped to the
+    user, or for anonymous requests to the X-Client-Id header, which they
+    must then send. Apply inside retry_on_lock so the whole
+    claim-and-write is retried together.
+
+    Two concurrent requests with the same key can both miss the lookup;
+    the unique (client, key) constraint lets only one insert the claim,
+    and the other replays the winner's stored response once it commits.
+    """
+    @functools.wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f'{HEADER} must be at most 255 characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        client = _client_id(request)
+        if client is None:
+            return Response({'error': f'Anonymous requests with {HEADER} must send {CLIENT_HEADER}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(client) > len('client:') + CLIENT_ID_MAX_LENGTH:
+            return Response({'error': f'{CLIENT_HEADER} must be at most {CLIENT_ID_MAX_LENGTH} characters'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        fingerprint = _fingerprint(request)
+        now = timezone.now()
+        with db_txn.atomic():
+            record = IdempotencyRecord.objects.filter(client=client, key=key).first()
+            if record is not None and record.expires_at <= now:
+                record.delete()
+                record = None
+            if record is not None:
+                return _replay(record, fingerprint)
+
+            ttl = getattr(settings, 'PHARMA_IDEMPOTENCY_TTL', timedelta(hours=24))
+            try:
+                with db_txn.atomic():
+                    record = IdempotencyRecord.objects.create(
+                        client=client, key=key, fingerprint=fingerprint, expires_at=now + ttl,
+                    )
+            except IntegrityError:
+                # Lost the race: the insert waited on the winner's commit
+                return _replay(IdempotencyRecord.objects.get(client=client, key=key), fingerprint)
+            response = view(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                record.delete()  # server faults are not a final answer; let the retry run
+            else:
+                record.status_code = response.status_code
+                record.response_body = response.data
+                record.save(update_fields=['status_code', 'response_body'])
+        return response
+
+    return wrapper
@@ -0,0 +1,128 @@
+"""
+Time series over the stored insight history: headline metrics per
+InsightSnapshot, per-SKU forecast rows, and how far each snapshot's
+forecast was from the units dispensed since (DailyProductSales). Everything
+is read from stored rows; nothing is recomputed.
+
+Over the days of a snapshot's horizon that have fully elapsed, and across
+the SKUs it forecast:
+- forecast_error is the weighted absolute percentage error, sum of
+  |forecast - actual| over sum of actual
+- forecast_bias is sum of (forecast - actual) over sum of actual; positive
+  means the forecast ran high
+
+Both are computed in SQL over at most MAX_POINTS snapshots. The history is
+already downsampled as it ages (models.INSIGHT_HISTORY_RESOLUTION).
+"""
+from datetime import timedelta
+
+from django.db.models import Case, DateField, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce
+from django.utils import timezone
+
+from .models import DailyProductSales, InsightForecast, InsightSnapshot
+
+METRICS = ('health_score', 'average_stockout_risk', 'high_risk_products', 'total_forecasted_demand',
+           'urgent_reorders', 'daily_holding_cost', 'average_daily_sales')
+MAX_POINTS = 500
+
+
+def _elapsed(computed_at, forecast_days, today):
+    """(first, last) elapsed days of a snapshot's forecast horizon, or None before the first one ends"""
+    first = timezone.localdate(computed_at) + timedelta(days=1)
+    last = min(first + timedelta(days=(forecast_days or 0) - 1), today - timedelta(days=1))
+    return (first, last) if last >= first else None
+
+
+def _with_actuals(forecasts, windows):
+    """
+    Forecast rows of the snapshots with an elapsed window, annotated with
+    `elapsed` days, `actual` units dispensed over them (a rollup subquery)
+    and `predicted` units. Windows are passed in as CASE expressions over
+    snapshot ids, one branch per distinct window.
+    """
+    groups = {}
+    for snapshot_id, window in windows.items():
+        if window:
+            groups.setdefault(window, []).append(snapshot_id)
+
+    def per_window(value, output_field):
+        return Case(*[When(snapshot_id__in=ids, then=Value(value(window))) for window, ids in groups.items()],
+                    output_field=output_field)
+
+    dispensed = (DailyProductSales.objects
+                 .filter(product=OuterRef('product_id'), date__gte=OuterRef('window_first'),
+                         date__lte=OuterRef('window_last'))
+                 .order_by().values('product').annotate(total=Sum('qty_out')).values('total'))
+    return (forecasts.filter(snapshot_id__in=[i for ids in groups.values() for i in ids]).order_by()
+            .annotate(window_first=per_window(lambda w: w[0], DateField()),
+                      window_last=per_window(lambda w: w[1], DateField()),
+                      elapsed=per_window(lambda w: (w[1] - w[0]).days + 1, IntegerField()))
+            .annotate(actual=Coalesce(Subquery(dispensed), 0),
+                      predicted=F('avg_daily_demand') * F('elapsed')))
+
+
+def metrics(days=30, now=None):
+    """
+    Headline metrics of the newest MAX_POINTS snapshots from the last
+    `days`, oldest first, each with forecast_error, forecast_bias and
+    forecast_error_days. Two queries.
+    """
+    now = now or timezone.now()
+    since, today = now - timedelta(days=days), timezone.localdate(now)
+    snapshots = list(InsightSnapshot.objects.filter(computed_at__gte=since).order_by('-computed_at', '-pk')
+                     .values('pk', 'computed_at', 'forecast_days', *METRICS)[:MAX_POINTS])[::-1]
+    windows = {s['pk']: _elapsed(s['computed_at'], s['forecast_days'], today) for s in snapshots}
+
+    errors = {}
+    if any(windows.values()):
+        rows = (_with_actuals(InsightForecast.objects.all(), windows)
+                .values('snapshot_id')
+                .annotate(absolute=Sum(Abs(F('predicted') - F('actual')), output_field=FloatField()),
+                          signed=Sum(F('predicted') - F('actual'), output_field=FloatField()),
+                          dispensed=Sum('actual'))
+                .values_list('snapshot_id', 'absolute', 'signed', 'dispensed'))
+        errors = {snapshot_id: totals for snapshot_id, *totals in rows}
+
+    history = []
+    for snapshot in snapshots:
+        window = windows[snapshot['pk']]
+        absolute, signed, dispensed = errors.get(snapshot['pk'], (0.0, 0.0, 0))
+        history.append({
+            'snapshot_id': snapshot.pop('pk'),
+            **snapshot,
+            'forecast_error': round(absolute / dispensed, 3) if dispensed else None,
+            'forecast_bias': round(signed / dispensed, 3) if dispensed else None,
+            'forecast_error_days': (window[1] - window[0]).days + 1 if window else 0,
+        })
+    return history
+
+
+def product_history(product_id, days=30, now=None):
+    """
+    One product's stored forecasts from the newest MAX_POINTS snapshots of
+    the last `days`, oldest first, with the average daily units actually
+    dispensed over each elapsed horizon (None until a day has passed). Two
+    queries.
+    """
+    now = now or timezone.now()
+    since, today = now - timedelta(days=days), timezone.localdate(now)
+    rows = list(InsightForecast.objects.filter(product_id=product_id, snapshot__computed_at__gte=since)
+                .order_by('-snapshot__computed_at', '-snapshot_id')
+                .values('snapshot_id', 'snapshot__computed_at', 'snapshot__forecast_days', 'model',
+                        'forecasted_demand', 'avg_daily_demand', 'stockout_risk', 'current_stock')[:MAX_POINTS])[::-1]
+    windows = {row['snapshot_id']: _elapsed(row['snapshot__computed_at'], row.pop('snapshot__forecast_days'), today)
+               for row in rows}
+    actuals = {}
+    if any(windows.values()):
+        actuals = dict(_with_actuals(InsightForecast.objects.filter(product_id=product_id), windows)
+                       .values_list('snapshot_id', 'actual'))
+
+    history = []
+    for row in rows:
+        window = windows[row['snapshot_id']]
+        actual = None
+        if window:
+            actual = round(actuals.get(row['snapshot_id'], 0) / ((window[1] - window[0]).days + 1), 2)
+        history.append({'computed_at': row.pop('snapshot__computed_at'), **row, 'actual_daily_demand': actual})
+    return history
@@ -0,0 +1,71 @@
+"""
+Stale-while-revalidate serving of comprehensive insights. The newest
+InsightSnapshot is returned immediately; when it is stale a refresh runs in
+a background thread (one per process at a time) or in the
+`precompute_insights` daemon, so request workers never wait on a full
+recomputation except on a cold start.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from .models import InsightSnapshot, Transaction
+
+logger = logging.getLogger(__name__)
+
+_refreshing = threading.Lock()
+
+
+def refresh_snapshot():
+    """Recompute insights and persist them as the newest snapshot"""
+    from .ai_agent import PharmacyAIAgent  # deferred: keeps numpy out of URL loading
+
+    last_transaction_id = Transaction.objects.aggregate(last=Max('pk'))['last'] or 0
+    started = time.perf_counter()
+    data = PharmacyAIAgent().get_ai_insights()
+    if 'error' in data:
+        raise RuntimeError(data['error'])
+    duration_ms = int((time.perf_counter() - started) * 1000)
+    return InsightSnapshot.objects.record(data, last_transaction_id, duration_ms)
+
+
+def _refresh_in_background():
+    try:
+        refresh_snapshot()
+    except Exception:
+        logger.exception("Background insight refresh failed")
+    finally:
+        connection.close()
+        _refreshing.release()
+
+
+def refresh_async():
+    """Start a background refresh unless one is already running in this process"""
+    if not _refreshing.acquire(blocking=False):
+        return False
+    threading.Thread(target=_refresh_in_background, name='insight-refresh', daemon=True).start()
+    return True
+
+
+def latest_insights():
+    """
+    Return (insights, info) from the newest snapshot, computing one inline
+    only if none exists yet. `info` is {hit, age_seconds, stale, refreshing}.
+    """
+    snapshot = InsightSnapshot.objects.latest_snapshot()
+    if snapshot is None:
+        snapshot = refresh_snapshot()
+        return snapshot.data, {'hit': False, 'age_seconds': 0.0, 'stale': False, 'refreshing': False}
+
+    stale = snapshot.is_stale()
+    refreshing = stale and getattr(settings, 'PHARMA_INSIGHTS_BACKGROUND_REFRESH', True) and refresh_async()
+    return snapshot.data, {
+        'hit': True,
+        'age_seconds': round(snapshot.age.total_seconds(), 3),
+        'stale': stale,
+        'refreshing': bool(refreshing),
+    }
@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from pharma.models import DailyProductSales, ProductDemandStats
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the DailyProductSales rollup from the transaction ledger, then replay it "
+            "into the running ProductDemandStats.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help="Only rebuild the last N days (default: full history)")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'])
+        rows = DailyProductSales.objects.rebuild(since=since)
+        scope = f"since {since}" if since else "for full history"
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(rows)} daily sales rows {scope}"))
+        products = ProductDemandStats.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt demand stats for {products} products"))
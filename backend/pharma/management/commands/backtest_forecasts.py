@@ -0,0 +1,80 @@
+import os
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharma.backtesting import Backtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Backtest the demand forecaster on rolling-origin splits of the sales "
+        "history: at each cut-off forecast the next --horizon days from the "
+        "90 days before it, then report MAE, MAPE and bias overall, per "
+        "category and per SKU, with wall time and peak memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, default=14, help="Days forecast at each cut-off (default: 14)")
+        parser.add_argument('--folds', type=int, default=12, help="Number of cut-offs (default: 12)")
+        parser.add_argument('--step', type=int, default=7, help="Days between cut-offs (default: 7)")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Worker processes for the cut-offs (default: CPU count)")
+        parser.add_argument('--top', type=int, default=20,
+                            help="SKUs listed, worst MAE first (default: 20; 0 lists all)")
+
+    def handle(self, *args, **options):
+        if min(options['horizon'], options['folds'], options['step'], options['workers']) < 1:
+            raise CommandError("--horizon, --folds, --step and --workers must be at least 1")
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        backtest = Backtest(options['horizon'], options['folds'], options['step'])
+        if not backtest.cutoffs or not len(backtest.matrix):
+            raise CommandError("Not enough sales history for a single cut-off")
+        backtest.run(options['workers'])
+        products = backtest.by_product()
+        categories = backtest.by_category(products)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        dates = backtest.cutoff_dates()
+        self.stdout.write(
+            f"{len(products)} SKUs, {len(dates)} cut-offs {dates[0]} .. {dates[-1]}, "
+            f"{options['horizon']}-day horizon"
+        )
+        self.stdout.write(f"Overall: {self._format(backtest.overall())}")
+
+        self.stdout.write("\nBy category:")
+        for name, metrics in categories.items():
+            self.stdout.write(f"  {name:<24} {self._format(metrics)}")
+
+        ranked = sorted(products.values(), key=lambda p: p['mae'], reverse=True)
+        shown = ranked[:options['top']] if options['top'] else ranked
+        self.stdout.write(f"\nBy SKU ({len(shown)} of {len(ranked)}, worst MAE first):")
+        for product in shown:
+            self.stdout.write(
+                f"  {product['sku']:<12} {product['name'][:24]:<24} {product['model']:<12} "
+                f"{self._format(product)}"
+            )
+
+        memory = f"peak traced memory {peak / 2 ** 20:.1f} MiB in this process"
+        if resource is not None and options['workers'] > 1:
+            # ru_maxrss is in KiB on Linux
+            workers_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            memory += f", {workers_rss:.1f} MiB max RSS per worker"
+        self.stdout.write(self.style.SUCCESS(
+            f"\nWall time {elapsed:.2f}s with {options['workers']} worker(s); {memory}"
+        ))
+
+    @staticmethod
+    def _format(metrics):
+        mape = f"{metrics['mape']:.1f}%" if metrics['mape'] is not None else 'n/a'
+        return f"MAE {metrics['mae']:.2f}  MAPE {mape}  bias {metrics['bias']:+.2f}  (n={metrics['points']})"
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from pharma.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Routine SQLite upkeep: purge expired idempotency records, refresh "
+        "planner statistics (ANALYZE, PRAGMA optimize), reclaim free pages "
+        "with an incremental vacuum and checkpoint the WAL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=0,
+                            help="Free pages to reclaim per run (default: all)")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="Run a full VACUUM (rewrites the file; needed once to switch "
+                                 "an existing database to auto_vacuum=INCREMENTAL)")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"db_maintenance only supports SQLite, not {connection.vendor}")
+
+        purged = IdempotencyRecord.objects.purge_expired()
+        self.stdout.write(f"Purged {purged} expired idempotency records")
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute('PRAGMA optimize')
+            self.stdout.write("Planner statistics refreshed")
+
+            if options['vacuum']:
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                cursor.execute('VACUUM')
+                self.stdout.write("Database rewritten with VACUUM")
+
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] == 2:
+                cursor.execute('PRAGMA freelist_count')
+                free = cursor.fetchone()[0]
+                cursor.execute(f"PRAGMA incremental_vacuum({options['pages']:d})")
+                cursor.fetchall()
+                self.stdout.write(f"Incremental vacuum: {free} free pages before")
+            else:
+                self.stdout.write("auto_vacuum is not INCREMENTAL; run with --vacuum once to enable it")
+
+            cursor.execute('PRAGMA journal_mode')
+            if cursor.fetchone()[0] == 'wal':
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                busy, log_pages, _ = cursor.fetchone()
+                self.stdout.write(f"WAL checkpoint: {log_pages} pages" + (" (busy)" if busy else ""))
+
+        self.stdout.write(self.style.SUCCESS("Maintenance complete"))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from pharma.models import Inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage sharded stock counters for high-velocity products: enable or "
+        "disable sharding, or fold outstanding shard deltas into Inventory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enable', type=int, action='append', default=[], metavar='PRODUCT_ID',
+                            help="Switch this product to sharded counters (repeatable)")
+        parser.add_argument('--disable', type=int, action='append', default=[], metavar='PRODUCT_ID',
+                            help="Fold and return this product to a single counter (repeatable)")
+        parser.add_argument('--fold', action='store_true',
+                            help="Fold all shard deltas into Inventory.quantity")
+
+    def handle(self, *args, **options):
+        if options['enable']:
+            count = Inventory.objects.enable_sharding(options['enable'])
+            self.stdout.write(f"Sharding enabled for {count} products")
+        if options['disable']:
+            Inventory.objects.disable_sharding(options['disable'])
+            self.stdout.write(f"Sharding disabled for {len(options['disable'])} products")
+        if options['fold']:
+            folded = Inventory.objects.fold_shards()
+            self.stdout.write(f"Folded shard deltas for {folded} products")
+        sharded = Inventory.objects.filter(sharded=True).count()
+        self.stdout.write(self.style.SUCCESS(f"{sharded} products use sharded counters"))
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from pharma.insights import refresh_snapshot
+from pharma.models import InsightSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Keep the comprehensive insights snapshot fresh. Runs as a daemon that "
+        "recomputes whenever the newest snapshot is stale (PHARMA_INSIGHTS_MAX_AGE "
+        "elapsed or PHARMA_INSIGHTS_MAX_MOVEMENTS ledger rows posted since); "
+        "--once refreshes a single time and exits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Refresh now and exit")
+        parser.add_argument('--poll', type=float, default=10.0,
+                            help="Seconds between staleness checks (default: 10)")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self._refresh()
+            return
+
+        self.stdout.write(f"Watching insight staleness every {options['poll']}s (Ctrl+C to stop)")
+        try:
+            while True:
+                snapshot = InsightSnapshot.objects.latest_snapshot()
+                if snapshot is None or snapshot.is_stale():
+                    self._refresh()
+                connection.close()  # do not hold a connection (or a WAL snapshot) while idle
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
+
+    def _refresh(self):
+        try:
+            snapshot = refresh_snapshot()
+        except Exception as exc:
+            self.stderr.write(f"Insight refresh failed: {exc}")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Insights refreshed in {snapshot.duration_ms} ms "
+            f"(through transaction {snapshot.last_transaction_id})"
+        ))
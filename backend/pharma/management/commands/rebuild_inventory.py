@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction as db_txn
+
+from pharma import alerts
+from pharma.ai_cache import bump_data_version
+from pharma.models import Inventory, InventorySnapshot, ProductStockStatus, _apply_deltas
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Inventory.quantity from the transaction ledger "
+        "(latest InventorySnapshot + ledger tail) and repair any drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report drift; do not modify Inventory")
+        parser.add_argument('--snapshot', action='store_true',
+                            help="Take a new ledger checkpoint after rebuilding")
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help="Limit to these product ids (repeatable)")
+
+    def handle(self, *args, **options):
+        with db_txn.atomic():
+            if not options['dry_run']:
+                Inventory.objects.fold_shards(options['products'])
+            balances = InventorySnapshot.objects.ledger_balances(options['products'])
+            current = dict(Inventory.objects
+                           .with_stock()
+                           .filter(product_id__in=balances)
+                           .values_list('product_id', 'on_hand_db'))
+
+            drift = {pid: qty - current.get(pid, 0)
+                     for pid, qty in balances.items() if qty != current.get(pid, 0)}
+            for pid, delta in sorted(drift.items()):
+                self.stdout.write(
+                    f"product {pid}: inventory {current.get(pid, 0)}, ledger {balances[pid]} ({delta:+d})"
+                )
+            negative = sorted(pid for pid, qty in balances.items() if qty < 0)
+            if negative:
+                self.stderr.write(f"Ledger balance is negative for products {negative}; left unchanged")
+                for pid in negative:
+                    drift.pop(pid, None)
+
+            if not options['dry_run'] and drift:
+                Inventory.objects.bulk_create(
+                    [Inventory(product_id=pid) for pid in drift if pid not in current],
+                    ignore_conflicts=True,
+                )
+                _apply_deltas(Inventory, drift, key='product_id', touch='last_updated')
+                ProductStockStatus.objects.refresh(drift)
+                alerts.evaluate(drift)
+                db_txn.on_commit(bump_data_version)
+
+            if options['snapshot'] and not options['dry_run']:
+                taken = InventorySnapshot.objects.take(options['products'])
+                self.stdout.write(f"Checkpointed {len(taken)} products")
+
+        verb = "would be repaired" if options['dry_run'] else "repaired"
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {len(balances)} products; {len(drift)} {verb}"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from pharma import alerts
+from pharma.models import ProductStockStatus
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the ProductStockStatus projection and re-evaluate stock alerts. "
+        "Movements keep both current; run nightly so days-of-cover follows the "
+        "sales window and expiry alerts follow the calendar, and after upgrades."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help="Limit to these product ids (repeatable)")
+
+    def handle(self, *args, **options):
+        count = ProductStockStatus.objects.refresh(options['products'])
+        opened, updated, resolved = alerts.evaluate(options['products'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed stock status for {count} products; alerts: "
+            f"{opened} opened, {updated} updated, {resolved} resolved"
+        ))
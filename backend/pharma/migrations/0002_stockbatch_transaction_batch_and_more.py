@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_number', models.CharField(blank=True, max_length=100)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.PositiveIntegerField(default=0)),
+                ('unit_cost', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='pharma.product')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='batches', to='pharma.supplier')),
+            ],
+            options={
+                'ordering': ['expiry_date', 'created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='pharma.stockbatch'),
+        ),
+        migrations.AddIndex(
+            model_name='stockbatch',
+            index=models.Index(fields=['product', 'expiry_date'], name='pharma_stoc_product_eb28b8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockbatch',
+            index=models.Index(fields=['product', 'lot_number'], name='pharma_stoc_product_1ba8c2_idx'),
+        ),
+    ]
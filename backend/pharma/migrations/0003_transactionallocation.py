@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0002_stockbatch_transaction_batch_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('batch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocations', to='pharma.stockbatch')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='pharma.transaction')),
+            ],
+            options={
+                'ordering': ['transaction', 'id'],
+            },
+        ),
+    ]
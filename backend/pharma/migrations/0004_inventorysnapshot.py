@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0003_transactionallocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('last_transaction_id', models.BigIntegerField(default=0, help_text='Ledger position covered: all transactions with id <= this value')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='pharma.product')),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+                'indexes': [models.Index(fields=['product', '-last_transaction_id'], name='pharma_inve_product_2159e9_idx')],
+            },
+        ),
+    ]
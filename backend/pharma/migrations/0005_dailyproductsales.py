@@ -0,0 +1,64 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:40
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def build_rollup(apps, schema_editor):
+    """Roll up the existing ledger; postings maintain the rows from here on"""
+    db = schema_editor.connection.alias
+    Transaction = apps.get_model('pharma', 'Transaction')
+    DailyProductSales = apps.get_model('pharma', 'DailyProductSales')
+    out = Q(transaction_type='OUT')
+    grouped = (Transaction.objects.using(db).order_by()
+               .annotate(day=TruncDate('created_at'))
+               .values('product_id', 'day')
+               .annotate(
+                   qty_out=Coalesce(Sum(-F('quantity'), filter=out), 0),
+                   qty_in=Coalesce(Sum('quantity', filter=Q(transaction_type='IN')), 0),
+                   revenue=Coalesce(
+                       Sum(-F('quantity') * F('unit_price'), filter=out,
+                           output_field=models.DecimalField(max_digits=14, decimal_places=2)),
+                       Decimal('0'),
+                   ),
+                   out_count=Count('pk', filter=out),
+                   txn_count=Count('pk'),
+               ))
+    DailyProductSales.objects.using(db).bulk_create([
+        DailyProductSales(product_id=g['product_id'], date=g['day'], qty_out=g['qty_out'], qty_in=g['qty_in'],
+                          revenue=g['revenue'], out_count=g['out_count'], txn_count=g['txn_count'])
+        for g in grouped
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0004_inventorysnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('qty_out', models.PositiveIntegerField(default=0, help_text='Units dispensed (OUT)')),
+                ('qty_in', models.PositiveIntegerField(default=0, help_text='Units received (IN)')),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('out_count', models.PositiveIntegerField(default=0, help_text='Number of OUT transactions')),
+                ('txn_count', models.PositiveIntegerField(default=0, help_text='Number of transactions of any type')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='pharma.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily product sales',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='pharma_dail_date_e1fef1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='uniq_daily_sales_product_date')],
+            },
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0005_dailyproductsales'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='sharded',
+            field=models.BooleanField(default=False, help_text='Hot product: writes go to InventoryShard rows and are folded in periodically'),
+        ),
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('delta', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_shards', to='pharma.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'shard'), name='uniq_inventory_shard')],
+            },
+        ),
+    ]
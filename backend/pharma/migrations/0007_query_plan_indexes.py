@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0006_inventory_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stockbatch',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['expiry_date'], name='stockbatch_live_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockbatch',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date', 'created_at'], name='stockbatch_live_fefo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created_at'], name='pharma_tran_created_16413d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'created_at'], name='pharma_tran_transac_3ba67d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['product', 'transaction_type', 'created_at'], name='pharma_tran_product_d5ca91_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['product', 'created_at'], name='pharma_tran_product_c8e69e_idx'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:47
+
+import django.db.models.deletion
+from datetime import timedelta
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+COVER_WINDOW_DAYS = 30
+
+
+def build_stock_status(apps, schema_editor):
+    """One status row per existing product; postings and lot edits keep them current from here on"""
+    db = schema_editor.connection.alias
+    Product = apps.get_model('pharma', 'Product')
+    InventoryShard = apps.get_model('pharma', 'InventoryShard')
+    StockBatch = apps.get_model('pharma', 'StockBatch')
+    DailyProductSales = apps.get_model('pharma', 'DailyProductSales')
+    ProductStockStatus = apps.get_model('pharma', 'ProductStockStatus')
+
+    since = timezone.localdate() - timedelta(days=COVER_WINDOW_DAYS)
+    shard_deltas = (InventoryShard.objects.using(db).filter(product=OuterRef('pk')).order_by()
+                    .values('product').annotate(total=Sum('delta')).values('total'))
+    live_lots = StockBatch.objects.using(db).filter(product=OuterRef('pk'), quantity__gt=0,
+                                                    expiry_date__isnull=False)
+    recent_sales = (DailyProductSales.objects.using(db).filter(product=OuterRef('pk'), date__gte=since)
+                    .order_by().values('product').annotate(total=Sum('qty_out')).values('total'))
+    rows = Product.objects.using(db).order_by().annotate(
+        on_hand=Coalesce(F('inventory__quantity'), 0)
+        + Coalesce(Subquery(shard_deltas, output_field=IntegerField()), 0),
+        next_expiry=Subquery(live_lots.order_by('expiry_date').values('expiry_date')[:1]),
+        sold=Coalesce(Subquery(recent_sales), 0),
+    ).values_list('pk', 'reorder_level', 'unit_price', 'on_hand', 'next_expiry', 'sold')
+
+    statuses = []
+    for pid, reorder_level, unit_price, on_hand, next_expiry, sold in rows:
+        daily = sold / COVER_WINDOW_DAYS
+        statuses.append(ProductStockStatus(
+            product_id=pid,
+            quantity=on_hand,
+            is_low=on_hand <= reorder_level,
+            is_out=on_hand <= 0,
+            days_of_cover=round(on_hand / daily, 1) if daily else None,
+            next_expiry=next_expiry,
+            stock_value=on_hand * unit_price,
+        ))
+    ProductStockStatus.objects.using(db).bulk_create(statuses, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0007_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductStockStatus',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_status', serialize=False, to='pharma.product')),
+                ('quantity', models.IntegerField(default=0)),
+                ('is_low', models.BooleanField(default=True, help_text='Stock at or below the reorder level')),
+                ('is_out', models.BooleanField(default=True)),
+                ('days_of_cover', models.FloatField(blank=True, help_text='Stock / average daily units out (last 30 days)', null=True)),
+                ('next_expiry', models.DateField(blank=True, help_text='Earliest expiry of a lot with stock', null=True)),
+                ('stock_value', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Product stock statuses',
+                'indexes': [models.Index(condition=models.Q(('is_low', True)), fields=['quantity'], name='stockstatus_low_idx'), models.Index(condition=models.Q(('is_out', True)), fields=['product'], name='stockstatus_out_idx'), models.Index(condition=models.Q(('next_expiry__isnull', False)), fields=['next_expiry'], name='stockstatus_expiry_idx')],
+            },
+        ),
+        migrations.RunPython(build_stock_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:57
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0009_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InsightSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('computed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('last_transaction_id', models.BigIntegerField(default=0, help_text='Newest ledger row the snapshot has seen; later rows count as stock movements')),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-computed_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-17 01:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0010_insightsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Alert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('out_of_stock', 'Out of stock'), ('low_stock', 'Low stock'), ('urgent_reorder', 'Urgent reorder'), ('expiring', 'Expiring lot')], max_length=20)),
+                ('severity', models.CharField(choices=[('critical', 'Critical'), ('high', 'High')], max_length=10)),
+                ('message', models.CharField(max_length=255)),
+                ('opened_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alerts', to='pharma.product')),
+            ],
+            options={
+                'ordering': ['-opened_at'],
+                'indexes': [models.Index(condition=models.Q(('resolved_at__isnull', True)), fields=['kind', 'severity', 'updated_at'], name='alert_open_summary_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('resolved_at__isnull', True)), fields=('product', 'kind'), name='uniq_open_alert')],
+            },
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:08
+
+import django.db.models.deletion
+from datetime import timedelta
+from django.db import migrations, models
+from django.utils import timezone
+
+RATE_SPANS = {'rate_7': 7, 'rate_30': 30}
+
+
+def fold_days(stats, qty, zero_days):
+    """Close a daily bucket of `qty` and `zero_days` quiet days into the running stats (models._fold_days)"""
+    n = stats['days'] + 1
+    delta = qty - stats['mean']
+    stats['mean'] += delta / n
+    stats['m2'] += delta * (qty - stats['mean'])
+    for field, span in RATE_SPANS.items():
+        alpha = 2 / (span + 1)
+        stats[field] = (stats[field] + alpha * (qty - stats[field])) * (1 - alpha) ** zero_days
+    if zero_days:
+        total = n + zero_days
+        stats['m2'] += stats['mean'] ** 2 * n * zero_days / total
+        stats['mean'] *= n / total
+        n = total
+    stats['days'] = n
+    return stats
+
+
+def build_demand_stats(apps, schema_editor):
+    """
+    Replay the daily sales rollup into one stats row per product that has
+    sold, then move the status rows' days of cover onto the 30-day rate.
+    """
+    db = schema_editor.connection.alias
+    DailyProductSales = apps.get_model('pharma', 'DailyProductSales')
+    ProductDemandStats = apps.get_model('pharma', 'ProductDemandStats')
+    ProductStockStatus = apps.get_model('pharma', 'ProductStockStatus')
+
+    rows = {}
+    sales = (DailyProductSales.objects.using(db).filter(qty_out__gt=0).order_by('product_id', 'date')
+             .values_list('product_id', 'date', 'qty_out'))
+    for pid, day, qty in sales.iterator(chunk_size=500):
+        row = rows.get(pid)
+        if row is None:
+            row = rows[pid] = {'day': day, 'day_qty': 0, 'days': 0, 'mean': 0.0, 'm2': 0.0,
+                               'rate_7': 0.0, 'rate_30': 0.0}
+        elif day > row['day']:
+            fold_days(row, row['day_qty'], (day - row['day']).days - 1)
+            row['day'], row['day_qty'] = day, 0
+        row['day_qty'] += qty
+        row['last_sale'] = day
+    ProductDemandStats.objects.using(db).bulk_create(
+        [ProductDemandStats(product_id=pid, **row) for pid, row in rows.items()], batch_size=500)
+
+    # Days of cover as of tomorrow, so today's sales count, with the rate bias-corrected
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    statuses = list(ProductStockStatus.objects.using(db).filter(product_id__in=rows))
+    for status in statuses:
+        stats = dict(rows[status.product_id])
+        if tomorrow > stats['day']:
+            fold_days(stats, stats['day_qty'], (tomorrow - stats['day']).days - 1)
+        rate = stats['rate_30'] / (1 - (1 - 2 / 31) ** stats['days']) if stats['days'] else 0
+        status.days_of_cover = round(status.quantity / rate, 1) if rate else None
+    ProductStockStatus.objects.using(db).bulk_update(statuses, ['days_of_cover'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0011_alert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDemandStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='demand_stats', serialize=False, to='pharma.product')),
+                ('day', models.DateField(help_text='Open daily bucket')),
+                ('day_qty', models.PositiveIntegerField(default=0, help_text='Units dispensed so far on `day`')),
+                ('days', models.PositiveIntegerField(default=0, help_text='Closed daily buckets folded into the stats')),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0, help_text='Welford sum of squared deviations')),
+                ('rate_7', models.FloatField(default=0, help_text='EWMA of daily units, 7-day span')),
+                ('rate_30', models.FloatField(default=0, help_text='EWMA of daily units, 30-day span')),
+                ('last_sale', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Product demand stats',
+            },
+        ),
+        migrations.AlterField(
+            model_name='productstockstatus',
+            name='days_of_cover',
+            field=models.FloatField(blank=True, help_text='Stock / 30-day EWMA of daily units out', null=True),
+        ),
+        migrations.RunPython(build_demand_stats, migrations.RunPython.noop),
+    ]
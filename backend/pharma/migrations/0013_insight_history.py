@@ -0,0 +1,77 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:13
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0012_productdemandstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='average_daily_sales',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='average_stockout_risk',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='daily_holding_cost',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='forecast_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='health_score',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='high_risk_products',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='total_forecasted_demand',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='insightsnapshot',
+            name='urgent_reorders',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='insightsnapshot',
+            name='data',
+            field=models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text='Full payload; emptied once the snapshot is history'),
+        ),
+        migrations.CreateModel(
+            name='InsightForecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('forecasted_demand', models.FloatField()),
+                ('avg_daily_demand', models.FloatField()),
+                ('stockout_risk', models.FloatField()),
+                ('current_stock', models.IntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='insight_forecasts', to='pharma.product')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='forecasts', to='pharma.insightsnapshot')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'snapshot'], name='insight_forecast_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('snapshot', 'product'), name='uniq_insight_forecast')],
+            },
+        ),
+    ]
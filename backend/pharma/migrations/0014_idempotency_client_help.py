@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 02:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharma', '0013_insight_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='idempotencyrecord',
+            name='client',
+            field=models.CharField(help_text='User id, or X-Client-Id for anonymous clients', max_length=64),
+        ),
+    ]
@@ -1,10 +1,24 @@
+import random
+from datetime import timedelta
 from decimal import Decimal
 
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.db import transaction as db_txn
+from django.db.models import (Case, Count, F, IntegerField, Max, OuterRef, Q,
+                              Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce, TruncDate, TruncHour
 from django.utils import timezone
 
+from .signals import posting, send_posted
+
+# Keys per grouped UPDATE; keeps CASE/WHEN parameter counts well under SQLite's limit
+DELTA_CHUNK_SIZE = 500
+
 
 class Category(models.Model):
     """Product categories for organizing inventory"""
@@ -57,27 +71,238 @@ class Product(models.Model):
     def __str__(self):
         return f"{self.name} ({self.sku})"
 
+def shard_count():
+    """Delta rows per product in sharded counter mode (settings.PHARMA_INVENTORY_SHARDS)"""
+    return getattr(settings, 'PHARMA_INVENTORY_SHARDS', 8)
+
+
+def unfolded_shard_delta(product_ref=None):
+    """
+    Expression: sum of a product's not-yet-folded InventoryShard deltas (0 if
+    none). `product_ref` defaults to OuterRef('product') for Inventory querysets.
+    """
+    if product_ref is None:
+        product_ref = OuterRef('product')
+    deltas = (InventoryShard.objects.filter(product=product_ref).order_by()
+              .values('product').annotate(total=Sum('delta')).values('total'))
+    return Coalesce(Subquery(deltas, output_field=IntegerField()), 0)
+
+
+class InventoryQuerySet(models.QuerySet):
+    def with_stock(self):
+        """Annotate `on_hand_db`: the counter plus any unfolded shard deltas"""
+        return self.annotate(on_hand_db=F('quantity') + unfolded_shard_delta())
+
+
+class InventoryManager(models.Manager.from_queryset(InventoryQuerySet)):
+    """Stock counter writes, transparently routed to shards for hot products"""
+
+    def apply_deltas(self, deltas, sharded=None):
+        """
+        Add {product_id: delta} to stock. Unsharded products get one grouped
+        UPDATE on Inventory; sharded ones add to one random shard each, so
+        concurrent writers for a hot product rarely touch the same row.
+        """
+        deltas = {pid: d for pid, d in deltas.items() if d}
+        if not deltas:
+            return
+        if sharded is None:
+            sharded = set(self.filter(product_id__in=deltas, sharded=True)
+                          .values_list('product_id', flat=True))
+        k = shard_count()
+        _apply_deltas(self.model, {pid: d for pid, d in deltas.items() if pid not in sharded},
+                      key='product_id', touch='last_updated')
+        _apply_deltas(InventoryShard,
+                      {(pid, random.randrange(k)): d for pid, d in deltas.items() if pid in sharded},
+                      field='delta', key=('product_id', 'shard'))
+
+    def enable_sharding(self, product_ids):
+        """Switch products to sharded counter mode, creating their K shard rows"""
+        with db_txn.atomic():
+            self.bulk_create([self.model(product_id=pid) for pid in product_ids], ignore_conflicts=True)
+            InventoryShard.objects.bulk_create(
+                [InventoryShard(product_id=pid, shard=i) for pid in product_ids for i in range(shard_count())],
+                ignore_conflicts=True,
+            )
+            return self.filter(product_id__in=product_ids).update(sharded=True)
+
+    def disable_sharding(self, product_ids):
+        """Fold outstanding deltas and return products to a single counter row"""
+        with db_txn.atomic():
+            self.filter(product_id__in=product_ids).update(sharded=False)
+            self.fold_shards(product_ids)
+            InventoryShard.objects.filter(product_id__in=product_ids).delete()
+
+    def fold_shards(self, product_ids=None):
+        """
+        Merge shard deltas into Inventory.quantity. Shards are decremented by
+        the amount folded (not zeroed), so writes racing the fold are kept.
+        Returns the number of products folded.
+        """
+        shards = InventoryShard.objects.exclude(delta=0)
+        if product_ids is not None:
+            shards = shards.filter(product_id__in=product_ids)
+        with db_txn.atomic():
+            pending = list(shards.select_for_update().values_list('pk', 'product_id', 'delta'))
+            totals = {}
+            for _, pid, delta in pending:
+                totals[pid] = totals.get(pid, 0) + delta
+            _apply_deltas(self.model, totals, key='product_id', touch='last_updated')
+            _apply_deltas(InventoryShard, {pk: -delta for pk, _, delta in pending}, field='delta')
+        return len(totals)
+
+
 class Inventory(models.Model):
     """Current inventory levels for products"""
     product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='inventory')
     quantity = models.PositiveIntegerField(default=0)
+    sharded = models.BooleanField(
+        default=False,
+        help_text="Hot product: writes go to InventoryShard rows and are folded in periodically"
+    )
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = InventoryManager()
+
     class Meta:
         verbose_name_plural = "Inventories"
 
     def __str__(self):
-        return f"{self.product.name}: {self.quantity} units"
+        return f"{self.product.name}: {self.on_hand} units"
+
+    @property
+    def on_hand(self):
+        """Stock on hand: the counter plus any unfolded shard deltas"""
+        if hasattr(self, 'on_hand_db'):
+            return self.on_hand_db
+        if not self.sharded:
+            return self.quantity
+        shards = InventoryShard.objects.filter(product_id=self.product_id)
+        return self.quantity + (shards.aggregate(total=Sum('delta'))['total'] or 0)
 
     @property
     def total_value(self):
         """Calculate total inventory value"""
-        return self.quantity * self.product.unit_price
+        return self.on_hand * self.product.unit_price
 
     @property
     def is_low_stock(self):
         """Check if stock is below reorder level"""
-        return self.quantity <= self.product.reorder_level
+        return self.on_hand <= self.product.reorder_level
+
+    def add(self, delta):
+        """Apply a stock delta to this row, or to one random shard in sharded mode"""
+        if self.sharded:
+            Inventory.objects.apply_deltas({self.product_id: delta}, sharded={self.product_id})
+        else:
+            self.quantity = max(0, self.quantity + delta)
+            self.save(update_fields=['quantity'])
+
+
+class InventoryShard(models.Model):
+    """One of K delta rows for a hot product's stock counter (see Inventory.sharded)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_shards')
+    shard = models.PositiveSmallIntegerField()
+    delta = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='uniq_inventory_shard'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}#{self.shard}: {self.delta:+d}"
+
+
+def _apply_deltas(model, deltas, field='quantity', key='pk', touch=None):
+    """
+    Add per-row deltas to `field` with one grouped UPDATE per chunk:
+    UPDATE ... SET field = field + CASE key WHEN k1 THEN d1 ... END WHERE key IN (...)
+    """
+    _apply_field_deltas(model, {k: {field: d} for k, d in deltas.items()}, key=key, touch=touch)
+
+
+def _apply_field_deltas(model, deltas, key='pk', touch=None):
+    """
+    Multi-column form of _apply_deltas: `deltas` maps key -> {field: delta}.
+    `key` may be a tuple of field names for composite keys; rows are then
+    matched with one IN list per component and non-matching rows get +0.
+    """
+    deltas = {k: d for k, d in deltas.items() if any(d.values())}
+    names = key if isinstance(key, tuple) else (key,)
+    keys = list(deltas)
+    for start in range(0, len(keys), DELTA_CHUNK_SIZE):
+        chunk = keys[start:start + DELTA_CHUNK_SIZE]
+        components = [k if isinstance(key, tuple) else (k,) for k in chunk]
+        fields = {f for k in chunk for f in deltas[k]}
+        updates = {}
+        for field in fields:
+            output_field = model._meta.get_field(field)
+            updates[field] = F(field) + Case(
+                *[When(**dict(zip(names, c)), then=Value(deltas[k].get(field, 0), output_field=output_field))
+                  for k, c in zip(chunk, components)],
+                default=Value(0, output_field=output_field),
+                output_field=output_field,
+            )
+        if touch:
+            updates[touch] = timezone.now()
+        lookup = {f'{name}__in': {c[i] for c in components} for i, name in enumerate(names)}
+        model.objects.filter(**lookup).update(**updates)
+
+
+class StockBatchManager(models.Manager):
+    """Manager with the FEFO allocation engine for multi-lot dispensing"""
+
+    def plan_fefo(self, demands):
+        """
+        Split OUT quantities across lots, earliest expiry first (FEFO).
+
+        `demands` maps product_id -> units. One locked, ordered scan of the
+        candidate lots for every product; nothing is written here.
+        Returns (plan, short): plan is {product_id: [(batch, units), ...]} and
+        short is {product_id: units that no lot could cover}.
+        """
+        demands = {pid: qty for pid, qty in demands.items() if qty > 0}
+        if not demands:
+            return {}, {}
+
+        lots = (self.select_for_update()
+                .filter(product_id__in=demands, quantity__gt=0)
+                .order_by('product_id', F('expiry_date').asc(nulls_last=True), 'created_at', 'pk'))
+
+        remaining = dict(demands)
+        plan = {pid: [] for pid in demands}
+        for batch in lots:
+            need = remaining[batch.product_id]
+            if need == 0:
+                continue
+            take = min(need, batch.quantity)
+            plan[batch.product_id].append((batch, take))
+            remaining[batch.product_id] = need - take
+
+        short = {pid: need for pid, need in remaining.items() if need > 0}
+        return plan, short
+
+    def allocate_fefo(self, demands):
+        """plan_fefo, raising ValidationError naming every product that is short"""
+        plan, short = self.plan_fefo(demands)
+        if short:
+            raise ValidationError(
+                "Insufficient batch stock for FEFO allocation: " + ", ".join(
+                    f"product {pid} short by {need}" for pid, need in sorted(short.items())
+                )
+            )
+        return plan
+
+    def consume(self, plan):
+        """Apply an allocate_fefo plan with one grouped UPDATE over all lots"""
+        deltas = {}
+        for allocations in plan.values():
+            for batch, units in allocations:
+                deltas[batch.pk] = deltas.get(batch.pk, 0) - units
+                batch.quantity -= units
+        _apply_deltas(self.model, deltas, touch='updated_at')
+
 
 class StockBatch(models.Model):
     """Per-lot inventory with its own expiry"""
@@ -92,11 +317,19 @@ class StockBatch(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StockBatchManager()
+
     class Meta:
         ordering = ['expiry_date', 'created_at']
         indexes = [
             models.Index(fields=['product', 'expiry_date']),
             models.Index(fields=['product', 'lot_number']),
+            # Only lots with stock left are dispensed or reported as expiring;
+            # empty lots pile up over time, so keep them out of these indexes.
+            models.Index(fields=['expiry_date'], condition=Q(quantity__gt=0),
+                         name='stockbatch_live_expiry_idx'),
+            models.Index(fields=['product', 'expiry_date', 'created_at'], condition=Q(quantity__gt=0),
+                         name='stockbatch_live_fefo_idx'),
         ]
         constraints = []
 
@@ -115,8 +348,263 @@ class StockBatch(models.Model):
         return (self.expiry_date - timezone.now().date()).days
 
 
+class TransactionManager(models.Manager):
+    """Manager with set-based ingestion for high-volume stock movements"""
+
+    def bulk_ingest(self, rows):
+        """
+        Post many IN transactions with the same side effects as Transaction.save,
+        using a constant number of statements instead of 4-5 round trips per line.
+
+        Each row is a dict with:
+          product / product_id   (required)
+          quantity               (required, > 0)
+          unit_price, reference, notes, created_at
+          batch / batch_id       receive into an existing lot, or
+          lot_number, expiry_date, unit_cost, supplier / supplier_id, received_at
+                                 to open a new lot for the line
+
+        Returns the created Transaction objects (with product and batch attached).
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+
+        lines = []
+        for i, row in enumerate(rows):
+            txn_type = row.get('transaction_type', 'IN')
+            if txn_type != 'IN':
+                raise ValidationError(f"Row {i}: bulk_ingest only supports IN transactions.")
+            try:
+                qty = int(row['quantity'])
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError(f"Row {i}: quantity must be an integer.")
+            if qty <= 0:
+                raise ValidationError(f"Row {i}: IN transactions must have positive quantity.")
+            product = row.get('product')
+            product_id = product.pk if product is not None else row.get('product_id')
+            if product_id is None:
+                raise ValidationError(f"Row {i}: product is required.")
+            lines.append((row, product_id, qty))
+
+        product_ids = {pid for _, pid, _ in lines}
+        known = set(Product.objects.filter(pk__in=product_ids).order_by().values_list('pk', flat=True))
+        missing = product_ids - known
+        if missing:
+            raise ValidationError(f"Unknown product ids: {sorted(missing)}")
+
+        existing_batch_ids = {
+            (row['batch'].pk if row.get('batch') is not None else row['batch_id'])
+            for row, _, _ in lines if row.get('batch') is not None or row.get('batch_id')
+        }
+        batches = StockBatch.objects.in_bulk(existing_batch_ids)
+        for row, pid, _ in lines:
+            batch = row.get('batch')
+            bid = batch.pk if batch is not None else row.get('batch_id')
+            if bid and (bid not in batches or batches[bid].product_id != pid):
+                raise ValidationError(f"Batch {bid} does not belong to product {pid}.")
+
+        with db_txn.atomic():
+            # 1. New lots are created with their final quantity in one INSERT
+            new_batches = []
+            for row, pid, qty in lines:
+                if row.get('batch') is None and not row.get('batch_id'):
+                    supplier = row.get('supplier')
+                    new_batches.append(StockBatch(
+                        product_id=pid,
+                        lot_number=row.get('lot_number', ''),
+                        expiry_date=row.get('expiry_date'),
+                        quantity=qty,
+                        unit_cost=row.get('unit_cost'),
+                        supplier_id=supplier.pk if supplier is not None else row.get('supplier_id'),
+                        received_at=row.get('received_at') or timezone.now(),
+                    ))
+            new_batches = iter(StockBatch.objects.bulk_create(new_batches))
+
+            # 2. Existing lots are topped up with one grouped UPDATE
+            batch_deltas = {}
+            txns = []
+            for row, pid, qty in lines:
+                batch = row.get('batch')
+                bid = batch.pk if batch is not None else row.get('batch_id')
+                if bid:
+                    batch = batches[bid]
+                    batch_deltas[bid] = batch_deltas.get(bid, 0) + qty
+                else:
+                    batch = next(new_batches)
+                txn = self.model(
+                    product_id=pid,
+                    batch=batch,
+                    transaction_type='IN',
+                    quantity=qty,
+                    unit_price=row.get('unit_price'),
+                    reference=row.get('reference', ''),
+                    notes=row.get('notes', ''),
+                )
+                if row.get('product') is not None:
+                    txn.product = row['product']
+                txns.append(txn)
+            _apply_deltas(StockBatch, batch_deltas, touch='updated_at')
+            for bid, delta in batch_deltas.items():
+                batches[bid].quantity += delta
+
+            # 3. Ledger rows in one INSERT; backdated rows get one grouped UPDATE
+            txns = self.bulk_create(txns)
+            backdated = {t.pk: row['created_at']
+                         for t, (row, _, _) in zip(txns, lines) if row.get('created_at')}
+            if backdated:
+                self._backdate(backdated)
+                for t, (row, _, _) in zip(txns, lines):
+                    if row.get('created_at'):
+                        t.created_at = row['created_at']
+
+            # 4. Inventory rows: create missing shells, then one grouped UPDATE
+            inventory_deltas = {}
+            for _, pid, qty in lines:
+                inventory_deltas[pid] = inventory_deltas.get(pid, 0) + qty
+            Inventory.objects.bulk_create(
+                [Inventory(product_id=pid) for pid in inventory_deltas],
+                ignore_conflicts=True,
+            )
+            sharded = set(Inventory.objects.filter(product_id__in=inventory_deltas, sharded=True)
+                          .values_list('product_id', flat=True))
+            Inventory.objects.apply_deltas(inventory_deltas, sharded=sharded)
+
+            send_posted(self.model, txns, sharded)
+
+        return txns
+
+    def bulk_dispense(self, rows):
+        """
+        Post many OUT transactions all-or-nothing, with lots allocated FEFO.
+
+        Each row is a dict with product / product_id, quantity (units to
+        dispense, > 0), and optional unit_price (defaults to the product's
+        price), reference and notes.
+
+        Products, inventories and locked candidate lots are read up front and
+        every line is checked in memory before anything is written. Inventory
+        rows are locked too, except for sharded products: their stock is read
+        from the counter plus shards, and the lot locks keep concurrent
+        dispenses from overdrawing it. If any
+        line fails, ValidationError is raised with message_dict mapping the
+        line index to its errors and nothing is written. Otherwise the ledger
+        rows, allocations, lot and inventory decrements are each applied with
+        one set-based statement.
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+
+        errors = {}
+        lines = []
+        for i, row in enumerate(rows):
+            product = row.get('product')
+            product_id = product.pk if product is not None else row.get('product_id')
+            if product_id is None:
+                errors[i] = 'Product is required.'
+                continue
+            try:
+                qty = int(row.get('quantity'))
+            except (TypeError, ValueError):
+                errors[i] = 'Quantity must be an integer.'
+                continue
+            if qty <= 0:
+                errors[i] = 'Quantity must be positive.'
+                continue
+            lines.append((i, row, product_id, qty))
+
+        with db_txn.atomic():
+            products = Product.objects.in_bulk([pid for _, _, pid, _ in lines])
+            inventories = {
+                inv.product_id: inv
+                for inv in Inventory.objects.select_for_update().filter(product_id__in=products, sharded=False)
+                .with_stock()
+            }
+            if len(inventories) < len(products):
+                inventories.update(
+                    (inv.product_id, inv)
+                    for inv in Inventory.objects.filter(product_id__in=set(products) - set(inventories)).with_stock()
+                )
+
+            demands = {}
+            for i, row, pid, qty in lines:
+                if pid not in products:
+                    errors[i] = f'Product {pid} does not exist.'
+                    continue
+                demands[pid] = demands.get(pid, 0) + qty
+            plan, short = StockBatch.objects.plan_fefo(demands)
+
+            for i, row, pid, qty in lines:
+                if i in errors:
+                    continue
+                available = inventories[pid].on_hand if pid in inventories else 0
+                if available < demands[pid]:
+                    errors[i] = f'Insufficient stock for product {pid}: available {available}, requested {demands[pid]}.'
+                elif pid in short:
+                    errors[i] = f'Insufficient batch stock for product {pid}: lots are short by {short[pid]}.'
+            if errors:
+                raise ValidationError({i: errors[i] for i in sorted(errors)})
+
+            # Hand each line its slice of the product's FEFO plan
+            queues = {pid: [list(a) for a in allocations] for pid, allocations in plan.items()}
+            txns, line_allocations = [], []
+            for i, row, pid, qty in lines:
+                taken, need = [], qty
+                queue = queues[pid]
+                while need:
+                    batch, units = queue[0]
+                    take = min(units, need)
+                    taken.append((batch, take))
+                    need -= take
+                    if take == units:
+                        queue.pop(0)
+                    else:
+                        queue[0][1] = units - take
+                product = row.get('product') or products[pid]
+                unit_price = row.get('unit_price')
+                txns.append(self.model(
+                    product=product,
+                    batch=taken[0][0],
+                    transaction_type='OUT',
+                    quantity=-qty,
+                    unit_price=unit_price if unit_price is not None else product.unit_price,
+                    reference=row.get('reference', ''),
+                    notes=row.get('notes', ''),
+                ))
+                line_allocations.append(taken)
+
+            txns = self.bulk_create(txns)
+            TransactionAllocation.objects.bulk_create([
+                TransactionAllocation(transaction=txn, batch=batch, quantity=units)
+                for txn, taken in zip(txns, line_allocations)
+                for batch, units in taken
+            ])
+            StockBatch.objects.consume(plan)
+            sharded = {pid for pid, inv in inventories.items() if inv.sharded}
+            Inventory.objects.apply_deltas({pid: -units for pid, units in demands.items()}, sharded=sharded)
+
+            send_posted(self.model, txns, sharded)
+
+        return txns
+
+    def _backdate(self, created_at_by_pk):
+        """Set created_at on already-inserted rows (auto_now_add ignores given values)"""
+        keys = list(created_at_by_pk)
+        for start in range(0, len(keys), DELTA_CHUNK_SIZE):
+            chunk = keys[start:start + DELTA_CHUNK_SIZE]
+            self.filter(pk__in=chunk).update(created_at=Case(
+                *[When(pk=k, then=Value(created_at_by_pk[k])) for k in chunk],
+                output_field=models.DateTimeField(),
+            ))
+
+
 class Transaction(models.Model):
-    """Inventory transactions (in/out)"""
+    """
+    Inventory transactions (in/out). The table is an append-only ledger:
+    current stock is the running sum of `quantity`, checkpointed by
+    InventorySnapshot, and Inventory.quantity is a cache of that sum.
+    """
     TRANSACTION_TYPES = [
         ('IN', 'Stock In'),
         ('OUT', 'Stock Out'),
@@ -132,8 +620,19 @@ class Transaction(models.Model):
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TransactionManager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # recent/today listings, rollup rebuilds, activity counts
+            models.Index(fields=['created_at']),
+            # type-filtered ranges (ledger listing filter, IN/OUT reports)
+            models.Index(fields=['transaction_type', 'created_at']),
+            # per-product movement history and demand series
+            models.Index(fields=['product', 'transaction_type', 'created_at']),
+            models.Index(fields=['product', 'created_at']),
+        ]
 
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.product.name}: {self.quantity}"
@@ -146,60 +645,654 @@ class Transaction(models.Model):
         if self.batch and self.batch.product_id != self.product_id:
             raise ValidationError("Selected batch does not belong to this product.")
 
-    def _get_fefo_batch(self, required_qty):
+    def _allocate_out(self, needed):
         """
-        Pick the earliest-expiring batch with sufficient qty (FEFO).
-        Simple version: must fit in a single batch; else raise.
+        Draw `needed` units from the chosen batch, or split them across lots
+        in FEFO order, recording one TransactionAllocation per lot touched.
         """
-        return (StockBatch.objects
-                .select_for_update()
-                .filter(product=self.product, quantity__gte=required_qty)
-                .order_by('expiry_date', 'created_at')
-                .first())
+        if self.batch:
+            if self.batch.quantity < needed:
+                raise ValidationError(
+                    f"Batch {self.batch.id} has only {self.batch.quantity}, but {needed} requested."
+                )
+            plan = {self.product_id: [(self.batch, needed)]}
+        else:
+            plan = StockBatch.objects.allocate_fefo({self.product_id: needed})
+
+        StockBatch.objects.consume(plan)
+        allocations = plan[self.product_id]
+        TransactionAllocation.objects.bulk_create([
+            TransactionAllocation(transaction=self, batch=batch, quantity=units)
+            for batch, units in allocations
+        ])
+
+        if self.batch is None:
+            # Earliest lot stays on the row for display; allocations hold the full split
+            self.batch = allocations[0][0]
+            Transaction.objects.filter(pk=self.pk).update(batch=self.batch)
 
     def save(self, *args, **kwargs):
-        """Override save to update inventory and (now) batch levels."""
-        is_new = self.pk is None
+        """
+        Post a new movement: update inventory and batch levels. Saved rows
+        are never edited; correct them with a reversing ADJUST.
+        """
+        if self.pk is not None:
+            raise ValidationError(
+                "Posted transactions cannot be changed; record a reversing ADJUST transaction instead."
+            )
 
         self.clean()
 
-        super().save(*args, **kwargs)
+        # A failed allocation must not leave the ledger row behind
+        with db_txn.atomic(), posting():
+            super().save(*args, **kwargs)
 
-        if is_new:
             inventory, _ = Inventory.objects.get_or_create(product=self.product)
 
             if self.transaction_type == 'IN':
                 if self.batch is None:
                     self.batch = StockBatch.objects.create(
                         product=self.product,
-                        quantity=0,  
+                        quantity=0,
                     )
-                    
+
                     Transaction.objects.filter(pk=self.pk).update(batch=self.batch)
 
                 self.batch.quantity += self.quantity
                 self.batch.save(update_fields=['quantity'])
 
-                inventory.quantity += self.quantity
-                inventory.save(update_fields=['quantity'])
+                inventory.add(self.quantity)
 
             elif self.transaction_type == 'OUT':
                 needed = abs(self.quantity)
+                self._allocate_out(needed)
 
-                if self.batch:
-                    if self.batch.quantity < needed:
-                        raise ValidationError(
-                            f"Batch {self.batch.id} has only {self.batch.quantity}, but {needed} requested."
-                        )
-                    self.batch.quantity -= needed
-                    self.batch.save(update_fields=['quantity'])
-                else:
-                    fefo = self._get_fefo_batch(needed)
-                    if not fefo:
-                        raise ValidationError("No batch with sufficient quantity for FEFO allocation.")
-                    fefo.quantity -= needed
-                    fefo.save(update_fields=['quantity'])
-                    Transaction.objects.filter(pk=self.pk).update(batch=fefo)
-
-                inventory.quantity = max(0, inventory.quantity - needed)
-                inventory.save(update_fields=['quantity'])
+                inventory.add(-needed)
+
+            elif self.transaction_type == 'ADJUST':
+                on_hand = inventory.on_hand
+                if on_hand + self.quantity < 0:
+                    raise ValidationError(
+                        f"Adjustment of {self.quantity} would take stock below zero "
+                        f"(current {on_hand})."
+                    )
+                inventory.add(self.quantity)
+
+            send_posted(Transaction, [self], {self.product_id} if inventory.sharded else ())
+
+
+class TransactionAllocation(models.Model):
+    """Units of an OUT transaction drawn from one lot (a dispense may span several)"""
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='allocations')
+    batch = models.ForeignKey(StockBatch, on_delete=models.SET_NULL, null=True, related_name='allocations')
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['transaction', 'id']
+
+    def __str__(self):
+        return f"Txn {self.transaction_id} <- batch {self.batch_id}: {self.quantity}"
+
+
+class InventorySnapshotManager(models.Manager):
+    """Ledger checkpoints and snapshot-plus-tail stock balances"""
+
+    def ledger_balances(self, product_ids=None, upto=None):
+        """
+        Stock per product recomputed from the ledger as
+        latest snapshot quantity + SUM(quantity) of transactions after it.
+
+        One grouped query over Product with correlated subqueries, so the
+        cost follows the ledger tail, not the whole history. `upto` caps the
+        tail at a transaction id. Returns {product_id: quantity}.
+        """
+        latest = self.filter(product=OuterRef('pk')).order_by('-last_transaction_id', '-pk')
+        tail = Transaction.objects.filter(product=OuterRef('pk'), pk__gt=OuterRef('mark'))
+        if upto is not None:
+            tail = tail.filter(pk__lte=upto)
+        tail = tail.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+
+        products = Product.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        rows = (products.order_by()
+                .annotate(
+                    base=Coalesce(Subquery(latest.values('quantity')[:1]), 0),
+                    mark=Coalesce(Subquery(latest.values('last_transaction_id')[:1]), 0),
+                )
+                .annotate(balance=F('base') + Coalesce(Subquery(tail, output_field=IntegerField()), 0))
+                .values_list('pk', 'balance'))
+        return dict(rows)
+
+    def take(self, product_ids=None):
+        """Checkpoint every product's ledger balance at the current ledger head"""
+        head = Transaction.objects.aggregate(head=Max('pk'))['head'] or 0
+        balances = self.ledger_balances(product_ids, upto=head)
+        now = timezone.now()
+        return self.bulk_create([
+            self.model(product_id=pid, quantity=qty, last_transaction_id=head, taken_at=now)
+            for pid, qty in balances.items()
+        ])
+
+
+class InventorySnapshot(models.Model):
+    """Stock checkpoint for a product at a ledger position (transaction id high-water mark)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    last_transaction_id = models.BigIntegerField(
+        default=0, help_text="Ledger position covered: all transactions with id <= this value"
+    )
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    objects = InventorySnapshotManager()
+
+    class Meta:
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['product', '-last_transaction_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ txn {self.last_transaction_id}: {self.quantity}"
+
+
+class DailyProductSalesManager(models.Manager):
+    """Incremental maintenance and backfill of the daily sales rollup"""
+
+    @staticmethod
+    def _contribution(txn):
+        units = abs(txn.quantity)
+        out = txn.transaction_type == 'OUT'
+        return {
+            'qty_out': units if out else 0,
+            'qty_in': units if txn.transaction_type == 'IN' else 0,
+            'revenue': units * Decimal(str(txn.unit_price or 0)) if out else Decimal('0'),
+            'out_count': 1 if out else 0,
+            'txn_count': 1,
+        }
+
+    def record(self, transactions):
+        """Fold newly posted transactions into their (product, day) rows"""
+        deltas = {}
+        for txn in transactions:
+            row = deltas.setdefault((txn.product_id, timezone.localdate(txn.created_at)), {})
+            for field, value in self._contribution(txn).items():
+                row[field] = row.get(field, 0) + value
+        if not deltas:
+            return
+        self.bulk_create([self.model(product_id=pid, date=day) for pid, day in deltas],
+                         ignore_conflicts=True)
+        _apply_field_deltas(self.model, deltas, key=('product_id', 'date'))
+
+    def rebuild(self, since=None):
+        """Recompute rows from the ledger with one grouped query (optionally from a date)"""
+        txns = Transaction.objects.order_by()
+        rows = self.all()
+        if since is not None:
+            txns = txns.filter(created_at__date__gte=since)
+            rows = rows.filter(date__gte=since)
+        out = Q(transaction_type='OUT')
+        grouped = (txns.annotate(day=TruncDate('created_at'))
+                   .values('product_id', 'day')
+                   .annotate(
+                       qty_out=Coalesce(Sum(-F('quantity'), filter=out), 0),
+                       qty_in=Coalesce(Sum('quantity', filter=Q(transaction_type='IN')), 0),
+                       revenue=Coalesce(
+                           Sum(-F('quantity') * F('unit_price'), filter=out,
+                               output_field=models.DecimalField(max_digits=14, decimal_places=2)),
+                           Decimal('0'),
+                       ),
+                       out_count=Count('pk', filter=out),
+                       txn_count=Count('pk'),
+                   ))
+        with db_txn.atomic():
+            rows.delete()
+            return self.bulk_create([
+                self.model(product_id=g['product_id'], date=g['day'], qty_out=g['qty_out'],
+                           qty_in=g['qty_in'], revenue=g['revenue'],
+                           out_count=g['out_count'], txn_count=g['txn_count'])
+                for g in grouped
+            ], batch_size=DELTA_CHUNK_SIZE)
+
+
+class DailyProductSales(models.Model):
+    """Per-product, per-day rollup of the ledger, maintained as transactions are posted"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField()
+    qty_out = models.PositiveIntegerField(default=0, help_text="Units dispensed (OUT)")
+    qty_in = models.PositiveIntegerField(default=0, help_text="Units received (IN)")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    out_count = models.PositiveIntegerField(default=0, help_text="Number of OUT transactions")
+    txn_count = models.PositiveIntegerField(default=0, help_text="Number of transactions of any type")
+
+    objects = DailyProductSalesManager()
+
+    class Meta:
+        verbose_name_plural = "Daily product sales"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'date'], name='uniq_daily_sales_product_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.date}: out {self.qty_out}, in {self.qty_in}"
+
+
+# Smoothing of the exponentially weighted daily demand rates, alpha = 2 / (span + 1)
+DEMAND_RATE_SPANS = {'rate_7': 7, 'rate_30': 30}
+
+
+def _fold_days(stats, qty, zero_days):
+    """
+    Close one daily bucket of `qty` units followed by `zero_days` days
+    without sales into running stats {days, mean, m2, rate_7, rate_30}:
+    Welford's update for the bucket, Chan's merge for the run of zeros,
+    and the EWMA rates decayed in closed form. The rates start from zero
+    and are stored uncorrected; as_of() removes that start-up bias.
+    O(1) whatever the gap.
+    """
+    n = stats['days'] + 1
+    delta = qty - stats['mean']
+    stats['mean'] += delta / n
+    stats['m2'] += delta * (qty - stats['mean'])
+    for field, span in DEMAND_RATE_SPANS.items():
+        alpha = 2 / (span + 1)
+        stats[field] = (stats[field] + alpha * (qty - stats[field])) * (1 - alpha) ** zero_days
+    if zero_days:
+        total = n + zero_days
+        stats['m2'] += stats['mean'] ** 2 * n * zero_days / total
+        stats['mean'] *= n / total
+        n = total
+    stats['days'] = n
+    return stats
+
+
+class ProductDemandStatsManager(models.Manager):
+    """Running per-product demand statistics, folded forward one posting at a time"""
+
+    FIELDS = ('days', 'mean', 'm2', 'rate_7', 'rate_30')
+
+    def record(self, transactions):
+        """Add newly posted OUT transactions to their products' open daily bucket"""
+        sold = {}
+        for txn in transactions:
+            if txn.transaction_type == 'OUT':
+                key = (txn.product_id, timezone.localdate(txn.created_at))
+                sold[key] = sold.get(key, 0) + abs(txn.quantity)
+        if not sold:
+            return
+        rows = {row.product_id: row for row in self.filter(product_id__in={pid for pid, _ in sold})}
+        for (pid, day), qty in sorted(sold.items(), key=lambda item: item[0][1]):
+            row = rows.setdefault(pid, self.model(product_id=pid, day=day))
+            row.add_sales(day, qty)
+        self.bulk_create(
+            rows.values(), batch_size=DELTA_CHUNK_SIZE,
+            update_conflicts=True, unique_fields=['product'],
+            update_fields=['day', 'day_qty', *self.FIELDS, 'last_sale', 'updated_at'],
+        )
+
+    def rebuild(self):
+        """Replay the DailyProductSales rollup into fresh rows; returns the number of products"""
+        rows = {}
+        sales = (DailyProductSales.objects.filter(qty_out__gt=0).order_by('product_id', 'date')
+                 .values_list('product_id', 'date', 'qty_out'))
+        for pid, day, qty in sales.iterator(chunk_size=DELTA_CHUNK_SIZE):
+            rows.setdefault(pid, self.model(product_id=pid, day=day)).add_sales(day, qty)
+        with db_txn.atomic():
+            self.all().delete()
+            self.bulk_create(rows.values(), batch_size=DELTA_CHUNK_SIZE)
+        return len(rows)
+
+
+class ProductDemandStats(models.Model):
+    """
+    Online daily demand statistics per product, updated in O(1) as OUT
+    movements are posted instead of re-read from history. Sales accumulate
+    in the open bucket (`day`, `day_qty`); when a later day's sale arrives
+    the bucket and the days without sales since are folded into Welford
+    mean/variance and exponentially weighted rates. Tracking starts at the
+    product's first sale. Read through as_of() to include the open bucket
+    and the quiet days up to a date.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='demand_stats')
+    day = models.DateField(help_text="Open daily bucket")
+    day_qty = models.PositiveIntegerField(default=0, help_text="Units dispensed so far on `day`")
+    days = models.PositiveIntegerField(default=0, help_text="Closed daily buckets folded into the stats")
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0, help_text="Welford sum of squared deviations")
+    rate_7 = models.FloatField(default=0, help_text="EWMA of daily units, 7-day span")
+    rate_30 = models.FloatField(default=0, help_text="EWMA of daily units, 30-day span")
+    last_sale = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductDemandStatsManager()
+
+    class Meta:
+        verbose_name_plural = "Product demand stats"
+
+    def __str__(self):
+        return f"{self.product_id}: {self.rate_30:.2f}/day over {self.days} days"
+
+    def add_sales(self, day, qty):
+        if day > self.day:
+            stats = _fold_days({f: getattr(self, f) for f in ProductDemandStatsManager.FIELDS},
+                               self.day_qty, (day - self.day).days - 1)
+            for field, value in stats.items():
+                setattr(self, field, value)
+            self.day, self.day_qty = day, 0
+        self.day_qty += qty  # a late sale for an already closed day lands in the open bucket
+        self.last_sale = max(day, self.last_sale) if self.last_sale else day
+
+    def as_of(self, day=None):
+        """
+        {days, mean, std, rate_7, rate_30, last_sale} with every day before
+        `day` (default today) closed; the open bucket counts once it is past.
+        The rates are bias-corrected (divided by 1 - (1 - alpha)^days, as
+        in Adam), so a short steady history reports its actual daily rate.
+        """
+        day = day or timezone.localdate()
+        stats = {f: getattr(self, f) for f in ProductDemandStatsManager.FIELDS}
+        if day > self.day:
+            _fold_days(stats, self.day_qty, (day - self.day).days - 1)
+        for field, span in DEMAND_RATE_SPANS.items():
+            if stats['days']:
+                stats[field] /= 1 - (1 - 2 / (span + 1)) ** stats['days']
+        variance = stats.pop('m2') / stats['days'] if stats['days'] else 0.0
+        return {**stats, 'std': variance ** 0.5, 'last_sale': self.last_sale}
+
+
+class ProductStockStatusManager(models.Manager):
+    """Keeps the stock-status projection in step with movements and lot changes"""
+
+    def refresh(self, product_ids=None):
+        """
+        Recompute the status rows for these products (all when None) with
+        one read and one upsert. Returns the number of rows written.
+        """
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        products = Product.objects.order_by()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        live_lots = StockBatch.objects.filter(product=OuterRef('pk'), quantity__gt=0, expiry_date__isnull=False)
+        stats_fields = ['day', 'day_qty', *ProductDemandStatsManager.FIELDS, 'last_sale']
+        rows = products.annotate(
+            on_hand=Coalesce(F('inventory__quantity'), 0) + unfolded_shard_delta(OuterRef('pk')),
+            next_expiry=Subquery(live_lots.order_by('expiry_date').values('expiry_date')[:1]),
+        ).values_list('pk', 'reorder_level', 'unit_price', 'on_hand', 'next_expiry',
+                      *(f'demand_stats__{field}' for field in stats_fields))
+
+        statuses = []
+        for pid, reorder_level, unit_price, on_hand, next_expiry, *stats in rows:
+            # Days of cover from the running 30-day demand rate, today's sales included
+            daily = 0
+            if stats[0] is not None:
+                daily = ProductDemandStats(product_id=pid, **dict(zip(stats_fields, stats))).as_of(tomorrow)['rate_30']
+            statuses.append(self.model(
+                product_id=pid,
+                quantity=on_hand,
+                is_low=on_hand <= reorder_level,
+                is_out=on_hand <= 0,
+                days_of_cover=round(on_hand / daily, 1) if daily else None,
+                next_expiry=next_expiry,
+                stock_value=on_hand * unit_price,
+            ))
+        self.bulk_create(
+            statuses, batch_size=DELTA_CHUNK_SIZE,
+            update_conflicts=True, unique_fields=['product'],
+            update_fields=['quantity', 'is_low', 'is_out', 'days_of_cover',
+                           'next_expiry', 'stock_value', 'updated_at'],
+        )
+        return len(statuses)
+
+
+class ProductStockStatus(models.Model):
+    """
+    Denormalized per-product stock status (quantity, low/out flags, days of
+    cover, next lot expiry, value). Derived from Inventory, StockBatch and
+    DailyProductSales; refreshed whenever they change, so list and summary
+    endpoints read one indexed row per product instead of joining.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='stock_status')
+    quantity = models.IntegerField(default=0)
+    is_low = models.BooleanField(default=True, help_text="Stock at or below the reorder level")
+    is_out = models.BooleanField(default=True)
+    days_of_cover = models.FloatField(null=True, blank=True,
+                                      help_text="Stock / 30-day EWMA of daily units out")
+    next_expiry = models.DateField(null=True, blank=True, help_text="Earliest expiry of a lot with stock")
+    stock_value = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductStockStatusManager()
+
+    class Meta:
+        verbose_name_plural = "Product stock statuses"
+        indexes = [
+            models.Index(fields=['quantity'], condition=Q(is_low=True), name='stockstatus_low_idx'),
+            models.Index(fields=['product'], condition=Q(is_out=True), name='stockstatus_out_idx'),
+            models.Index(fields=['next_expiry'], condition=Q(next_expiry__isnull=False),
+                         name='stockstatus_expiry_idx'),
+        ]
+
+    def __str__(self):
+        flag = 'out' if self.is_out else 'low' if self.is_low else 'ok'
+        return f"{self.product_id}: {self.quantity} ({flag})"
+
+
+class IdempotencyRecordManager(models.Manager):
+    def purge_expired(self):
+        """Delete records past their expiry; returns the number removed"""
+        return self.filter(expires_at__lte=timezone.now()).delete()[0]
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Stored outcome of a write request sent with an Idempotency-Key header.
+    A repeat of the same key from the same client replays the stored
+    response instead of re-running the write (see pharma.idempotency).
+    """
+    client = models.CharField(max_length=64, help_text="User id, or X-Client-Id for anonymous clients")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of method, path and body")
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = IdempotencyRecordManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'key'], name='uniq_idempotency_client_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.client}/{self.key} -> {self.status_code}"
+
+
+# Snapshot history is thinned as it ages: past each age only the newest
+# snapshot per bucket is kept, so a refresh every few minutes settles to
+# one row per hour after a day and one per day after a week
+INSIGHT_HISTORY_RESOLUTION = (
+    (timedelta(days=1), TruncHour),
+    (timedelta(days=7), TruncDate),
+)
+
+
+class InsightSnapshotManager(models.Manager):
+    def latest_snapshot(self):
+        return self.order_by('-computed_at', '-pk').first()
+
+    def record(self, data, last_transaction_id, duration_ms, keep=None, history_days=None):
+        """
+        Store a freshly computed insights payload with its headline metrics
+        and per-SKU forecast rows. Only the newest `keep` snapshots retain
+        the full payload; older ones stay as history (metrics and forecast
+        rows), downsampled per INSIGHT_HISTORY_RESOLUTION, for
+        `history_days` before being deleted.
+        """
+        forecast = data.get('demand_forecast', {})
+        summary = forecast.get('summary') or {}
+        optimization = data.get('inventory_optimization', {}).get('summary') or {}
+        with db_txn.atomic():
+            snapshot = self.create(
+                data=data, last_transaction_id=last_transaction_id, duration_ms=duration_ms,
+                forecast_days=forecast.get('forecast_period_days'),
+                health_score=data.get('system_health', {}).get('overall_score'),
+                average_stockout_risk=summary.get('average_stockout_risk'),
+                high_risk_products=summary.get('high_risk_products', 0),
+                total_forecasted_demand=summary.get('total_forecasted_demand'),
+                urgent_reorders=optimization.get('urgent_reorders_needed', 0),
+                daily_holding_cost=optimization.get('total_daily_holding_cost'),
+                average_daily_sales=data.get('sales_trends', {}).get('average_daily_sales'),
+            )
+            rows = forecast.get('forecasts', {})
+            existing = set(Product.objects.filter(pk__in=list(rows)).values_list('pk', flat=True))
+            InsightForecast.objects.bulk_create([
+                InsightForecast(
+                    snapshot=snapshot, product_id=pid, model=row['model'],
+                    forecasted_demand=row['forecasted_demand'], avg_daily_demand=row['avg_daily_demand'],
+                    stockout_risk=row['stockout_risk'], current_stock=row['current_stock'],
+                )
+                for pid, row in rows.items() if pid in existing  # skip products deleted meanwhile
+            ], batch_size=DELTA_CHUNK_SIZE)
+
+            keep = keep or getattr(settings, 'PHARMA_INSIGHT_SNAPSHOTS_KEPT', 24)
+            history_days = history_days or getattr(settings, 'PHARMA_INSIGHT_HISTORY_DAYS', 90)
+            cutoff = self.order_by('-computed_at', '-pk').values_list('pk', flat=True)[keep:keep + 1]
+            if cutoff:
+                self.filter(pk__lte=cutoff[0]).exclude(data={}).update(data={})
+            self.downsample()
+            self.filter(computed_at__lt=timezone.now() - timedelta(days=history_days)).delete()
+        return snapshot
+
+    def downsample(self, now=None):
+        """Keep only the newest snapshot per hour/day bucket past each age in INSIGHT_HISTORY_RESOLUTION"""
+        now = now or timezone.now()
+        for age, trunc in INSIGHT_HISTORY_RESOLUTION:
+            older = self.filter(computed_at__lt=now - age)
+            newest = (older.annotate(bucket=trunc('computed_at')).order_by()
+                      .values('bucket').annotate(last=Max('pk')).values('last'))
+            older.exclude(pk__in=newest).delete()
+
+
+class InsightSnapshot(models.Model):
+    """
+    Persisted output of PharmacyAIAgent.get_ai_insights. The AI views serve
+    the newest snapshot and refresh it in the background once it is stale
+    (see pharma.insights). Headline metrics are copied into columns and
+    per-SKU forecasts into InsightForecast rows, which outlive the full
+    payload and back the insight history queries (pharma.insight_history).
+    """
+    data = models.JSONField(encoder=DjangoJSONEncoder, help_text="Full payload; emptied once the snapshot is history")
+    computed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    last_transaction_id = models.BigIntegerField(
+        default=0, help_text="Newest ledger row the snapshot has seen; later rows count as stock movements"
+    )
+    duration_ms = models.PositiveIntegerField(default=0)
+    forecast_days = models.PositiveIntegerField(null=True, blank=True)
+    health_score = models.FloatField(null=True, blank=True)
+    average_stockout_risk = models.FloatField(null=True, blank=True)
+    high_risk_products = models.PositiveIntegerField(default=0)
+    total_forecasted_demand = models.FloatField(null=True, blank=True)
+    urgent_reorders = models.PositiveIntegerField(default=0)
+    daily_holding_cost = models.FloatField(null=True, blank=True)
+    average_daily_sales = models.FloatField(null=True, blank=True)
+
+    objects = InsightSnapshotManager()
+
+    class Meta:
+        ordering = ['-computed_at']
+
+    def __str__(self):
+        return f"Insights at {self.computed_at:%Y-%m-%d %H:%M:%S}"
+
+    @property
+    def age(self):
+        return timezone.now() - self.computed_at
+
+    def movements_since(self, limit=None):
+        """Ledger rows posted after this snapshot, counting at most `limit`"""
+        rows = Transaction.objects.filter(pk__gt=self.last_transaction_id).order_by()
+        return rows[:limit].count() if limit else rows.count()
+
+    def is_stale(self, max_age=None, max_movements=None):
+        max_age = max_age or getattr(settings, 'PHARMA_INSIGHTS_MAX_AGE', timedelta(minutes=5))
+        max_movements = max_movements or getattr(settings, 'PHARMA_INSIGHTS_MAX_MOVEMENTS', 50)
+        return self.age >= max_age or self.movements_since(max_movements) >= max_movements
+
+
+class InsightForecast(models.Model):
+    """One product's demand forecast as of an InsightSnapshot"""
+    snapshot = models.ForeignKey(InsightSnapshot, on_delete=models.CASCADE, related_name='forecasts')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='insight_forecasts')
+    model = models.CharField(max_length=20)
+    forecasted_demand = models.FloatField()
+    avg_daily_demand = models.FloatField()
+    stockout_risk = models.FloatField()
+    current_stock = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot', 'product'], name='uniq_insight_forecast'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'snapshot'], name='insight_forecast_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} @ snapshot {self.snapshot_id}: {self.forecasted_demand}"
+
+
+class AlertQuerySet(models.QuerySet):
+    def open(self):
+        return self.filter(resolved_at__isnull=True)
+
+
+class Alert(models.Model):
+    """
+    A per-product stock alert raised by the rules in pharma.alerts. Rules
+    are re-evaluated for the touched products whenever stock status moves;
+    an alert stays open while its rule holds and is resolved, not deleted,
+    once it no longer does.
+    """
+    KIND_CHOICES = [
+        ('out_of_stock', 'Out of stock'),
+        ('low_stock', 'Low stock'),
+        ('urgent_reorder', 'Urgent reorder'),
+        ('expiring', 'Expiring lot'),
+    ]
+    SEVERITY_CHOICES = [
+        ('critical', 'Critical'),
+        ('high', 'High'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='alerts')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    severity = models.CharField(max_length=10, choices=SEVERITY_CHOICES)
+    message = models.CharField(max_length=255)
+    opened_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    objects = AlertQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-opened_at']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'kind'], condition=Q(resolved_at__isnull=True),
+                                    name='uniq_open_alert'),
+        ]
+        indexes = [
+            # Covers the alert summary's GROUP BY over open alerts
+            models.Index(fields=['kind', 'severity', 'updated_at'], condition=Q(resolved_at__isnull=True),
+                         name='alert_open_summary_idx'),
+        ]
+
+    def __str__(self):
+        state = 'open' if self.resolved_at is None else 'resolved'
+        return f"{self.get_kind_display()} ({self.severity}, {state}): {self.product_id}"
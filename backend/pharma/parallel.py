@@ -0,0 +1,99 @@
+"""
+Process-pool execution of the per-SKU forecast for large catalogs. The
+demand matrix is copied once into a shared-memory block; each task names a
+contiguous shard of rows, attaches to the block and runs
+forecasting.forecast on a view of its rows, so history is never pickled
+per task. Results are concatenated back in row (SKU) order.
+"""
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import django
+import numpy as np
+
+from . import forecasting
+
+_pool = None
+_pool_workers = 0
+# Request threads and the background insight refresh share the pool
+_pool_lock = threading.Lock()
+
+
+def _executor(workers):
+    """
+    A long-lived pool per process, rebuilt only when the worker count
+    changes. Callers hold _pool_lock, so a rebuild cannot shut the pool
+    down under another thread's submit.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        # spawn: forking a threaded web worker is unsafe; workers set Django up themselves
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                    initializer=django.setup)
+        _pool_workers = workers
+    return _pool
+
+
+def shutdown():
+    """Stop the worker pool, if one was started"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool, _pool_workers = None, 0
+
+
+def _forecast_shard(block, shape, rows, stock, days):
+    started = time.process_time()
+    shm = shared_memory.SharedMemory(name=block)
+    values = matrix = None
+    try:
+        values = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[rows[0]:rows[1]]
+        matrix = forecasting.DemandMatrix(np.arange(rows[0], rows[1]), None, values)
+        stats = forecasting.forecast(matrix, stock, days)
+    finally:
+        values = matrix = None  # views into the block must go before it can close
+        shm.close()
+    return stats, time.process_time() - started
+
+
+def forecast(matrix, stock, days, workers, shard_size):
+    """
+    forecasting.forecast over `matrix`, split into shards of `shard_size`
+    rows across `workers` processes. Returns (stats, timing); timing
+    reports the wall time, the shards' summed CPU time,
+    `estimated_speedup` (CPU over wall time: what a serial run would take
+    if it cost the same CPU time, relative to this one) and
+    `parallel_efficiency` (that speedup per worker).
+    """
+    started = time.perf_counter()
+    values = np.ascontiguousarray(matrix.values, dtype=np.float64)
+    bounds = [(lo, min(lo + shard_size, len(values))) for lo in range(0, len(values), shard_size)]
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+        with _pool_lock:
+            pool = _executor(workers)
+            futures = [pool.submit(_forecast_shard, shm.name, values.shape, rows, stock[rows[0]:rows[1]], days)
+                       for rows in bounds]
+        results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+    stats = {name: np.concatenate([shard[name] for shard, _ in results]) for name in results[0][0]}
+    wall = time.perf_counter() - started
+    busy = sum(seconds for _, seconds in results)
+    return stats, {
+        'workers': workers,
+        'shards': len(bounds),
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(busy, 4),
+        'estimated_speedup': round(busy / wall, 2) if wall else None,
+        'parallel_efficiency': round(busy / (wall * workers), 2) if wall else None,
+    }
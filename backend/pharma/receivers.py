@@ -0,0 +1,61 @@
+from django.db import transaction as db_txn
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import alerts
+from .ai_cache import bump_data_version
+from .models import (Category, DailyProductSales, Inventory, Product, ProductDemandStats, ProductStockStatus,
+                     StockBatch, Transaction)
+from .signals import is_posting, transactions_posted
+
+
+@receiver(transactions_posted, sender=Transaction)
+def update_daily_sales(sender, transactions, **kwargs):
+    DailyProductSales.objects.record(transactions)
+
+
+@receiver(transactions_posted, sender=Transaction)
+def update_demand_stats(sender, transactions, **kwargs):
+    ProductDemandStats.objects.record(transactions)
+
+
+# Connected after update_demand_stats so days-of-cover sees today's movements
+@receiver(transactions_posted, sender=Transaction)
+def update_stock_status(sender, transactions, **kwargs):
+    ProductStockStatus.objects.refresh({txn.product_id for txn in transactions})
+
+
+# Connected after update_stock_status: the rules read the refreshed status
+@receiver(transactions_posted, sender=Transaction)
+def update_alerts(sender, transactions, **kwargs):
+    alerts.evaluate({txn.product_id for txn in transactions})
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_stock_status(sender, instance, raw=False, **kwargs):
+    """Reorder level and price feed the low flag and stock value"""
+    if not raw:
+        ProductStockStatus.objects.refresh([instance.pk])
+        alerts.evaluate([instance.pk])
+
+
+@receiver(post_save, sender=StockBatch)
+@receiver(post_delete, sender=StockBatch)
+def refresh_batch_stock_status(sender, instance, raw=False, origin=None, **kwargs):
+    """Lot edits outside the posting paths can move the next expiry"""
+    if raw or isinstance(origin, Product) or is_posting():
+        return  # fixture load, product deletion, or a posting (transactions_posted refreshes once)
+    ProductStockStatus.objects.refresh([instance.product_id])
+    alerts.evaluate([instance.product_id])
+
+
+# After commit, so a reader racing the write cannot cache pre-commit results
+# under the new version
+@receiver(transactions_posted, sender=Transaction)
+@receiver([post_save, post_delete], sender=Transaction)
+@receiver([post_save, post_delete], sender=Inventory)
+@receiver([post_save, post_delete], sender=StockBatch)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_ai_cache(sender, **kwargs):
+    db_txn.on_commit(bump_data_version)
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 
 from .models import (Category, Inventory, Product, StockBatch, Supplier,
-                     Transaction)
+                     Transaction, TransactionAllocation)
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -31,48 +31,37 @@ class ProductSerializer(serializers.ModelSerializer):
     """Serializer for Product model"""
     category_name = serializers.CharField(source='category.name', read_only=True)
     supplier_name = serializers.CharField(source='supplier.name', read_only=True)
+    # Read from the ProductStockStatus projection (select_related('stock_status'))
+    current_stock = serializers.IntegerField(source='stock_status.quantity', read_only=True)
+    is_low_stock = serializers.BooleanField(source='stock_status.is_low', read_only=True)
+    next_expiry = serializers.DateField(source='stock_status.next_expiry', read_only=True)
+    days_of_cover = serializers.FloatField(source='stock_status.days_of_cover', read_only=True)
 
     class Meta:
         model = Product
         fields = ['id', 'name', 'sku', 'description', 'category', 'category_name',
                  'supplier', 'supplier_name', 'unit_price', 'cost_price', 
                  'reorder_level', 'is_active', 'created_at', 'updated_at',
+                 'current_stock', 'is_low_stock', 'next_expiry', 'days_of_cover',
                  ]
 
-    def get_current_stock(self, obj):
-        try:
-            return obj.inventory.quantity
-        except Inventory.DoesNotExist:
-            return 0
-
-    def get_total_value(self, obj):
-        try:
-            return obj.inventory.total_value
-        except Inventory.DoesNotExist:
-            return 0
-
-    def get_is_low_stock(self, obj):
-        try:
-            return obj.inventory.is_low_stock
-        except Inventory.DoesNotExist:
-            return True
-
 class InventorySerializer(serializers.ModelSerializer):
     """Serializer for Inventory model"""
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_sku = serializers.CharField(source='product.sku', read_only=True)
+    quantity = serializers.IntegerField(source='on_hand', read_only=True)
     unit_price = serializers.DecimalField(source='product.unit_price', max_digits=10, decimal_places=2, read_only=True)
     total_value  = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, source='total_value_db')
     is_low_stock = serializers.SerializerMethodField()
     
     class Meta:
         model = Inventory
-        fields = ['id', 'product', 'product_name', 'product_sku', 'quantity', 
+        fields = ['id', 'product', 'product_name', 'product_sku', 'quantity', 'sharded',
                  'unit_price', 'total_value', 'is_low_stock', 'last_updated']
     
     def get_is_low_stock(self, obj):
         """Calculate if stock is low based on reorder level"""
-        return obj.quantity <= obj.product.reorder_level
+        return obj.on_hand <= obj.product.reorder_level
 
 class StockBatchSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -90,18 +79,27 @@ class StockBatchSerializer(serializers.ModelSerializer):
     def get_is_expired(self, obj): return obj.is_expired
     def get_days_to_expiry(self, obj): return obj.days_to_expiry
 
+class TransactionAllocationSerializer(serializers.ModelSerializer):
+    lot_number = serializers.CharField(source='batch.lot_number', read_only=True)
+    expiry_date = serializers.DateField(source='batch.expiry_date', read_only=True)
+
+    class Meta:
+        model = TransactionAllocation
+        fields = ['batch', 'lot_number', 'expiry_date', 'quantity']
+
 class TransactionSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_sku = serializers.CharField(source='product.sku', read_only=True)
     transaction_type_display = serializers.CharField(source='get_transaction_type_display', read_only=True)
     batch_lot = serializers.CharField(source='batch.lot_number', read_only=True)
     batch_expiry = serializers.DateField(source='batch.expiry_date', read_only=True)
+    allocations = TransactionAllocationSerializer(many=True, read_only=True)
 
     class Meta:
         model = Transaction
         fields = ['id', 'product', 'product_name', 'product_sku', 'transaction_type',
                   'transaction_type_display', 'quantity', 'unit_price', 'reference',
-                  'notes', 'batch', 'batch_lot', 'batch_expiry', 'created_at']
+                  'notes', 'batch', 'batch_lot', 'batch_expiry', 'allocations', 'created_at']
 
     def validate_quantity(self, value):
         """Validate quantity based on transaction type"""
@@ -121,7 +119,7 @@ class TransactionSerializer(serializers.ModelSerializer):
             quantity = abs(data.get('quantity'))
             
             try:
-                current_stock = product.inventory.quantity
+                current_stock = product.inventory.on_hand
                 if current_stock < quantity:
                     raise serializers.ValidationError(
                         f"Insufficient stock. Available: {current_stock}, Requested: {quantity}"
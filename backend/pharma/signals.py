@@ -0,0 +1,53 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction as db_txn
+from django.dispatch import Signal
+
+# Sent once new ledger rows and the stock balances they move (Inventory,
+# StockBatch) are written, by Transaction.save and by the bulk paths (see
+# send_posted). Receivers get `transactions`: the posted Transaction objects,
+# with created_at set. Derived tables update here so they commit or roll back
+# together with the movement, except for sharded products.
+transactions_posted = Signal()
+
+_posting = ContextVar('pharma_posting', default=False)
+
+
+@contextmanager
+def posting():
+    """
+    Mark a posting in progress. Model signals for the balance rows it
+    writes along the way (e.g. StockBatch saves) can skip work that the
+    closing transactions_posted does once for the whole posting.
+    """
+    token = _posting.set(True)
+    try:
+        yield
+    finally:
+        _posting.reset(token)
+
+
+def is_posting():
+    return _posting.get()
+
+
+def send_posted(sender, transactions, sharded=()):
+    """
+    Send transactions_posted for a posting. Movements of products in
+    `sharded` (hot products, Inventory.sharded) are sent after commit in a
+    transaction of their own. Their derived rows (daily rollup, demand
+    stats, stock status, alerts) are one row per product, and writing them
+    inside the posting would queue concurrent dispenses on those rows.
+    """
+    now = [txn for txn in transactions if txn.product_id not in sharded]
+    later = [txn for txn in transactions if txn.product_id in sharded]
+    if now:
+        transactions_posted.send(sender=sender, transactions=now)
+    if later:
+        db_txn.on_commit(lambda: _send_committed(sender, later), robust=True)
+
+
+def _send_committed(sender, transactions):
+    with db_txn.atomic():
+        transactions_posted.send(sender=sender, transactions=transactions)
@@ -1,3 +1,1007 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from multiprocessing import shared_memory
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import alerts, backtesting, forecasting, insight_history, parallel
+from .ai_agent import PharmacyAIAgent
+from .analytics import AnalyticsContext
+from .backtesting import Backtest
+from .db import retry_on_lock
+from .forecasting import DemandMatrix
+from .insights import refresh_snapshot
+from .views import StockBatchViewSet, TransactionViewSet
+from .models import (Alert, Category, DailyProductSales, IdempotencyRecord, InsightSnapshot, Inventory,
+                     InventoryShard, InventorySnapshot, Product, ProductDemandStats, ProductStockStatus,
+                     StockBatch, Supplier, Transaction)
+
+
+def make_product(sku='AMOX500', category=None, **kwargs):
+    category = category or Category.objects.get_or_create(name='Antibiotics')[0]
+    defaults = {
+        'name': f'Product {sku}',
+        'unit_price': Decimal('12.50'),
+        'cost_price': Decimal('10.00'),
+        'reorder_level': 20,
+    }
+    defaults.update(kwargs)
+    return Product.objects.create(sku=sku, category=category, **defaults)
+
+
+class BulkIngestTests(TestCase):
+    def setUp(self):
+        self.products = [make_product(sku=f'SKU{i}') for i in range(5)]
+
+    def test_creates_transactions_batches_and_inventory(self):
+        existing = StockBatch.objects.create(product=self.products[0], lot_number='L1', quantity=5)
+        rows = [
+            {'product': self.products[0], 'quantity': 10, 'batch': existing},
+            {'product_id': self.products[0].pk, 'quantity': 7, 'lot_number': 'L2'},
+            {'product': self.products[1], 'quantity': 3},
+        ]
+        txns = Transaction.objects.bulk_ingest(rows)
+
+        self.assertEqual(len(txns), 3)
+        self.assertTrue(all(t.pk and t.batch_id for t in txns))
+        existing.refresh_from_db()
+        self.assertEqual(existing.quantity, 15)
+        self.assertEqual(StockBatch.objects.get(lot_number='L2').quantity, 7)
+        self.assertEqual(Inventory.objects.get(product=self.products[0]).quantity, 17)
+        self.assertEqual(Inventory.objects.get(product=self.products[1]).quantity, 3)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        rows = [{'product': p, 'quantity': 2} for p in self.products for _ in range(20)]
+        with self.assertNumQueries(15):
+            Transaction.objects.bulk_ingest(rows)
+        self.assertEqual(Transaction.objects.count(), 100)
+
+    def test_rejects_unknown_product_without_writing(self):
+        with self.assertRaises(ValidationError):
+            Transaction.objects.bulk_ingest([
+                {'product': self.products[0], 'quantity': 1},
+                {'product_id': 999999, 'quantity': 1},
+            ])
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_bulk_stock_in_endpoint_counts_stock_once(self):
+        resp = APIClient().post('/api/transactions/bulk_stock_in/', {
+            'reference': 'GRN-0001',
+            'items': [{'product_id': self.products[0].pk, 'quantity': 100, 'unit_price': '12.50'}],
+        }, format='json')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(Inventory.objects.get(product=self.products[0]).quantity, 100)
+
+
+class FefoAllocationTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        today = date.today()
+        Transaction.objects.bulk_ingest([
+            {'product': self.product, 'quantity': 5, 'lot_number': 'LATE', 'expiry_date': today + timedelta(days=90)},
+            {'product': self.product, 'quantity': 4, 'lot_number': 'SOON', 'expiry_date': today + timedelta(days=10)},
+            {'product': self.product, 'quantity': 3, 'lot_number': 'NOEXP'},
+        ])
+
+    def lots(self):
+        return dict(StockBatch.objects.values_list('lot_number', 'quantity'))
+
+    def test_out_spans_lots_in_expiry_order(self):
+        txn = Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-7)
+
+        self.assertEqual(self.lots(), {'SOON': 0, 'LATE': 2, 'NOEXP': 3})
+        self.assertEqual(
+            [(a.batch.lot_number, a.quantity) for a in txn.allocations.select_related('batch')],
+            [('SOON', 4), ('LATE', 3)],
+        )
+        self.assertEqual(txn.batch.lot_number, 'SOON')
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 5)
+
+    def test_shortage_rolls_back_the_ledger_row(self):
+        with self.assertRaises(ValidationError):
+            Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-13)
+        self.assertFalse(Transaction.objects.filter(transaction_type='OUT').exists())
+        self.assertEqual(self.lots(), {'SOON': 4, 'LATE': 5, 'NOEXP': 3})
+
+    def test_stock_out_endpoint_dispenses_across_lots(self):
+        resp = APIClient().post('/api/transactions/stock_out/', {
+            'product_id': self.product.pk, 'quantity': 10,
+        }, format='json')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(resp.json()['quantity'], -10)
+        self.assertEqual(len(resp.json()['allocations']), 3)
+
+
+class BulkStockOutTests(TestCase):
+    def setUp(self):
+        self.a, self.b = make_product(sku='A'), make_product(sku='B')
+        Transaction.objects.bulk_ingest([
+            {'product': self.a, 'quantity': 6, 'lot_number': 'A1', 'expiry_date': date.today()},
+            {'product': self.a, 'quantity': 6, 'lot_number': 'A2'},
+            {'product': self.b, 'quantity': 4, 'lot_number': 'B1'},
+        ])
+        self.client = APIClient()
+
+    def test_dispenses_all_lines_across_lots(self):
+        items = [{'product_id': self.a.pk, 'quantity': 5},
+                 {'product_id': self.a.pk, 'quantity': 3},
+                 {'product_id': self.b.pk, 'quantity': 4}]
+        resp = self.client.post('/api/transactions/bulk_stock_out/', {'items': items}, format='json')
+
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual([len(t['allocations']) for t in resp.json()], [1, 2, 1])
+        self.assertEqual(dict(StockBatch.objects.values_list('lot_number', 'quantity')),
+                         {'A1': 0, 'A2': 4, 'B1': 0})
+        self.assertEqual(Inventory.objects.get(product=self.a).quantity, 4)
+        self.assertEqual(Inventory.objects.get(product=self.b).quantity, 0)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        rows = [{'product': p, 'quantity': 1} for p in (self.a, self.b) for _ in range(2)]
+        with self.assertNumQueries(18):  # includes opening urgent_reorder alerts
+            Transaction.objects.bulk_dispense(rows)
+
+    def test_rejects_whole_request_with_line_report(self):
+        items = [{'product_id': self.a.pk, 'quantity': 2},
+                 {'product_id': self.b.pk, 'quantity': 5},
+                 {'product_id': 999999, 'quantity': 1}]
+        resp = self.client.post('/api/transactions/bulk_stock_out/', {'items': items}, format='json')
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual([e['line'] for e in resp.json()['line_errors']], [1, 2])
+        self.assertFalse(Transaction.objects.filter(transaction_type='OUT').exists())
+        self.assertEqual(Inventory.objects.get(product=self.a).quantity, 12)
+
+
+class LedgerRebuildTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 30}])
+        Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-8)
+        Transaction.objects.create(product=self.product, transaction_type='ADJUST', quantity=-2)
+
+    def test_posted_rows_cannot_be_edited(self):
+        txn = Transaction.objects.filter(transaction_type='OUT').get()
+        txn.quantity = -1
+        with self.assertRaises(ValidationError):
+            txn.save()
+        self.assertEqual(Transaction.objects.get(pk=txn.pk).quantity, -8)
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 20)
+
+        txn_admin = admin.site._registry[Transaction]
+        self.assertFalse(txn_admin.has_change_permission(None, txn))
+        self.assertFalse(txn_admin.has_delete_permission(None, txn))
+
+    def test_adjustments_post_to_inventory(self):
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 20)
+
+    def test_balance_is_snapshot_plus_tail(self):
+        InventorySnapshot.objects.take()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 5}])
+        self.assertEqual(InventorySnapshot.objects.ledger_balances(), {self.product.pk: 25})
+
+    def test_rebuild_repairs_drift(self):
+        Inventory.objects.filter(product=self.product).update(quantity=999)
+        call_command('rebuild_inventory', '--snapshot', stdout=StringIO())
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 20)
+        self.assertEqual(InventorySnapshot.objects.get().quantity, 20)
+
+
+class DailySalesRollupTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 50}])
+        Transaction.objects.create(product=self.product, transaction_type='OUT',
+                                   quantity=-3, unit_price=Decimal('12.50'))
+        Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 2}])
+
+    def test_rollup_is_maintained_on_post(self):
+        row = DailyProductSales.objects.get()
+        self.assertEqual((row.qty_in, row.qty_out, row.out_count, row.txn_count), (50, 5, 2, 3))
+        self.assertEqual(row.revenue, Decimal('62.50'))
+
+    def test_backfill_matches_incremental_rollup(self):
+        expected = list(DailyProductSales.objects.values('qty_in', 'qty_out', 'revenue', 'out_count', 'txn_count'))
+        DailyProductSales.objects.all().delete()
+        call_command('backfill_sales_rollup', stdout=StringIO())
+        self.assertEqual(
+            list(DailyProductSales.objects.values('qty_in', 'qty_out', 'revenue', 'out_count', 'txn_count')),
+            expected,
+        )
+
+    def test_transaction_summary_reads_rollup(self):
+        data = APIClient().get('/api/transactions/summary/').json()
+        self.assertEqual(data['today'], {'stock_in': 50, 'stock_out': -5, 'transaction_count': 3})
+
+
+class ShardedInventoryTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 40}])
+        Inventory.objects.enable_sharding([self.product.pk])
+
+    def test_writes_land_on_shards_not_the_counter(self):
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 10}])
+        Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-15)
+        Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 5}])
+
+        inventory = Inventory.objects.get(product=self.product)
+        self.assertEqual(inventory.quantity, 40)
+        self.assertEqual(inventory.on_hand, 30)
+        self.assertEqual(Inventory.objects.with_stock().get().on_hand_db, 30)
+
+    def test_reads_sum_shards(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-25)
+        client = APIClient()
+        self.assertEqual(client.get('/api/inventory/').json()['results'][0]['quantity'], 15)
+        low = client.get('/api/products/low_stock/').json()
+        self.assertEqual([p['sku'] for p in low], ['AMOX500'])
+
+    def test_dispense_writes_derived_rows_after_commit(self):
+        client = APIClient()
+        resp = client.post('/api/transactions/stock_out/', {'product_id': self.product.pk, 'quantity': 41},
+                           format='json')
+        self.assertEqual(resp.status_code, 400)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = client.post('/api/transactions/stock_out/', {'product_id': self.product.pk, 'quantity': 5},
+                               format='json')
+            Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 5}])
+        self.assertEqual(resp.status_code, 201, resp.content)
+        self.assertEqual(ProductStockStatus.objects.get(product=self.product).quantity, 40)
+        self.assertFalse(DailyProductSales.objects.filter(qty_out__gt=0).exists())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ProductStockStatus.objects.get(product=self.product).quantity, 30)
+        self.assertEqual(DailyProductSales.objects.get().qty_out, 10)
+
+    def test_fold_merges_deltas_into_counter(self):
+        Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-12)
+        call_command('inventory_shards', '--fold', stdout=StringIO())
+
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, 28)
+        self.assertFalse(InventoryShard.objects.exclude(delta=0).exists())
+        Inventory.objects.disable_sharding([self.product.pk])
+        self.assertFalse(InventoryShard.objects.exists())
+
+
+@override_settings(PHARMA_LOCK_RETRY_DELAY=0)
+class RetryOnLockTests(SimpleTestCase):
+    def flaky(self, failures, message='database is locked'):
+        calls = []
+
+        @retry_on_lock
+        def write():
+            calls.append(1)
+            if len(calls) <= failures:
+                raise OperationalError(message)
+            return 'ok'
+        return write, calls
+
+    def test_retries_until_the_lock_clears(self):
+        write, calls = self.flaky(failures=2)
+        self.assertEqual(write(), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_and_exhausted_retries_propagate(self):
+        write, calls = self.flaky(failures=1, message='no such table: pharma_product')
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 1)
+
+        write, calls = self.flaky(failures=99)
+        with self.assertRaises(OperationalError):
+            write()
+        self.assertEqual(len(calls), 5)
+
+
+class SqliteProfileTests(TestCase):
+    def test_connection_pragmas_and_maintenance(self):
+        with connection.cursor() as cursor:
+            self.assertEqual(cursor.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+        out = StringIO()
+        call_command('db_maintenance', stdout=out)
+        self.assertIn('Maintenance complete', out.getvalue())
+
+
+class QueryPlanTests(TestCase):
+    """Hot queries must stay on an index: no full table scans, checked via EXPLAIN QUERY PLAN"""
+
+    def assertIndexed(self, queryset, index):
+        plan = queryset.explain()
+        scans = [line for line in plan.splitlines() if ' SCAN ' in f' {line} ' and 'USING' not in line]
+        self.assertEqual(scans, [], plan)
+        self.assertIn(index, plan)
+
+    def test_transaction_ranges_use_created_at_indexes(self):
+        since = timezone.now() - timedelta(days=30)
+        ledger = TransactionViewSet.queryset
+        self.assertIndexed(ledger.filter(created_at__gte=since), '_created_')
+        self.assertIndexed(ledger.filter(transaction_type='OUT', created_at__gte=since), '_transac_')
+        self.assertIndexed(ledger.filter(product_id=1, transaction_type='OUT', created_at__gte=since),
+                           '(product_id=? AND transaction_type=? AND created_at>?)')
+
+    def test_batch_expiry_and_fefo_use_partial_indexes(self):
+        today = date.today()
+        self.assertIndexed(
+            StockBatchViewSet.queryset.filter(expiry_date__isnull=False, expiry_date__lte=today + timedelta(days=30),
+                                              expiry_date__gte=today, quantity__gt=0),
+            'stockbatch_live_expiry_idx',
+        )
+        self.assertIndexed(
+            StockBatch.objects.filter(product_id__in=[1, 2], quantity__gt=0)
+            .order_by('product_id', F('expiry_date').asc(nulls_last=True), 'created_at', 'pk'),
+            'stockbatch_live_fefo_idx',
+        )
+
+
+class ProductDemandStatsTests(TestCase):
+    SALES = [3, 0, 0, 5, 1, 0, 0, 0, 2, 4]  # units per day, oldest first, ending yesterday
+
+    def setUp(self):
+        self.product = make_product()
+        now = timezone.now()
+        self.movements = [
+            Transaction(product=self.product, transaction_type='OUT', quantity=-qty,
+                        created_at=now - timedelta(days=len(self.SALES) - i))
+            for i, qty in enumerate(self.SALES) if qty
+        ]
+
+    def assertMatchesHistory(self, stats):
+        sales = np.array(self.SALES, dtype=float)
+        weights = (1 - 2 / 31) ** np.arange(len(sales))[::-1]
+        rate = (weights * sales).sum() / weights.sum()  # bias-corrected EWMA
+        self.assertEqual(stats['days'], len(sales))
+        self.assertAlmostEqual(stats['mean'], sales.mean())
+        self.assertAlmostEqual(stats['std'], sales.std())
+        self.assertAlmostEqual(stats['rate_30'], rate)
+
+    def test_incremental_updates_match_the_full_history(self):
+        for txn in self.movements:
+            ProductDemandStats.objects.record([txn])
+        self.assertMatchesHistory(ProductDemandStats.objects.get(product=self.product).as_of())
+
+    def test_rebuild_replays_the_rollup(self):
+        DailyProductSales.objects.bulk_create(
+            DailyProductSales(product=self.product, date=timezone.localdate(txn.created_at), qty_out=-txn.quantity)
+            for txn in self.movements
+        )
+        self.assertEqual(ProductDemandStats.objects.rebuild(), 1)
+        self.assertMatchesHistory(ProductDemandStats.objects.get(product=self.product).as_of())
+
+    def test_steady_demand_on_a_short_history(self):
+        now = timezone.now()
+        ProductDemandStats.objects.record([
+            Transaction(product=self.product, transaction_type='OUT', quantity=-5, created_at=now - timedelta(days=ago))
+            for ago in range(10, 0, -1)
+        ])
+        stats = ProductDemandStats.objects.get(product=self.product).as_of()
+        self.assertEqual(stats['days'], 10)
+        self.assertAlmostEqual(stats['rate_7'], 5)
+        self.assertAlmostEqual(stats['rate_30'], 5)
+        self.assertAlmostEqual(stats['std'], 0)
+
+    def test_quiet_days_decay_the_rate(self):
+        ProductDemandStats.objects.record(self.movements)
+        stats = ProductDemandStats.objects.get(product=self.product)
+        later = stats.as_of(timezone.localdate() + timedelta(days=30))
+        self.assertEqual(later['days'], len(self.SALES) + 30)
+        self.assertLess(later['rate_30'], stats.as_of()['rate_30'])
+        self.assertLess(later['rate_7'], later['rate_30'])
+        self.assertEqual(later['last_sale'], stats.last_sale)
+
+
+class ProductStockStatusTests(TestCase):
+    def setUp(self):
+        self.product = make_product(reorder_level=10)
+        Transaction.objects.bulk_ingest([
+            {'product': self.product, 'quantity': 30, 'lot_number': 'L1', 'expiry_date': date.today() + timedelta(days=60)},
+            {'product': self.product, 'quantity': 30, 'lot_number': 'L2', 'expiry_date': date.today() + timedelta(days=20)},
+        ])
+
+    def status(self):
+        return ProductStockStatus.objects.get(product=self.product)
+
+    def test_follows_movements(self):
+        self.assertEqual((self.status().quantity, self.status().is_low), (60, False))
+        self.assertEqual(self.status().next_expiry, date.today() + timedelta(days=20))
+
+        Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 30}])
+        status = self.status()
+        self.assertEqual((status.quantity, status.is_low, status.is_out), (30, False, False))
+        self.assertEqual(status.next_expiry, date.today() + timedelta(days=60))
+        self.assertEqual(status.days_of_cover, 1.0)  # 30 on hand / 30 sold on the only day so far
+        self.assertEqual(status.stock_value, Decimal('375.00'))
+
+        Transaction.objects.create(product=self.product, transaction_type='OUT', quantity=-30)
+        self.assertEqual((self.status().is_low, self.status().is_out), (True, True))
+
+    def test_category_and_supplier_product_lists_read_status_in_constant_queries(self):
+        supplier = Supplier.objects.create(name='Acme')
+        Product.objects.filter(pk=self.product.pk).update(supplier=supplier)
+        for sku in ('B', 'C'):
+            make_product(sku=sku, supplier=supplier)
+        client = APIClient()
+        for url in (f'/api/categories/{self.product.category_id}/products/',
+                    f'/api/suppliers/{supplier.pk}/products/'):
+            with self.subTest(url=url), self.assertNumQueries(2):
+                products = client.get(url).json()
+            self.assertEqual([p['current_stock'] for p in products], [60, 0, 0])
+        for url in (f'/api/categories/{self.product.category_id}/', f'/api/suppliers/{supplier.pk}/'):
+            with self.subTest(url=url), self.assertNumQueries(2):
+                products = client.get(url).json()['products']
+            self.assertEqual([p['current_stock'] for p in products], [60, 0, 0])
+
+    def test_single_posting_refreshes_status_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            Transaction.objects.create(product=self.product, transaction_type='IN', quantity=5)
+        refreshes = [q for q in queries.captured_queries if 'INSERT INTO "pharma_productstockstatus"' in q['sql']]
+        self.assertEqual(len(refreshes), 1)
+        self.assertEqual(self.status().quantity, 65)
+
+    def test_follows_product_and_batch_edits(self):
+        self.product.reorder_level = 100
+        self.product.save()
+        self.assertTrue(self.status().is_low)
+
+        StockBatch.objects.filter(lot_number='L2').get().delete()
+        self.assertEqual(self.status().next_expiry, date.today() + timedelta(days=60))
+
+    def test_low_stock_endpoints_read_projection(self):
+        other = make_product(sku='OTHER', reorder_level=100)
+        Transaction.objects.bulk_ingest([{'product': other, 'quantity': 5}])
+        client = APIClient()
+
+        self.assertEqual([p['sku'] for p in client.get('/api/products/low_stock/').json()], ['OTHER'])
+        self.assertEqual(client.get('/api/products/stats/').json()['low_stock_products'], 1)
+        self.assertEqual(len(client.get('/api/inventory/', {'is_low_stock': 'true'}).json()['results']), 1)
+        listed = {p['sku']: p for p in client.get('/api/products/').json()['results']}
+        self.assertEqual(listed['AMOX500']['next_expiry'], str(date.today() + timedelta(days=20)))
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.product = make_product()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 20}])
+        self.client = APIClient()
+
+    def stock_out(self, key, quantity=5, terminal='pos-1'):
+        headers = {'HTTP_X_CLIENT_ID': terminal} if terminal else {}
+        return self.client.post('/api/transactions/stock_out/', {'product_id': self.product.pk, 'quantity': quantity},
+                                format='json', HTTP_IDEMPOTENCY_KEY=key, **headers)
+
+    def test_retry_replays_stored_response_without_dispensing_again(self):
+        first = self.stock_out('pos-1-0001')
+        retry = self.stock_out('pos-1-0001')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.filter(transaction_type='OUT').count(), 1)
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 15)
+
+    def test_concurrent_duplicate_insert_replays_the_winner(self):
+        first = self.stock_out('pos-1-0004')
+        # A racing request that looked the key up before the first one committed
+        missed = IdempotencyRecord.objects.none()
+        with mock.patch.object(type(IdempotencyRecord.objects), 'filter', return_value=missed):
+            retry = self.stock_out('pos-1-0004')
+            conflict = self.stock_out('pos-1-0004', quantity=6)
+
+        self.assertEqual((retry.status_code, retry.json()), (201, first.json()))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(conflict.status_code, 422)
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 15)
+
+    def test_key_reuse_with_different_body_is_rejected(self):
+        self.stock_out('pos-1-0002', quantity=5)
+        self.assertEqual(self.stock_out('pos-1-0002', quantity=6).status_code, 422)
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 15)
+
+    def test_anonymous_keys_are_scoped_to_the_client_header(self):
+        # Two terminals behind one address reuse a key for different sales
+        self.assertEqual(self.stock_out('0001', quantity=5, terminal='pos-1').status_code, 201)
+        second = self.stock_out('0001', quantity=6, terminal='pos-2')
+        self.assertEqual(second.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', second)
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 9)
+
+        self.assertEqual(self.stock_out('0002', terminal=None).status_code, 400)
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 9)
+
+    def test_expired_keys_run_again_and_are_purged(self):
+        self.stock_out('pos-1-0003')
+        IdempotencyRecord.objects.update(expires_at=timezone.now())
+        self.assertNotIn('Idempotent-Replayed', self.stock_out('pos-1-0003'))
+        self.assertEqual(Inventory.objects.get(product=self.product).on_hand, 10)
+
+        IdempotencyRecord.objects.update(expires_at=timezone.now())
+        self.assertEqual(IdempotencyRecord.objects.purge_expired(), 1)
+
+
+class BatchedForecastTests(TestCase):
+    def setUp(self):
+        self.a, self.b = make_product(sku='A'), make_product(sku='B')
+        Transaction.objects.bulk_ingest([{'product': self.a, 'quantity': 28}])
+        today = date.today()
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(product=self.a, date=today - timedelta(days=3), qty_out=2, out_count=1),
+            DailyProductSales(product=self.a, date=today - timedelta(days=1), qty_out=4, out_count=1),
+            DailyProductSales(product=self.b, date=today - timedelta(days=200), qty_out=9, out_count=1),
+        ])
+
+    def test_single_product_forecast_counts_days_without_sales(self):
+        self.assertIn('error', PharmacyAIAgent().forecast_demand(product_id=self.a.pk))
+        ProductDemandStats.objects.rebuild()
+        with self.assertNumQueries(2):
+            forecast = PharmacyAIAgent().forecast_demand(product_id=self.a.pk, days=10)
+        # 6 units over 3 days, recent ones weighted up; the old sales-day average projected 30
+        self.assertAlmostEqual(forecast['avg_daily_demand'], 2, delta=0.1)
+        self.assertEqual(forecast['model'], 'online')
+        self.assertEqual(forecast['recommended_reorder_quantity'], 0)
+        self.assertTrue(0 <= forecast['stockout_risk'] <= 1)
+
+    def test_all_products_in_constant_queries(self):
+        with self.assertNumQueries(2):
+            result = PharmacyAIAgent().forecast_demand(days=10)
+        self.assertEqual(list(result['forecasts']), [self.a.pk])
+        self.assertEqual(result['forecasts'][self.a.pk]['current_stock'], 28)
+        self.assertIn('error', PharmacyAIAgent().forecast_demand(product_id=self.b.pk))
+
+    def test_optimization_reuses_forecast_arrays(self):
+        with self.assertNumQueries(2):
+            result = PharmacyAIAgent().optimize_inventory()
+        [row] = result['optimization_data']
+        self.assertEqual((row['product_id'], row['optimal_stock'], row['holding_cost']), (self.a.pk, 20.0, 0.19))
+        self.assertEqual(row['recommendation'], 'Stock level is optimal')
+        self.assertEqual(result['summary']['urgent_reorders_needed'], 0)
+
+
+class ForecastModelTests(SimpleTestCase):
+    def matrix(self, rows):
+        values = np.array(rows, dtype=float)
+        return DemandMatrix(np.arange(len(values)), date.today(), values)
+
+    def test_selects_a_model_per_series_in_one_pass(self):
+        days = np.arange(91)
+        weekly = np.where(days % 7 == 5, 10.0, 1.0)     # Saturday peak
+        intermittent = np.where(days % 9 == 0, 6.0, 0.0)  # a sale every 9 days
+        steady = np.full(91, 4.0)
+        result = forecasting.forecast(self.matrix([weekly, intermittent, steady]), np.zeros(3), 14)
+
+        self.assertEqual(list(result['model']), ['holt_winters', 'sba', 'ses'])
+        np.testing.assert_allclose(result['forecasted_demand'], [2 * (10 + 6), 14 * 6 / 9, 56], rtol=0.15)
+        self.assertAlmostEqual(result['demand_volatility'][2], 0)
+
+    def test_short_history_skips_holt_winters(self):
+        days = np.arange(21)
+        result = forecasting.forecast(self.matrix([np.where(days % 7 == 5, 10.0, 1.0)]), np.zeros(1), 7)
+        self.assertNotEqual(result['model'][0], 'holt_winters')
+
+
+class SystemHealthTests(TestCase):
+    def test_counts_in_one_aggregate_with_category_breakdown(self):
+        otc = Category.objects.create(name='OTC')
+        ok, low = make_product(sku='OK'), make_product(sku='LOW', category=otc)
+        make_product(sku='NOINV', category=otc)  # no inventory row: out of stock
+        Transaction.objects.bulk_ingest([{'product': ok, 'quantity': 50}, {'product': low, 'quantity': 5}])
+
+        with self.assertNumQueries(2):
+            health = PharmacyAIAgent().get_system_health_score()
+
+        self.assertEqual((health['total_products'], health['low_stock_count'], health['out_of_stock_count']),
+                         (3, 1, 1))
+        breakdown = {c['category_name']: c for c in health['category_breakdown']}
+        self.assertEqual((breakdown['OTC']['low_stock_count'], breakdown['OTC']['out_of_stock_count']), (1, 1))
+        self.assertEqual(breakdown['OTC']['stock_health'], 50.0)
+        self.assertEqual(breakdown['Antibiotics']['availability_health'], 100.0)
+
+
+class AnalyticsContextTests(TestCase):
+    def setUp(self):
+        self.product = make_product(sku='A')
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 40}])
+        today = timezone.localdate()
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(product=self.product, date=today - timedelta(days=days),
+                              qty_out=qty, out_count=1, revenue=Decimal(qty * 10))
+            for days, qty in ((1, 2), (2, 4), (150, 9))
+        ])
+
+    def test_insights_share_one_history_load(self):
+        with self.assertNumQueries(4):
+            insights = PharmacyAIAgent().get_ai_insights()
+
+        self.assertNotIn('error', insights)
+        forecast = insights['demand_forecast']['forecasts'][self.product.id]
+        self.assertEqual(forecast['current_stock'], 40)
+        self.assertEqual(insights['sales_trends']['total_revenue'], 60.0)
+
+    def test_trends_beyond_the_context_window_reload_history(self):
+        context = AnalyticsContext(trend_days=30)
+        self.assertFalse(context.covers(200))
+        trends = PharmacyAIAgent().predict_sales_trends(days=100, context=context)
+        self.assertEqual(trends['total_revenue'], 150.0)
+
+
+class AICacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.product = make_product(sku='A')
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 40}])
+
+    def test_repeat_call_is_served_from_cache_per_parameters(self):
+        first = self.client.get('/api/ai/demand-forecast/?days=14').json()
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/ai/demand-forecast/?days=14').json()
+        other = self.client.get('/api/ai/demand-forecast/?days=7').json()
+
+        self.assertFalse(first['cache']['hit'])
+        self.assertTrue(second['cache']['hit'])
+        self.assertGreaterEqual(second['cache']['age_seconds'], 0)
+        self.assertEqual(second['data'], first['data'])
+        self.assertFalse(other['cache']['hit'])
+
+    def test_stock_movement_invalidates_after_commit(self):
+        before = self.client.get('/api/ai/demand-forecast/?days=14').json()
+        with self.captureOnCommitCallbacks(execute=True):
+            Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 30}])
+        after = self.client.get('/api/ai/demand-forecast/?days=14').json()
+
+        self.assertFalse(after['cache']['hit'])
+        self.assertGreater(after['cache']['data_version'], before['cache']['data_version'])
+        self.assertEqual((before['data']['total_products_forecasted'], after['data']['total_products_forecasted']),
+                         (0, 1))
+
+
+class ProjectionMigrationTests(TransactionTestCase):
+    """Migrations that add a derived table fill it from the existing rows"""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        executor.loader.build_graph()
+        return executor.loader.project_state(target).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('pharma')[0])
+
+    def test_upgrade_builds_rollup_status_and_demand_stats(self):
+        apps = self.migrate(('pharma', '0004_inventorysnapshot'))
+        category = apps.get_model('pharma', 'Category').objects.create(name='Antibiotics')
+        product = apps.get_model('pharma', 'Product').objects.create(
+            category=category, sku='AMOX500', name='Amoxicillin', unit_price=Decimal('2.00'),
+            cost_price=Decimal('1.00'), reorder_level=10)
+        apps.get_model('pharma', 'Inventory').objects.create(product=product, quantity=54)
+        batch = apps.get_model('pharma', 'StockBatch').objects.create(
+            product=product, quantity=54, expiry_date=date.today() + timedelta(days=20))
+        Ledger = apps.get_model('pharma', 'Transaction')
+        Ledger.objects.create(product=product, batch=batch, transaction_type='IN', quantity=60)
+        Ledger.objects.create(product=product, batch=batch, transaction_type='OUT', quantity=-6,
+                              unit_price=Decimal('2.00'))
+
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('pharma')[0])
+        rollup = DailyProductSales.objects.get(product_id=product.pk)
+        self.assertEqual((rollup.qty_in, rollup.qty_out, rollup.revenue), (60, 6, Decimal('12.00')))
+        self.assertEqual(ProductDemandStats.objects.get(product_id=product.pk).day_qty, 6)
+        status = ProductStockStatus.objects.get(product_id=product.pk)
+        self.assertEqual((status.quantity, status.is_low, status.next_expiry, status.days_of_cover),
+                         (54, False, batch.expiry_date, 9.0))
+
+
+@override_settings(PHARMA_INSIGHTS_BACKGROUND_REFRESH=False, PHARMA_INSIGHTS_MAX_MOVEMENTS=2)
+class InsightSnapshotTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_product(sku='A')
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 40}])
+
+    def test_cold_start_computes_then_serves_the_snapshot(self):
+        first = self.client.get('/api/ai/comprehensive-insights/').json()
+        self.assertFalse(first['cache']['hit'])
+        self.assertEqual(InsightSnapshot.objects.count(), 1)
+
+        with self.assertNumQueries(2):  # latest snapshot + movement count
+            health = self.client.get('/api/ai/system-health/').json()
+        self.assertEqual((health['cache']['hit'], health['cache']['stale']), (True, False))
+        self.assertEqual(health['data'], first['data']['system_health'])
+
+    def test_snapshot_served_forecast_does_not_build_the_agent(self):
+        refresh_snapshot()
+        with mock.patch('pharma.ai_views.get_ai_agent') as get_agent:
+            resp = self.client.get('/api/ai/demand-forecast/')
+        self.assertEqual(resp.status_code, 200)
+        get_agent.assert_not_called()
+
+    def test_stale_after_movements_until_refreshed(self):
+        refresh_snapshot()
+        for _ in range(2):
+            Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 1}])
+        stale = self.client.get('/api/ai/inventory-optimization/').json()
+        self.assertEqual((stale['cache']['stale'], stale['cache']['refreshing']), (True, False))
+
+        call_command('precompute_insights', '--once', stdout=StringIO())
+        snapshot = InsightSnapshot.objects.latest_snapshot()
+        self.assertEqual(snapshot.last_transaction_id, Transaction.objects.order_by('-pk')[0].pk)
+        self.assertFalse(snapshot.is_stale())
+
+    def test_record_keeps_payloads_for_the_newest_and_history_for_the_rest(self):
+        payload = {'system_health': {'overall_score': 80.0}}
+        for _ in range(4):
+            InsightSnapshot.objects.record(payload, 0, 1, keep=2)
+        self.assertEqual(InsightSnapshot.objects.exclude(data={}).count(), 2)
+        self.assertEqual(list(InsightSnapshot.objects.values_list('health_score', flat=True)), [80.0] * 4)
+
+        InsightSnapshot.objects.update(computed_at=timezone.now() - timedelta(days=91))
+        InsightSnapshot.objects.record(payload, 0, 1, keep=2, history_days=90)
+        self.assertEqual(InsightSnapshot.objects.count(), 1)
+
+    def test_older_history_is_downsampled(self):
+        now = timezone.localtime().replace(hour=12, minute=30)
+        ages = [timedelta(hours=2), timedelta(hours=2, minutes=20),  # last day: kept as is
+                timedelta(days=2), timedelta(days=2, minutes=10), timedelta(days=2, hours=3),  # one per hour
+                timedelta(days=10), timedelta(days=10, hours=3)]  # one per day
+        for age in sorted(ages, reverse=True):
+            snapshot = InsightSnapshot.objects.record({'system_health': {'overall_score': 80.0}}, 0, 1)
+            InsightSnapshot.objects.filter(pk=snapshot.pk).update(computed_at=now - age)
+        InsightSnapshot.objects.downsample(now=now)
+        self.assertEqual(sorted(now - at for at in InsightSnapshot.objects.values_list('computed_at', flat=True)),
+                         [timedelta(hours=2), timedelta(hours=2, minutes=20),
+                          timedelta(days=2), timedelta(days=2, hours=3), timedelta(days=10)])
+
+
+class InsightHistoryTests(TestCase):
+    def setUp(self):
+        self.a, self.b = make_product(sku='A'), make_product(sku='B')
+        self.now = timezone.now()
+
+    def snapshot(self, days_ago, health, rates):
+        snapshot = InsightSnapshot.objects.record({
+            'system_health': {'overall_score': health},
+            'demand_forecast': {
+                'forecast_period_days': 30,
+                'summary': {'average_stockout_risk': 0.1},
+                'forecasts': {
+                    product.pk: {'model': 'ses', 'forecasted_demand': rate * 30, 'avg_daily_demand': rate,
+                                 'stockout_risk': 0.2, 'current_stock': 10}
+                    for product, rate in rates.items()
+                },
+            },
+        }, 0, 1)
+        InsightSnapshot.objects.filter(pk=snapshot.pk).update(computed_at=self.now - timedelta(days=days_ago))
+        return snapshot
+
+    def test_refresh_stores_metrics_and_forecast_rows(self):
+        Transaction.objects.bulk_ingest([{'product': self.a, 'quantity': 40}])
+        DailyProductSales.objects.create(product=self.a, date=date.today() - timedelta(days=2), qty_out=4, out_count=1)
+        snapshot = refresh_snapshot()
+        self.assertEqual(snapshot.health_score, snapshot.data['system_health']['overall_score'])
+        self.assertEqual(snapshot.forecast_days, 30)
+        self.assertEqual(list(snapshot.forecasts.values_list('product_id', 'current_stock')), [(self.a.pk, 40)])
+
+    def test_metrics_report_forecast_error_from_stored_rows(self):
+        today = timezone.localdate(self.now)
+        self.snapshot(4, 70.0, {self.a: 2.0, self.b: 1.0})
+        self.snapshot(0, 90.0, {self.a: 3.0})
+        # Three elapsed days for the older snapshot: A sold 9 (forecast 6), B sold 3 (forecast 3)
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(product=self.a, date=today - timedelta(days=2), qty_out=9, out_count=1),
+            DailyProductSales(product=self.b, date=today - timedelta(days=1), qty_out=3, out_count=1),
+            DailyProductSales(product=self.b, date=today, qty_out=50, out_count=1),
+        ])
+        with self.assertNumQueries(2):
+            history = insight_history.metrics(days=30, now=self.now)
+        self.assertEqual([h['health_score'] for h in history], [70.0, 90.0])
+        self.assertEqual([h['forecast_error_days'] for h in history], [3, 0])
+        self.assertEqual([h['forecast_error'] for h in history], [0.25, None])
+        self.assertEqual([h['forecast_bias'] for h in history], [-0.25, None])
+
+        resp = APIClient().get('/api/ai/insight-history/', {'product': self.a.pk})
+        forecasts = resp.json()['data']['forecasts']
+        self.assertEqual([(f['avg_daily_demand'], f['actual_daily_demand']) for f in forecasts], [(2.0, 3.0), (3.0, None)])
+
+
+class AlertRuleTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = make_product(sku='A', name='Amoxicillin')
+
+    def open_alerts(self):
+        return dict(Alert.objects.open().filter(product=self.product).values_list('kind', 'severity'))
+
+    def test_movements_open_update_and_resolve_alerts(self):
+        self.assertEqual(self.open_alerts(), {'out_of_stock': 'critical'})
+
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 10,
+                                          'expiry_date': timezone.localdate() + timedelta(days=10)}])
+        self.assertEqual(self.open_alerts(), {'low_stock': 'high', 'expiring': 'high'})
+        self.assertEqual(Alert.objects.filter(kind='out_of_stock', resolved_at__isnull=False).count(), 1)
+
+        Transaction.objects.bulk_dispense([{'product': self.product, 'quantity': 10}])
+        self.assertEqual(self.open_alerts(), {'out_of_stock': 'critical'})
+
+    def test_only_the_touched_product_is_evaluated(self):
+        other = make_product(sku='B')
+        Alert.objects.filter(product=other).delete()
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 50}])
+        self.assertFalse(Alert.objects.filter(product=other).exists())
+        self.assertEqual(alerts.evaluate(), (1, 0, 0))  # a full pass picks B up again
+
+    def test_summary_reads_open_alerts_and_the_latest_health_score(self):
+        make_product(sku='B')
+        low = [self.product] + [make_product(sku=f'L{i}') for i in range(5)]
+        Transaction.objects.bulk_ingest([{'product': product, 'quantity': 5} for product in low])
+        InsightSnapshot.objects.record({'system_health': {'overall_score': 60.0}}, 0, 1)
+
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/ai/alert-summary/').json()['data']
+
+        self.assertEqual((data['total_alerts'], data['critical_alerts'], data['high_alerts']), (3, 2, 1))
+        self.assertEqual([a['type'] for a in data['alerts']], ['system_health', 'out_of_stock', 'low_stock'])
+        self.assertEqual(data['alerts'][0]['message'], 'System health score is 60.0 - needs immediate attention')
+        self.assertEqual(data['alerts'][2]['message'], '6 products are low on stock')
+
+        # Five low products and a healthy score raise neither summary alert
+        Transaction.objects.bulk_ingest([{'product': self.product, 'quantity': 50}])
+        InsightSnapshot.objects.record({'system_health': {'overall_score': 85.0}}, 0, 1)
+        data = self.client.get('/api/ai/alert-summary/').json()['data']
+        self.assertEqual([a['type'] for a in data['alerts']], ['out_of_stock'])
+        self.assertEqual(Alert.objects.open().filter(kind='low_stock').count(), 5)
+
+
+class BacktestTests(TestCase):
+    def test_rolling_origins_keep_a_full_history_window(self):
+        self.assertEqual(backtesting.cutoffs(120, 14, folds=5, step=7, history_days=90), [92, 99, 106])
+
+    def test_steady_demand_backtests_without_error(self):
+        product = make_product(sku='A')
+        end = timezone.localdate() - timedelta(days=1)
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(product=product, date=end - timedelta(days=n), qty_out=3, out_count=1)
+            for n in range(130)
+        ])
+        backtest = Backtest(horizon=7, folds=3, step=7, end=end).run()
+
+        self.assertEqual(len(backtest.cutoff_dates()), 3)
+        overall = backtest.overall()
+        self.assertEqual(overall['points'], 3)
+        self.assertAlmostEqual(overall['mae'], 0, places=6)
+        self.assertEqual(backtest.by_category()['Antibiotics']['points'], 3)
+
+        out = StringIO()
+        call_command('backtest_forecasts', '--horizon', '7', '--folds', '2', '--workers', '1', stdout=out)
+        self.assertIn('Overall: MAE 0.00', out.getvalue())
+
+
+class SalesTrendEngineTests(TestCase):
+    def setUp(self):
+        otc = Category.objects.create(name='OTC')
+        self.a, self.b = make_product(sku='A'), make_product(sku='B', category=otc, unit_price=Decimal('2.00'))
+        Transaction.objects.bulk_ingest([{'product': self.a, 'quantity': 100}, {'product': self.b, 'quantity': 100}])
+        Transaction.objects.bulk_dispense([{'product': self.a, 'quantity': 4}, {'product': self.b, 'quantity': 5}])
+
+    def test_granularities_bucket_the_same_sales(self):
+        agent = PharmacyAIAgent()
+        for granularity in ('hour', 'day', 'week'):
+            with self.subTest(granularity=granularity), self.assertNumQueries(2):
+                trends = agent.predict_sales_trends(days=7, granularity=granularity)
+            self.assertEqual((trends['total_revenue'], trends['total_units'], trends['total_sales']), (60.0, 9, 2))
+            self.assertEqual(trends['series'][-1]['units'], 9)
+        weekday = timezone.localdate().strftime('%A')
+        self.assertEqual(trends['day_of_week_pattern'][weekday], 30.0)
+
+    def test_group_by_category_splits_the_series(self):
+        response = self.client.get('/api/ai/sales-trends/?days=7&group_by=category')
+        groups = response.json()['data']['groups']
+        self.assertEqual({name: g['total_revenue'] for name, g in groups.items()},
+                         {'Antibiotics': 50.0, 'OTC': 10.0})
+        self.assertEqual(self.client.get('/api/ai/sales-trends/?granularity=month').status_code, 400)
+
+
+class ParallelForecastTests(TestCase):
+    def setUp(self):
+        self.products = [make_product(sku=f'P{i}') for i in range(5)]
+        today = timezone.localdate()
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(product=p, date=today - timedelta(days=n), qty_out=i + n % 3, out_count=1)
+            for i, p in enumerate(self.products) for n in range(0, 60, i + 1)
+        ])
+
+    def test_shard_failure_surfaces_the_worker_error(self):
+        block = shared_memory.SharedMemory(create=True, size=8)
+        try:
+            with self.assertRaisesRegex(TypeError, 'buffer is too small'):
+                parallel._forecast_shard(block.name, (4, 60), (0, 2), np.zeros(2), 14)
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_sharded_processes_match_the_in_process_forecast(self):
+        serial = PharmacyAIAgent(workers=1).forecast_demand(days=14)
+        sharded = PharmacyAIAgent(workers=2, shard_size=2).forecast_demand(days=14)
+
+        self.assertEqual(sharded['forecasts'], serial['forecasts'])
+        self.assertEqual((sharded['timing']['workers'], sharded['timing']['shards']), (2, 3))
+        self.assertEqual(serial['timing']['shards'], 1)
+        self.assertGreater(sharded['timing']['parallel_efficiency'], 0)
+        self.assertAlmostEqual(sharded['timing']['estimated_speedup'],
+                               sharded['timing']['parallel_efficiency'] * 2, delta=0.03)
+
+
+class BatchProductRecommendationTests(TestCase):
+    def setUp(self):
+        other = Category.objects.create(name='Analgesics')
+        self.a = make_product(sku='A', reorder_level=50)
+        self.b = make_product(sku='B', reorder_level=5)
+        self.c = make_product(sku='C', category=other, reorder_level=50)
+        Transaction.objects.bulk_ingest([{'product': p, 'quantity': 20} for p in (self.a, self.b, self.c)])
+        now = timezone.now()
+        ProductDemandStats.objects.record([
+            Transaction(product=product, transaction_type='OUT', quantity=-qty, created_at=now - timedelta(days=ago))
+            for product in (self.a, self.b) for ago, qty in ((5, 4), (3, 6), (1, 5))
+        ])
+        self.client = APIClient()
+
+    def recommend(self, **params):
+        return self.client.get('/api/ai/product-recommendations/', params)
+
+    def test_ids_in_constant_queries(self):
+        with self.assertNumQueries(2):
+            resp = self.recommend(ids=f'{self.a.pk},{self.b.pk},{self.c.pk}')
+        products = resp.json()['data']['products']
+        self.assertEqual(list(products), [str(self.a.pk), str(self.b.pk), str(self.c.pk)])
+        self.assertEqual(products[str(self.a.pk)]['forecast']['model'], 'online')
+        self.assertEqual(products[str(self.a.pk)]['forecast']['sku'], 'A')
+        self.assertIn('error', products[str(self.c.pk)])
+
+        single = self.client.get(f'/api/ai/product-recommendations/{self.a.pk}/').json()['data']
+        batched = products[str(self.a.pk)]
+        del batched['forecast']['product_name'], batched['forecast']['sku']
+        self.assertEqual(single, batched)
+
+    def test_filters(self):
+        self.assertEqual(list(self.recommend(low_stock='true').json()['data']['products']),
+                         [str(self.a.pk), str(self.c.pk)])
+        self.assertEqual(list(self.recommend(low_stock='true', category=self.a.category_id).json()['data']['products']),
+                         [str(self.a.pk)])
+
+    def test_rejects_missing_or_bad_selection(self):
+        self.assertEqual(self.recommend().status_code, 400)
+        self.assertEqual(self.recommend(ids='1,x').status_code, 400)
+
+
+class StartupImportTests(SimpleTestCase):
+    # django.setup() plus URL loading measured ~600 ms with the AI stack
+    # deferred and ~1150 ms with numpy/scipy/pandas imported eagerly
+    STARTUP = (
+        "import sys, django; django.setup(); "
+        "from django.urls import get_resolver; get_resolver().url_patterns; "
+        "print(' '.join(m for m in ('numpy', 'scipy', 'pandas', 'pharma.ai_agent') if m in sys.modules))"
+    )
+
+    def test_url_loading_defers_the_ai_stack(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+        result = subprocess.run([sys.executable, '-c', self.STARTUP],
+                                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), '')
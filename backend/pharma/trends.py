@@ -0,0 +1,120 @@
+"""
+Sales trend engine. Revenue, units and sale counts are bucketed in SQL by
+hour, day or week (optionally per category or supplier), and only the
+resulting short series are handled in NumPy: gaps are filled with zeros
+and a linear trend is fitted per series.
+
+Day and week buckets are read from the DailyProductSales rollup; hourly
+buckets need the Transaction ledger itself.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, ExtractWeekDay, TruncHour, TruncWeek
+from django.utils import timezone
+
+from .models import DailyProductSales, Transaction
+
+BUCKET_LENGTH = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+    'week': timedelta(weeks=1),
+}
+GROUP_FIELDS = {
+    'category': 'product__category__name',
+    'supplier': 'product__supplier__name',
+}
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def bucket_starts(granularity, window, now=None):
+    """The `window` most recent bucket keys, oldest first, ending with the current bucket"""
+    now = timezone.localtime(now)
+    if granularity == 'hour':
+        last = now.replace(minute=0, second=0, microsecond=0)
+    elif granularity == 'week':
+        last = now.date() - timedelta(days=now.weekday())
+    else:
+        last = now.date()
+    step = BUCKET_LENGTH[granularity]
+    return [last - step * i for i in range(window - 1, -1, -1)]
+
+
+def _source(granularity, first):
+    """(rows, bucket expression, aggregates) for buckets from `first` on"""
+    if granularity == 'hour':
+        rows = Transaction.objects.filter(transaction_type='OUT', created_at__gte=first)
+        revenue = -F('quantity') * Coalesce(F('unit_price'), Value(0), output_field=DecimalField())
+        return rows, TruncHour('created_at'), 'created_at', {
+            'revenue': Sum(revenue, output_field=DecimalField()),
+            'units': Sum(-F('quantity')),
+            'sales': Count('pk'),
+        }
+    rows = DailyProductSales.objects.filter(date__gte=first, out_count__gt=0)
+    bucket = TruncWeek('date') if granularity == 'week' else F('date')
+    return rows, bucket, 'date', {
+        'revenue': Sum('revenue'),
+        'units': Sum('qty_out'),
+        'sales': Sum('out_count'),
+    }
+
+
+def sales_series(granularity='day', window=30, group_by=None, now=None):
+    """
+    Dense revenue/units/sales arrays over the last `window` buckets, from
+    one grouped query. Returns (bucket keys, {group: {revenue, units,
+    sales}}); the single group is None unless `group_by` is 'category' or
+    'supplier'.
+    """
+    keys = bucket_starts(granularity, window, now)
+    rows, bucket, _, aggregates = _source(granularity, keys[0])
+    fields = ['bucket'] + ([GROUP_FIELDS[group_by]] if group_by else [])
+    index = {key: i for i, key in enumerate(keys)}
+
+    series = {}
+    for row in rows.order_by().annotate(bucket=bucket).values(*fields).annotate(**aggregates):
+        key = row['bucket']
+        if isinstance(key, datetime) and granularity != 'hour':
+            key = key.date()  # TruncWeek over a DateField comes back as a datetime on some backends
+        i = index.get(key)
+        if i is None:
+            continue
+        group = row[GROUP_FIELDS[group_by]] if group_by else None
+        arrays = series.setdefault(group, {name: np.zeros(window) for name in aggregates})
+        for name in aggregates:
+            arrays[name][i] = float(row[name] or 0)
+    if not group_by:
+        series.setdefault(None, {name: np.zeros(window) for name in aggregates})
+    return keys, series
+
+
+def weekday_pattern(granularity='day', window=30, now=None):
+    """Average sale value per weekday over the window, aggregated in SQL"""
+    keys = bucket_starts(granularity, window, now)
+    rows, _, field, aggregates = _source(granularity, keys[0])
+    totals = (rows.order_by()
+              .annotate(weekday=ExtractWeekDay(field))
+              .values('weekday')
+              .annotate(revenue=aggregates['revenue'], sales=aggregates['sales']))
+    pattern = dict.fromkeys(WEEKDAYS, 0.0)
+    for row in totals:
+        # ExtractWeekDay counts from Sunday = 1
+        name = WEEKDAYS[(row['weekday'] - 2) % 7]
+        pattern[name] = round(float(row['revenue']) / row['sales'], 2) if row['sales'] else 0.0
+    return pattern
+
+
+def fit_trend(values, horizon):
+    """
+    Least-squares line through a bucketed series. Returns the slope per
+    bucket, growth of the fitted line over the window (%), and the summed
+    projection for the next `horizon` buckets (floored at zero).
+    """
+    x = np.arange(len(values))
+    slope, intercept = np.polyfit(x, values, 1)
+    start, end = intercept, intercept + slope * x[-1]
+    growth = (end - start) / start * 100 if start > 0 else 0.0
+    future = np.arange(len(values), len(values) + horizon)
+    projected = np.clip(slope * future + intercept, 0, None).sum()
+    return float(slope), float(growth), float(projected)
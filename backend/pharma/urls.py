@@ -19,7 +19,10 @@ urlpatterns = [
     path('ai/inventory-optimization/', ai_views.ai_inventory_optimization, name='ai_inventory_optimization'),
     path('ai/sales-trends/', ai_views.ai_sales_trends, name='ai_sales_trends'),
     path('ai/comprehensive-insights/', ai_views.ai_comprehensive_insights, name='ai_comprehensive_insights'),
+    path('ai/product-recommendations/', ai_views.ai_batch_product_recommendations,
+         name='ai_batch_product_recommendations'),
     path('ai/product-recommendations/<int:product_id>/', ai_views.ai_product_recommendations, name='ai_product_recommendations'),
+    path('ai/insight-history/', ai_views.ai_insight_history, name='ai_insight_history'),
     path('ai/alert-summary/', ai_views.ai_alert_summary, name='ai_alert_summary'),
     
     path('ai/database-context/', ai_views.get_database_context, name='get_database_context'),
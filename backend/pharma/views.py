@@ -1,28 +1,60 @@
 from datetime import datetime, time, timedelta
 
+from django.core.exceptions import ValidationError
 from django.db import transaction as db_txn
-from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models import (Count, DecimalField, ExpressionWrapper, F, Prefetch, Q, Sum,
+                              prefetch_related_objects)
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from .db import retry_on_lock
 from .filters import InventoryFilter
-from .models import (Category, Inventory, Product, StockBatch, Supplier,
-                     Transaction)
+from .idempotency import idempotent
+from .models import (Category, DailyProductSales, Inventory, Product,
+                     ProductStockStatus, StockBatch, Supplier, Transaction)
 from .serializers import (CategoryDetailSerializer, CategorySerializer,
                           InventorySerializer, ProductDetailSerializer,
                           ProductSerializer, StockBatchSerializer,
                           SupplierDetailSerializer, SupplierSerializer,
                           TransactionSerializer)
 
+# Relations ProductSerializer reads (names and the stock-status projection)
+PRODUCT_RELATED = ('category', 'supplier', 'stock_status')
 
-class CategoryViewSet(viewsets.ModelViewSet):
+
+def products_prefetch():
+    """Prefetch for the nested product lists of category/supplier detail views"""
+    return Prefetch('products', queryset=Product.objects.select_related(*PRODUCT_RELATED))
+
+
+class LockRetryMixin:
+    """Retry the standard create/update/destroy writes when SQLite is locked"""
+
+    @retry_on_lock
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    # partial_update goes through update, so it is covered here too
+    @retry_on_lock
+    def update(self, request, *args, **kwargs):
+        return super().update(request, *args, **kwargs)
+
+    @retry_on_lock
+    def destroy(self, request, *args, **kwargs):
+        return super().destroy(request, *args, **kwargs)
+
+
+class CategoryViewSet(LockRetryMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     """ViewSet for Category CRUD operations"""
     def get_queryset(self):
-        return Category.objects.annotate(product_count=Count('products'))
+        qs = Category.objects.annotate(product_count=Count('products'))
+        if self.action == 'retrieve':
+            qs = qs.prefetch_related(products_prefetch())
+        return qs
 
     serializer_class = CategorySerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -37,7 +69,7 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def products(self, request, pk=None):
         """Get all products in a category"""
         category = self.get_object()
-        products = category.products.all()
+        products = category.products.select_related(*PRODUCT_RELATED)
         return Response(ProductSerializer(products, many=True).data)
 
     @action(detail=False, methods=['get'])
@@ -52,11 +84,14 @@ class CategoryViewSet(viewsets.ModelViewSet):
         })
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(LockRetryMixin, viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
     """ViewSet for Supplier CRUD operations"""
     def get_queryset(self):
-        return Supplier.objects.annotate(product_count=Count('products'))
+        qs = Supplier.objects.annotate(product_count=Count('products'))
+        if self.action == 'retrieve':
+            qs = qs.prefetch_related(products_prefetch())
+        return qs
 
     serializer_class = SupplierSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -72,7 +107,7 @@ class SupplierViewSet(viewsets.ModelViewSet):
     def products(self, request, pk=None):
         """Get all products from a supplier"""
         supplier = self.get_object()
-        products = supplier.products.all()
+        products = supplier.products.select_related(*PRODUCT_RELATED)
         return Response(ProductSerializer(products, many=True).data)
 
     @action(detail=False, methods=['get'])
@@ -82,11 +117,9 @@ class SupplierViewSet(viewsets.ModelViewSet):
         return Response(self.get_serializer(suppliers, many=True).data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(LockRetryMixin, viewsets.ModelViewSet):
     """ViewSet for Product CRUD operations"""
-    queryset = (Product.objects
-        .select_related('category', 'supplier')
-        .annotate(current_stock=F('inventory__quantity')))
+    queryset = Product.objects.select_related(*PRODUCT_RELATED)
     serializer_class = ProductSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['category', 'supplier', 'is_active']
@@ -97,16 +130,22 @@ class ProductViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         return ProductDetailSerializer if self.action == 'retrieve' else ProductSerializer
 
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == 'retrieve':
+            qs = qs.prefetch_related('transactions__batch', 'transactions__allocations__batch')
+        return qs
+
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         """Get products with low stock"""
-        products = self.get_queryset().filter(inventory__quantity__lte=F('reorder_level'))
+        products = self.get_queryset().filter(stock_status__is_low=True)
         return Response(self.get_serializer(products, many=True).data)
 
     @action(detail=False, methods=['get'])
     def out_of_stock(self, request):
         """Get products that are out of stock"""
-        products = self.get_queryset().filter(inventory__quantity=0)
+        products = self.get_queryset().filter(stock_status__is_out=True)
         return Response(self.get_serializer(products, many=True).data)
 
     @action(detail=False, methods=['get'])
@@ -114,20 +153,22 @@ class ProductViewSet(viewsets.ModelViewSet):
         """Get product statistics"""
         total_products = Product.objects.count()
         active_products = Product.objects.filter(is_active=True).count()
-        low_stock_products = Product.objects.filter(inventory__quantity__lte=F('reorder_level')).count()
-        out_of_stock_products = Product.objects.filter(inventory__quantity=0).count()
-        total_value = Inventory.objects.aggregate(
-            total=Sum(F('quantity') * F('product__unit_price'))
-        )['total'] or 0
+        stock = ProductStockStatus.objects.aggregate(
+            low=Count('pk', filter=Q(is_low=True)),
+            out=Count('pk', filter=Q(is_out=True)),
+            value=Sum('stock_value'),
+        )
         return Response({
             'total_products': total_products,
             'active_products': active_products,
-            'low_stock_products': low_stock_products,
-            'out_of_stock_products': out_of_stock_products,
-            'total_inventory_value': total_value
+            'low_stock_products': stock['low'],
+            'out_of_stock_products': stock['out'],
+            'total_inventory_value': stock['value'] or 0
         })
 
     @action(detail=True, methods=['post'])
+    @retry_on_lock
+    @idempotent
     def adjust_stock(self, request, pk=None):
         """Adjust stock for a product (+/- quantity)"""
         product = self.get_object()
@@ -137,11 +178,8 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Quantity must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
         notes = request.data.get('notes', '')
 
-        with db_txn.atomic():
-            inv, _ = Inventory.objects.select_for_update().get_or_create(product=product)
-            inv.quantity = F('quantity') + delta
-            inv.save(update_fields=['quantity'])
-
+        # Transaction.save posts the adjustment to the ledger and to Inventory
+        try:
             txn = Transaction.objects.create(
                 product=product,
                 transaction_type='ADJUST',
@@ -149,9 +187,11 @@ class ProductViewSet(viewsets.ModelViewSet):
                 unit_price=product.unit_price,
                 notes=notes
             )
+        except ValidationError as e:
+            return Response({'error': ' '.join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
         return Response(TransactionSerializer(txn).data, status=status.HTTP_201_CREATED)
 
-class StockBatchViewSet(viewsets.ModelViewSet):
+class StockBatchViewSet(LockRetryMixin, viewsets.ModelViewSet):
     queryset = (StockBatch.objects
                 .select_related('product', 'supplier', 'product__category'))
     serializer_class = StockBatchSerializer
@@ -256,9 +296,10 @@ class InventoryViewSet(viewsets.ReadOnlyModelViewSet):
     """ViewSet for Inventory read operations"""
     queryset = (Inventory.objects
         .select_related('product', 'product__category', 'product__supplier')
+        .with_stock()
         .annotate(
             total_value_db=ExpressionWrapper(
-                F('quantity') * F('product__unit_price'),
+                F('on_hand_db') * F('product__unit_price'),
                 output_field=DecimalField(max_digits=12, decimal_places=2),
             )
         ))
@@ -266,41 +307,44 @@ class InventoryViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_class = InventoryFilter
     search_fields = ['product__name', 'product__sku']
-    ordering_fields = ['quantity', 'last_updated', 'total_value_db']
-    ordering = ['-quantity']
+    ordering_fields = ['quantity', 'on_hand_db', 'last_updated', 'total_value_db']
+    ordering = ['-on_hand_db']
 
     @action(detail=False, methods=['get'])
     def low_stock(self, request):
         """Get inventory items with low stock (explicit condition; no non-DB fields)"""
-        inventory = self.get_queryset().filter(quantity__lte=F('product__reorder_level'))
+        inventory = self.get_queryset().filter(product__stock_status__is_low=True)
         return Response(self.get_serializer(inventory, many=True).data)
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
         """Get inventory summary"""
         total_items = Inventory.objects.count()
-        low_stock_items = Inventory.objects.filter(quantity__lte=F('product__reorder_level')).count()
-        out_of_stock_items = Inventory.objects.filter(quantity=0).count()
-        total_value = Inventory.objects.aggregate(
-            total=Sum(F('quantity') * F('product__unit_price'))
-        )['total'] or 0
+        stock = ProductStockStatus.objects.filter(product__inventory__isnull=False).aggregate(
+            low=Count('pk', filter=Q(is_low=True)),
+            out=Count('pk', filter=Q(is_out=True)),
+            value=Sum('stock_value'),
+        )
         return Response({
             'total_items': total_items,
-            'low_stock_items': low_stock_items,
-            'out_of_stock_items': out_of_stock_items,
-            'total_value': total_value
+            'low_stock_items': stock['low'],
+            'out_of_stock_items': stock['out'],
+            'total_value': stock['value'] or 0
         })
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
-    """ViewSet for Transaction CRUD operations"""
-    queryset = Transaction.objects.select_related('product', 'product__category')
+class TransactionViewSet(LockRetryMixin, viewsets.ModelViewSet):
+    """ViewSet for the transaction ledger (append-only: no update or delete)"""
+    queryset = (Transaction.objects
+        .select_related('product', 'product__category', 'batch')
+        .prefetch_related('allocations__batch'))
     serializer_class = TransactionSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['transaction_type', 'product', 'product__category']
     search_fields = ['product__name', 'product__sku', 'reference', 'notes']
     ordering_fields = ['created_at', 'quantity', 'unit_price']
     ordering = ['-created_at']
+    http_method_names = ['get', 'post', 'head', 'options']
 
     @action(detail=False, methods=['get'])
     def recent(self, request):
@@ -320,129 +364,129 @@ class TransactionViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Get transaction summary"""
-        tznow = timezone.now()
-        start_today = datetime.combine(tznow.date(), time.min, tzinfo=tznow.tzinfo)
-        end_today = datetime.combine(tznow.date(), time.max, tzinfo=tznow.tzinfo)
-        thirty_days_ago = tznow - timedelta(days=30)
-
-        today_qs = Transaction.objects.filter(created_at__gte=start_today, created_at__lte=end_today)
-        last30_qs = Transaction.objects.filter(created_at__gte=thirty_days_ago)
-
-        today_stats = today_qs.aggregate(
-            total_in=Sum('quantity', filter=Q(transaction_type='IN')),
-            total_out=Sum('quantity', filter=Q(transaction_type='OUT')),
-            count=Count('id')
-        )
-        monthly_stats = last30_qs.aggregate(
-            total_in=Sum('quantity', filter=Q(transaction_type='IN')),
-            total_out=Sum('quantity', filter=Q(transaction_type='OUT')),
-            count=Count('id')
+        """Get transaction summary (read from the daily sales rollup)"""
+        today = timezone.localdate()
+        thirty_days_ago = today - timedelta(days=30)
+
+        totals = dict(
+            total_in=Sum('qty_in'),
+            total_out=Sum('qty_out'),
+            count=Sum('txn_count')
         )
+        today_stats = DailyProductSales.objects.filter(date=today).aggregate(**totals)
+        monthly_stats = DailyProductSales.objects.filter(date__gte=thirty_days_ago).aggregate(**totals)
 
         return Response({
             'today': {
                 'stock_in': today_stats['total_in'] or 0,
-                'stock_out': today_stats['total_out'] or 0,
+                'stock_out': -(today_stats['total_out'] or 0),
                 'transaction_count': today_stats['count'] or 0
             },
             'last_30_days': {
                 'stock_in': monthly_stats['total_in'] or 0,
-                'stock_out': monthly_stats['total_out'] or 0,
+                'stock_out': -(monthly_stats['total_out'] or 0),
                 'transaction_count': monthly_stats['count'] or 0
             }
         })
 
     @action(detail=False, methods=['post'])
+    @retry_on_lock
+    @idempotent
     def bulk_stock_in(self, request):
-        """Bulk stock in operation (atomic + updates inventory)"""
+        """Bulk stock in operation (set-based: one atomic ingest for all lines)"""
         items = request.data.get('items', [])
         reference = request.data.get('reference', '')
         notes = request.data.get('notes', '')
         if not items:
             return Response({'error': 'Items list is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        created = []
-        with db_txn.atomic():
-            for item in items:
-                pid = item.get('product_id')
-                qty = item.get('quantity')
-                price = item.get('unit_price')
-                try:
-                    qty = int(qty)
-                    product = Product.objects.select_related('inventory').get(id=pid)
-                except (TypeError, ValueError, Product.DoesNotExist):
-                    continue
-
-                inv, _ = Inventory.objects.select_for_update().get_or_create(product=product)
-                inv.quantity = F('quantity') + qty
-                inv.save(update_fields=['quantity'])
-
-                created.append(Transaction.objects.create(
-                    product=product, transaction_type='IN',
-                    quantity=qty, unit_price=price, reference=reference, notes=notes
-                ))
+        lines = []
+        for item in items:
+            try:
+                lines.append((int(item.get('product_id')), int(item.get('quantity')), item))
+            except (TypeError, ValueError):
+                continue
+        products = Product.objects.in_bulk([pid for pid, _, _ in lines])
+
+        rows = [{
+            'product': products[pid],
+            'quantity': qty,
+            'unit_price': item.get('unit_price'),
+            'reference': reference,
+            'notes': notes,
+        } for pid, qty, item in lines if pid in products and qty > 0]
+
+        created = Transaction.objects.bulk_ingest(rows)
         return Response(TransactionSerializer(created, many=True).data, status=status.HTTP_201_CREATED)
 
     @action(detail=False, methods=['post'])
+    @retry_on_lock
+    @idempotent
     def stock_out(self, request):
-        """Single-item stock out (dispense/sale)"""
+        """Single-item stock out (dispense/sale), split across lots in FEFO order"""
         pid = request.data.get('product_id')
         qty = request.data.get('quantity')
         reference = request.data.get('reference', '')
         notes = request.data.get('notes', '')
         try:
             qty = int(qty)
-            product = Product.objects.select_related('inventory').get(id=pid)
+            product = Product.objects.get(id=pid)
         except (TypeError, ValueError, Product.DoesNotExist):
             return Response({'error': 'Invalid product_id or quantity'}, status=status.HTTP_400_BAD_REQUEST)
+        if qty <= 0:
+            return Response({'error': 'Quantity must be positive'}, status=status.HTTP_400_BAD_REQUEST)
 
         with db_txn.atomic():
-            inv, _ = Inventory.objects.select_for_update().get_or_create(product=product)
-            inv.refresh_from_db(fields=['quantity'])
-            if inv.quantity < qty:
+            # A sharded product's counter row is not locked (see bulk_dispense)
+            inv = (Inventory.objects.select_for_update().filter(product=product, sharded=False).with_stock().first()
+                   or Inventory.objects.filter(product=product).with_stock().first())
+            if inv is None or inv.on_hand < qty:
                 return Response({'error': 'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
-            inv.quantity = F('quantity') - qty
-            inv.save(update_fields=['quantity'])
 
-            txn = Transaction.objects.create(
-                product=product, transaction_type='OUT',
-                quantity=qty, unit_price=product.unit_price,
-                reference=reference, notes=notes
-            )
+            # Transaction.save allocates lots and decrements batches + inventory
+            try:
+                txn = Transaction.objects.create(
+                    product=product, transaction_type='OUT',
+                    quantity=-qty, unit_price=product.unit_price,
+                    reference=reference, notes=notes
+                )
+            except ValidationError as e:
+                return Response({'error': ' '.join(e.messages)}, status=status.HTTP_400_BAD_REQUEST)
         return Response(TransactionSerializer(txn).data, status=status.HTTP_201_CREATED)
 
     @action(detail=False, methods=['post'])
+    @retry_on_lock
+    @idempotent
     def bulk_stock_out(self, request):
-        """Bulk stock out (atomic)"""
+        """
+        Bulk stock out, all-or-nothing: every line is validated before any
+        write, and lots are drawn FEFO. A failure returns a per-line report.
+        """
         items = request.data.get('items', [])
         reference = request.data.get('reference', '')
         notes = request.data.get('notes', '')
         if not items:
             return Response({'error': 'Items list is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        created = []
-        with db_txn.atomic():
-            for item in items:
-                pid = item.get('product_id')
-                qty = item.get('quantity')
-                try:
-                    qty = int(qty)
-                    product = Product.objects.select_related('inventory').get(id=pid)
-                except (TypeError, ValueError, Product.DoesNotExist):
-                    continue
-
-                inv, _ = Inventory.objects.select_for_update().get_or_create(product=product)
-                inv.refresh_from_db(fields=['quantity'])
-                if inv.quantity < qty:
-                    return Response({'error': f'Insufficient stock for product {pid}'}, status=status.HTTP_400_BAD_REQUEST)
-
-                inv.quantity = F('quantity') - qty
-                inv.save(update_fields=['quantity'])
-
-                created.append(Transaction.objects.create(
-                    product=product, transaction_type='OUT',
-                    quantity=qty, unit_price=product.unit_price,
-                    reference=reference, notes=notes
-                ))
+        rows = []
+        for item in items:
+            try:
+                pid = int(item.get('product_id'))
+            except (TypeError, ValueError):
+                pid = None
+            rows.append({'product_id': pid, 'quantity': item.get('quantity'),
+                         'reference': reference, 'notes': notes})
+
+        try:
+            created = Transaction.objects.bulk_dispense(rows)
+        except ValidationError as e:
+            return Response({
+                'error': 'Stock out rejected; no items were dispensed',
+                'line_errors': [
+                    {'line': line, 'product_id': items[line].get('product_id'), 'errors': messages}
+                    for line, messages in e.message_dict.items()
+                ],
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        prefetch_related_objects(created, 'allocations__batch')
         return Response(TransactionSerializer(created, many=True).data, status=status.HTTP_201_CREATED)
@@ -18,6 +18,7 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()
 
+from django.core.management import call_command
 from django.db import transaction as db_transaction
 from django.utils import timezone
 from pharma.models import Category, Inventory, Product, Supplier, Transaction
@@ -347,24 +348,27 @@ def ensure_inventory_shells(products):
     return out
 
 # ---------- Batches + Transactions ----------
-def make_batch(product, qty, received_dt, supplier=None):
-    """Create a StockBatch with lot/expiry/unit_cost and return it."""
+def receipt_row(product, qty, received_dt, notes_prefix, supplier=None):
+    """Build a bulk_ingest row that opens a new lot with lot/expiry/unit_cost."""
     if not HAS_BATCH:
         raise RuntimeError("StockBatch model not found. Add it to models.py and run migrations.")
     life = shelf_life_days(product.category.name)
     expiry = (received_dt.date() + timedelta(days=life))
     lot = f"{product.sku}-{received_dt.strftime('%y%m%d')}-{random.randint(100,999)}"
     unit_cost = money(Decimal(product.cost_price) * Decimal(str(random.uniform(0.95, 1.08))))
-    batch = StockBatch.objects.create(
-        product=product,
-        lot_number=lot,
-        expiry_date=expiry,
-        quantity=qty,
-        unit_cost=unit_cost,
-        supplier=supplier or product.supplier,
-        received_at=received_dt,
-    )
-    return batch
+    return {
+        'product': product,
+        'quantity': qty,
+        'unit_price': unit_cost,
+        'reference': rand_ref('PO', received_dt),
+        'notes': f"{notes_prefix} lot {lot}",
+        'lot_number': lot,
+        'expiry_date': expiry,
+        'unit_cost': unit_cost,
+        'supplier': supplier or product.supplier,
+        'received_at': received_dt,
+        'created_at': received_dt,
+    }
 
 def fefo_batch(product):
     """Earliest expiring batch with remaining quantity."""
@@ -380,6 +384,9 @@ def seed_batches_and_transactions(products):
       - Then create 4–10 mixed transactions within last 90d:
           * IN → new batch (with expiry)
           * OUT → consume the earliest-expiring batch (FEFO)
+
+    Receipts go through Transaction.objects.bulk_ingest, so all initial lots
+    for the whole catalog are posted in a handful of statements.
     """
     if not HAS_BATCH:
         raise RuntimeError("You asked to add expiries, but StockBatch model is missing.")
@@ -398,57 +405,30 @@ def seed_batches_and_transactions(products):
         'First Aid': (1, 8),
     }
 
-    txn_fields = {f.name for f in Transaction._meta.get_fields()}
-    has_txn_batch_fk = 'batch' in txn_fields  # optional FK
-
     with db_transaction.atomic():
+        # --- Initial batches (IN) before window, one bulk ingest for all products ---
+        initial_rows = []
         for p in products:
-            # Ensure inventory row exists
-            Inventory.objects.get_or_create(product=p, defaults={'quantity': 0})
-
-            # --- Initial batches (IN) before window ---
-            initial_batches = random.randint(1, 3)
-            for _ in range(initial_batches):
+            for _ in range(random.randint(1, 3)):
                 qty = random.randint(40, 150)
                 recv = random_dt_between(start_dt - timedelta(days=45), start_dt - timedelta(days=1))
-                batch = make_batch(p, qty, recv, supplier=p.supplier)
-                created_batches += 1
-
-                txn = Transaction.objects.create(
-                    product=p,
-                    transaction_type='IN',
-                    quantity=qty,
-                    unit_price=batch.unit_cost,
-                    reference=rand_ref('PO', recv),
-                    notes=f"Initial stock lot {batch.lot_number}",
-                )
-                update_kwargs = {'created_at': recv}
-                if has_txn_batch_fk:
-                    update_kwargs['batch'] = batch
-                Transaction.objects.filter(pk=txn.pk).update(**update_kwargs)
-                created_txns += 1
-
-            # --- Mixed activity inside 90d window ---
+                initial_rows.append(receipt_row(p, qty, recv, "Initial stock", supplier=p.supplier))
+        created = Transaction.objects.bulk_ingest(initial_rows)
+        created_batches += len(created)
+        created_txns += len(created)
+
+        # --- Mixed activity inside 90d window ---
+        for p in products:
             n = random.randint(4, 10)
             for _ in range(n):
                 when = random_dt_between(start_dt, end_dt)
                 if random.random() < 0.35:
                     # IN: receive new batch
                     qty = random.randint(20, 120)
-                    batch = make_batch(p, qty, when, supplier=p.supplier)
+                    Transaction.objects.bulk_ingest([
+                        receipt_row(p, qty, when, "Restock", supplier=p.supplier)
+                    ])
                     created_batches += 1
-                    txn = Transaction.objects.create(
-                        product=p,
-                        transaction_type='IN',
-                        quantity=qty,
-                        unit_price=batch.unit_cost,
-                        reference=rand_ref('PO', when),
-                        notes=f"Restock lot {batch.lot_number}",
-                    )
-                    update_kwargs = {'created_at': when}
-                    if has_txn_batch_fk:
-                        update_kwargs['batch'] = batch
-                    Transaction.objects.filter(pk=txn.pk).update(**update_kwargs)
                     created_txns += 1
                 else:
                     # OUT: sell from earliest-expiring batch
@@ -461,23 +441,18 @@ def seed_batches_and_transactions(products):
                     if qty <= 0:
                         continue
 
-                    # Reduce the batch balance first; Transaction.save will reduce Inventory
-                    batch.quantity -= qty
-                    batch.save(update_fields=['quantity'])
-
+                    # Transaction.save reduces both the batch and Inventory
                     unit_price = money(Decimal(p.unit_price) * Decimal(str(random.uniform(0.95, 1.08))))
                     txn = Transaction.objects.create(
                         product=p,
+                        batch=batch,
                         transaction_type='OUT',
                         quantity=-qty,  # negative for OUT
                         unit_price=unit_price,
                         reference=rand_ref('POS', when),
                         notes=f"Sale (FEFO lot {batch.lot_number})",
                     )
-                    update_kwargs = {'created_at': when}
-                    if has_txn_batch_fk:
-                        update_kwargs['batch'] = batch
-                    Transaction.objects.filter(pk=txn.pk).update(**update_kwargs)
+                    backdate_created_at(txn, when)
                     created_txns += 1
 
     print(f"✅ Created {created_batches} batches and {created_txns} transactions")
@@ -506,6 +481,10 @@ def main():
         print("\n🧪 Seeding batches (with expiries) and 90 days of transactions...")
         nbatches, ntxns = seed_batches_and_transactions(products)
 
+        print("\n📊 Rebuilding daily sales rollup for the backdated history...")
+        call_command('backfill_sales_rollup')
+        call_command('refresh_stock_status')
+
         print("\n" + "=" * 50)
         print("🎉 Database Population Complete!")
         print(f"✅ Products: {len(products)}")